@@ -1,6 +1,5 @@
 from core.agent_base import BaseAgent
 import json
-import time
 import datetime
 
 class AlertAgent(BaseAgent):
@@ -9,37 +8,49 @@ class AlertAgent(BaseAgent):
         self.alert_check_frequency = 300  # Check every 5 minutes
         self.alert_channels = ["system"]  # Default channel
     
-    def run(self, db_connector):
-        self.update_status(db_connector, "active")
+    def default_schedule(self):
+        return {"interval": self.alert_check_frequency}
+    
+    def run_cycle(self, db_connector):
+        # Process configuration messages
+        with self.phase("messages"):
+            messages = self.get_messages(db_connector)
+        for message in messages:
+            if message["message_type"] == "configuration":
+                config = message["content"]
+                if "alert_channels" in config:
+                    self.alert_channels = config["alert_channels"]
+            
+            # Direct anomaly messages, sent before anomalies moved to the topic
+            elif message["message_type"] == "anomalies_detected":
+                content = message["content"]
+                anomalies = content.get("anomalies", [])
+                date = content.get("date")
+                
+                for anomaly in anomalies:
+                    self.process_anomaly(db_connector, date, anomaly)
         
+        # Check for unprocessed high-severity insights (leader only, to avoid
+        # one notification per running alert agent)
+        if self.acquire_leadership(db_connector):
+            with self.phase("topics"):
+                self.consume_anomalies(db_connector)
+            self.check_unprocessed_insights(db_connector)
+    
+    def consume_anomalies(self, db_connector):
+        """Process the anomalies topic for the alert group, one batch per fenced transaction"""
         while True:
-            try:
-                # Process configuration messages
-                messages = self.get_messages(db_connector)
-                for message in messages:
-                    if message["message_type"] == "configuration":
-                        config = json.loads(message["content"])
-                        if "alert_channels" in config:
-                            self.alert_channels = config["alert_channels"]
-                    
-                    # Process anomaly notifications
-                    elif message["message_type"] == "anomalies_detected":
-                        content = json.loads(message["content"])
-                        anomalies = content.get("anomalies", [])
-                        date = content.get("date")
-                        
-                        for anomaly in anomalies:
-                            self.process_anomaly(db_connector, date, anomaly)
-                
-                # Check for unprocessed high-severity insights
-                self.check_unprocessed_insights(db_connector)
-                
-                time.sleep(self.alert_check_frequency)
-                
-            except Exception as e:
-                self.logger.error("Error in alert agent: %s", str(e))
-                self.update_status(db_connector, "error")
-                time.sleep(60)  # Wait before retrying
+            entries = self.poll_topic(db_connector, "anomalies")
+            if not entries:
+                return
+            
+            # Notifications and the cursor commit together, and not at all once leadership is lost
+            with self.fenced(db_connector):
+                for entry in entries:
+                    content = entry["content"]
+                    for anomaly in content.get("anomalies", []):
+                        self.process_anomaly(db_connector, content.get("date"), anomaly)
+                self.ack_topic(db_connector, "anomalies", entries[-1]["seq"])
     
     def process_anomaly(self, db_connector, date, anomaly):
         """Process a single anomaly and generate appropriate alerts"""
@@ -54,7 +65,7 @@ class AlertAgent(BaseAgent):
             # Create notification
             subject = f"{severity.upper()}: Unusual sales {direction} detected for {source}"
             content = (
-                f"Date: {date}\n"
+                f"Date: {anomaly.get('hour') or date}\n"  # Intraday anomalies name the hour
                 f"Source: {source}\n"
                 f"Actual: {anomaly.get('value'):.2f}\n"
                 f"Expected: {anomaly.get('expected'):.2f}\n"
@@ -85,41 +96,46 @@ class AlertAgent(BaseAgent):
         AND timestamp >= ?
         """
         
-        notifications = db_connector.query(notifications_query, (three_days_ago,))
+        with self.phase("query"):
+            # Notifications of the previous cycle may still be queued
+            db_connector.flush()
+            notifications = db_connector.query(notifications_query, (three_days_ago,))
         
-        # Extract insight IDs from notifications
-        processed_insight_ids = []
+        # Extract insight keys from notifications. Ids restart in every partition
+        # file, so an insight is identified by (id, date).
+        processed_insights = set()
         for notification in notifications:
             try:
                 message = json.loads(notification.get("message", "{}"))
                 if "insight_id" in message:
-                    processed_insight_ids.append(message["insight_id"])
+                    processed_insights.add((message["insight_id"], message.get("date")))
             except Exception as e:
                 self.logger.error("Error parsing notification message: %s", str(e))
         
         # Now get high severity insights from the last 3 days
-        query = """
-        SELECT id, date, insight_type, description, severity, metrics
-        FROM sales_insights
-        WHERE severity = 'high' AND date >= ?
-        """
-        
-        insights = db_connector.query(query, (three_days_ago,))
-        
+        with self.phase("query"):
+            insights = db_connector.query_range(
+                "sales_insights", "id, date, insight_type, description, severity, metrics",
+                three_days_ago, current_date, where="severity = 'high'"
+            )
         
         # Filter out already processed insights
-        unprocessed_insights = [insight for insight in insights if insight["id"] not in processed_insight_ids]
+        unprocessed_insights = [
+            insight for insight in insights
+            if (insight["id"], insight["date"]) not in processed_insights
+        ]
         
-        for insight in unprocessed_insights:
-            subject = f"HIGH PRIORITY INSIGHT: {insight['insight_type']} on {insight['date']}"
-            content = json.dumps({
-                "insight_id": insight["id"],
-                "date": insight["date"],
-                "description": insight["description"],
-                "metrics": insight["metrics"]
-            })
-            
-            self.create_notification(db_connector, "insight_notification", subject, content)
+        with self.phase("notify"):
+            for insight in unprocessed_insights:
+                subject = f"HIGH PRIORITY INSIGHT: {insight['insight_type']} on {insight['date']}"
+                content = json.dumps({
+                    "insight_id": insight["id"],
+                    "date": insight["date"],
+                    "description": insight["description"],
+                    "metrics": insight["metrics"]
+                })
+                
+                self.create_notification(db_connector, "insight_notification", subject, content)
     
     def create_notification(self, db_connector, notification_type, subject, content):
         """Create a system notification"""
@@ -128,8 +144,9 @@ class AlertAgent(BaseAgent):
         VALUES (?, ?, ?, 0)
         """
         
-        # Use 'high' severity for all notifications for simplicity
-        notification_id = db_connector.execute(query, (notification_type, content, "high"))
-        self.logger.info("Created notification: %s (ID: %s)", subject, notification_id)
+        # Use 'high' severity for all notifications for simplicity. Returns a future of the
+        # notification id, since the insert may be batched by the write-behind queue.
+        notification = db_connector.execute_deferred(query, (notification_type, content, "high"))
+        self.logger.info("Created notification: %s", subject)
         
-        return notification_id
\ No newline at end of file
+        return notification
\ No newline at end of file
@@ -3,27 +3,27 @@ import json
 import datetime
 import statistics
 from core.agent_base import BaseAgent
+from core.baselines import BaselineStore, MAD_SCALE
+from core.metric_points import MetricPointStore, BUCKET_FORMAT
+from core.anomaly_backfill import AnomalyBackfill
+from core.series_cache import series_cache
+from config.settings import ANALYTICS_CONFIG, INGESTION_CONFIG
 
 class AnalyticsAgent(BaseAgent):
     def __init__(self, agent_id=None):
         super().__init__(agent_id, "analytics")
         self.analysis_frequency = 3600  # Hourly analysis
         self.anomaly_threshold = 2.0  # Z-score threshold for anomalies
+        self.detector = ANALYTICS_CONFIG.get("detector", "zscore")  # zscore or seasonal
+        self.baselines = None
+        self.points = None
     
-    def run(self, db_connector):
-        self.update_status(db_connector, "active")
-        self.logger.info("Analytics agent started")
-        
-        try:
-            # Analyze historical data
-            self.analyze_historical_data(db_connector)
-            
-            # Update status to inactive since we're done
-            self.update_status(db_connector, "inactive")
-            
-        except Exception as e:
-            self.logger.error("Error in analytics agent: %s", str(e))
-            self.update_status(db_connector, "error")
+    def default_schedule(self):
+        return {"interval": self.analysis_frequency}
+    
+    def run_cycle(self, db_connector):
+        # Analyze historical data
+        self.analyze_historical_data(db_connector)
     
     def analyze_historical_data(self, db_connector):
         """Analyze historical sales data to detect patterns and anomalies"""
@@ -34,68 +34,78 @@ class AnalyticsAgent(BaseAgent):
         start_date = (current_date - datetime.timedelta(days=30)).strftime("%Y-%m-%d")
         end_date = current_date.strftime("%Y-%m-%d")
         
-        # Get sales data for analysis
-        query = """
-        SELECT date, source, metric_type, value
-        FROM sales_metrics
-        WHERE date >= ? AND date <= ?
-        ORDER BY date ASC
-        """
-        
-        sales_data = db_connector.query(query, (start_date, end_date))
-        
-        # Group data by source and metric type
-        grouped_data = {}
-        for record in sales_data:
-            source = record["source"]
-            metric_type = record["metric_type"]
-            date = record["date"]
-            value = record["value"]
-            
-            if source not in grouped_data:
-                grouped_data[source] = {}
-                
-            if metric_type not in grouped_data[source]:
-                grouped_data[source][metric_type] = {}
-                
-            grouped_data[source][metric_type][date] = value
+        # Recent series come from the process-wide cache, kept current by ingestion, instead
+        # of a scan of sales_metrics every cycle
+        cache = series_cache(db_connector)
+        with self.phase("read"):
+            keys = cache.keys(db_connector)
         
-        # Detect anomalies
+        # Detect anomalies, only for the sources assigned to this worker
         anomalies = []
-        for source in grouped_data:
-            for metric_type in grouped_data[source]:
-                if metric_type == "total_sales":  # Focus on sales anomalies
-                    time_series = []
-                    dates = []
-                    
-                    # Convert to time series
-                    for date in sorted(grouped_data[source][metric_type].keys()):
-                        dates.append(date)
-                        time_series.append(grouped_data[source][metric_type][date])
+        with self.phase("detect"):
+            owned = set(self.owned_keys(db_connector, sorted({source for source, _ in keys})))
+            for source, metric_type in keys:
+                if source in owned and metric_type == "total_sales":  # Focus on sales anomalies
+                    # Dates in order, values as an array('d')
+                    dates, time_series = cache.window(db_connector, source, metric_type, start_date, end_date)
                     
+                    if self.detector == "seasonal":
+                        # Compare against the same weekday in previous weeks
+                        anomalies.extend(self._detect_seasonal_anomalies(
+                            db_connector, source, metric_type, dates, time_series, current_date
+                        ))
                     # Need at least 7 data points for meaningful analysis
-                    if len(time_series) >= 7:
+                    elif len(time_series) >= 7:
                         # Detect anomalies using z-score
                         anomalies.extend(self._detect_anomalies(
                             source, metric_type, dates, time_series
                         ))
         
-        # Send anomalies to alert agent if any found
+        # Hour-level check, when intraday points are being collected
+        if INGESTION_CONFIG.get("resolution", 86400) < 86400:
+            with self.phase("intraday"):
+                anomalies.extend(self._detect_intraday_anomalies(db_connector, datetime.datetime.now()))
+        
+        # Publish anomalies once; every subscribed group reads them through its own cursor
         if anomalies:
-            alert_agent_ids = self._find_alert_agents(db_connector)
-            
-            for alert_agent_id in alert_agent_ids:
-                self.send_message(
-                    db_connector,
-                    alert_agent_id,
-                    "anomalies_detected",
-                    {
-                        "anomalies": anomalies,
-                        "date": current_date.strftime("%Y-%m-%d")
-                    }
-                )
+            with self.phase("notify"), db_connector.transaction():
+                # Anomalies already published by an earlier cycle (or before a restart) are
+                # skipped; the record is saved together with the publish
+                published = self.load_checkpoint(db_connector, "published", {})
+                new_anomalies = [a for a in anomalies if self._anomaly_key(a) not in published]
                 
-            self.logger.info("Sent %d anomalies to alert agent", len(anomalies))
+                if new_anomalies:
+                    self.publish(
+                        db_connector,
+                        "anomalies",
+                        "anomalies_detected",
+                        {
+                            "anomalies": new_anomalies,
+                            "date": current_date.strftime("%Y-%m-%d")
+                        }
+                    )
+                    
+                    # Keys of dates before the analysis window can never come up again
+                    published = {key: date for key, date in published.items() if date >= start_date}
+                    published.update((self._anomaly_key(a), a["date"]) for a in new_anomalies)
+                    self.save_checkpoint(db_connector, published, "published")
+                
+                self.logger.info(
+                    "Published %d anomalies (%d already sent)", len(new_anomalies), len(anomalies) - len(new_anomalies)
+                )
+    
+    def backfill_anomalies(self, db_connector, start_date, end_date=None, threshold=None, workers=None):
+        """Recompute anomalies over any stretch of history into sales_insights, one pass per series"""
+        end_date = end_date or datetime.datetime.now().strftime("%Y-%m-%d")
+        backfill = AnomalyBackfill(db_connector, threshold=threshold or self.anomaly_threshold)
+        return backfill.run(start_date, end_date, workers=workers)
+    
+    def _anomaly_key(self, anomaly):
+        """Identity of an anomaly across cycles: series, day or hour, and detector"""
+        return "|".join((
+            anomaly["source"], anomaly["metric_type"], anomaly.get("hour") or anomaly["date"],
+            anomaly.get("detector", "zscore")
+        ))
     
     def _detect_anomalies(self, source, metric_type, dates, values):
         """Detect anomalies in a time series using z-score"""
@@ -130,13 +140,94 @@ class AnalyticsAgent(BaseAgent):
         
         return anomalies
     
-    def _find_alert_agents(self, db_connector):
-        """Find active alert agents"""
-        query = """
-        SELECT agent_id
-        FROM agent_registry
-        WHERE agent_type = 'alert' AND status = 'active'
-        """
-        
-        agents = db_connector.query(query, ())
-        return [agent["agent_id"] for agent in agents]
\ No newline at end of file
+    def _detect_seasonal_anomalies(self, db_connector, source, metric_type, dates, values, current_date):
+        """Detect anomalies against per-weekday baselines, then fold completed days into them"""
+        if self.baselines is None:
+            self.baselines = BaselineStore(db_connector)
+        
+        anomalies = []
+        today = current_date.strftime("%Y-%m-%d")
+        recent = set(dates[-3:])  # Same scoring window as the z-score detector
+        
+        for date, value in zip(dates, values):
+            last_date = self.baselines.last_date(source, metric_type, date)
+            if last_date is not None and date <= last_date:
+                continue  # Already part of the baseline, and scored when it arrived
+            
+            # Score before folding in, so a day is never compared with itself
+            if date in recent:
+                scored = self.baselines.score(source, metric_type, date, value)
+                if scored is not None and abs(scored[0]) >= self.anomaly_threshold:
+                    z_score, expected = scored
+                    anomalies.append({
+                        "date": date,
+                        "source": source,
+                        "type": "sales_anomaly",
+                        "metric_type": metric_type,
+                        "value": value,
+                        "expected": expected,
+                        "z_score": z_score,
+                        "detector": "seasonal"
+                    })
+            
+            # Today's figures may still change, so only finished days update the baseline
+            if date < today:
+                self.baselines.observe(source, metric_type, date, value)
+        
+        self.baselines.flush()
+        return anomalies
+    
+    def _detect_intraday_anomalies(self, db_connector, now):
+        """Compare the last complete hour with the same hour of the day on previous days"""
+        if self.points is None:
+            self.points = MetricPointStore(db_connector)
+        
+        hour_end = now.replace(minute=0, second=0, microsecond=0)
+        hour_start = hour_end - datetime.timedelta(hours=1)
+        history_start = hour_start - datetime.timedelta(days=INGESTION_CONFIG.get("intraday_days", 14))
+        min_samples = INGESTION_CONFIG.get("intraday_min_samples", 5)
+        current = hour_start.strftime(BUCKET_FORMAT)
+        
+        # source -> {hour_start: total}, only for this hour of the day, so one small read
+        series = {}
+        for source, hour, value in self.points.hourly_series(
+            "total_sales", history_start.strftime(BUCKET_FORMAT), hour_end.strftime(BUCKET_FORMAT),
+            hour=hour_start.hour
+        ):
+            series.setdefault(source, {})[hour] = value
+        
+        anomalies = []
+        for source in self.owned_keys(db_connector, sorted(series)):
+            if current not in series[source]:
+                continue
+            value = series[source].pop(current)
+            history = list(series[source].values())
+            if len(history) < min_samples:
+                continue
+            
+            # Median/MAD like the seasonal detector, mean/stdev when the MAD is zero
+            expected = statistics.median(history)
+            mad = statistics.median(abs(sample - expected) for sample in history)
+            if mad:
+                z_score = MAD_SCALE * (value - expected) / mad
+            else:
+                stdev = statistics.stdev(history)
+                if not stdev:
+                    continue
+                expected = statistics.mean(history)
+                z_score = (value - expected) / stdev
+            
+            if abs(z_score) >= self.anomaly_threshold:
+                anomalies.append({
+                    "date": hour_start.strftime("%Y-%m-%d"),
+                    "hour": current,
+                    "source": source,
+                    "type": "sales_anomaly",
+                    "metric_type": "total_sales",
+                    "value": value,
+                    "expected": expected,
+                    "z_score": z_score,
+                    "detector": "intraday"
+                })
+        
+        return anomalies
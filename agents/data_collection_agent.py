@@ -1,35 +1,67 @@
-import time
 import random
 import datetime
 from core.agent_base import BaseAgent
+from core.metric_points import MetricPointStore
+from core.checkpoints import dates_after
+from core.sketches import SketchStore, HyperLogLog, KLLSketch, CLIENTS, ORDER_VALUE
+from config.settings import INGESTION_CONFIG, CHECKPOINT_CONFIG, SKETCH_CONFIG
+
+SOURCES = ["web", "mobile", "store", "partner"]
 
 class DataCollectionAgent(BaseAgent):
     def __init__(self, agent_id=None):
         super().__init__(agent_id, "data_collection")
-        self.collection_frequency = 86400  # Daily collection
+        # Daily collection, or one cycle per bucket when intraday points are enabled
+        self.collection_frequency = INGESTION_CONFIG.get("resolution", 86400)
+        self.points = None
+        self.sketches = None
+    
+    def default_schedule(self):
+        return {"interval": self.collection_frequency}
     
-    def run(self, db_connector):
-        self.update_status(db_connector, "active")
-        
-        while True:
-            try:
-                # Get current date
-                current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-                self.logger.info("Collecting sales data for %s", current_date)
-                
-                # Collect sales data for current date
-                records = self.collect_sales_data(db_connector, current_date)
-                self.logger.info("Collected and stored sales data for %s (%d records)", current_date, records)
-                
-                # Sleep until next collection time
-                time.sleep(self.collection_frequency)
-                
-            except Exception as e:
-                self.logger.error("Error in data collection: %s", str(e))
-                self.update_status(db_connector, "error")
-                time.sleep(60)  # Wait before retrying
+    def run_cycle(self, db_connector):
+        if self.collection_frequency < 86400:
+            return self.collect_intraday_data(db_connector, datetime.datetime.now())
+        
+        # Get current date
+        current_date = datetime.datetime.now().strftime("%Y-%m-%d")
+        
+        # Last collected date per source; a restart on the same day collects nothing, a gap
+        # of a few days is filled in, and a source seen for the first time starts today
+        yesterday = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        collected = self.load_checkpoint(db_connector, "daily", {})
+        last = {source: collected.get(source, yesterday) for source in self.owned_keys(db_connector, SOURCES)}
+        max_days = CHECKPOINT_CONFIG.get("max_catch_up_days", 7)
+        
+        partitioned = db_connector.partitions and db_connector.partitions.is_partitioned("sales_metrics")
+        
+        records = 0
+        for date in dates_after(min(last.values(), default=current_date), current_date, max_days):
+            due = [source for source, last_date in last.items() if last_date < date]
+            self.logger.info("Collecting sales data for %s", date)
+            if partitioned:
+                # Partitions cannot be attached inside a transaction: the rows are written
+                # immediately (not queued) and the checkpoint after them; a crash in between
+                # collects the day again, which the upsert makes harmless
+                records += self.collect_sales_data(db_connector, date, due, deferred=False)
+                self._save_daily_checkpoint(db_connector, date, due)
+            else:
+                # Rows and checkpoint commit together; inside a transaction, deferred writes
+                # run immediately instead of going to the write-behind queue
+                with db_connector.transaction():
+                    records += self.collect_sales_data(db_connector, date, due)
+                    self._save_daily_checkpoint(db_connector, date, due)
+        
+        self.logger.info("Collected and stored sales data up to %s (%d records)", current_date, records)
+        return records
     
-    def collect_sales_data(self, db_connector, date):
+    def _save_daily_checkpoint(self, db_connector, date, sources):
+        with db_connector.transaction():
+            collected = self.load_checkpoint(db_connector, "daily", {})
+            collected.update((source, date) for source in sources if collected.get(source, "") < date)
+            self.save_checkpoint(db_connector, collected, "daily")
+    
+    def collect_sales_data(self, db_connector, date, sources=None, deferred=True):
         query = """
         SELECT 
             ? as date,
@@ -46,8 +78,9 @@ class DataCollectionAgent(BaseAgent):
         # This would normally query a real orders table
         # For demo purposes, we'll simulate data
         
-        # Define sources
-        sources = ["web", "mobile", "store", "partner"]
+        # Define sources, keeping only those assigned to this worker
+        if sources is None:
+            sources = self.owned_keys(db_connector, SOURCES)
         
         # Get day of week (0 = Monday, 6 = Sunday)
         day_of_week = datetime.datetime.strptime(date, "%Y-%m-%d").weekday()
@@ -64,7 +97,8 @@ class DataCollectionAgent(BaseAgent):
         multiplier = max(weekend_multiplier, friday_multiplier)
         
         # Store metrics for each source
-        record_count = 0
+        rows = []
+        sketches = {}
         
         for source in sources:
             # Generate random variations for each source
@@ -85,12 +119,94 @@ class DataCollectionAgent(BaseAgent):
             }
             
             for metric_type, value in metrics.items():
-                insert_query = """
-                INSERT INTO sales_metrics (date, source, metric_type, value)
-                VALUES (?, ?, ?, ?)
-                """
-                
-                db_connector.execute(insert_query, (date, source, metric_type, value))
-                record_count += 1
-        
-        return record_count
\ No newline at end of file
+                rows.append((date, source, metric_type, value))
+            
+            sketches[source] = self._order_sketches(total_orders, unique_customers, total_sales)
+        
+        if self.sketches is None:
+            self.sketches = SketchStore(db_connector)
+        with self.phase("sketches"):
+            if deferred:
+                for source, day_sketches in sketches.items():
+                    self.sketches.save(date, source, day_sketches)
+            else:
+                # A transaction makes the sketch writes run now rather than queue
+                with db_connector.transaction():
+                    for source, day_sketches in sketches.items():
+                        self.sketches.save(date, source, day_sketches)
+        
+        # One batch upsert, routed to the date's partition when partitioning is enabled.
+        # A re-run for the same day overwrites that day's values instead of duplicating them.
+        # deferred=False commits the rows before returning, even with write_behind enabled.
+        with self.phase("insert"):
+            return db_connector.insert_rows(
+                "sales_metrics", ("date", "source", "metric_type", "value"), rows,
+                deferred=deferred, update_on=("date", "source", "metric_type")
+            )
+    
+    def collect_intraday_data(self, db_connector, timestamp):
+        """Record one bucket of points and refresh today's daily rows from them"""
+        if self.points is None:
+            self.points = MetricPointStore(db_connector)
+        
+        bucket = self.points.bucket_start(timestamp)
+        sources = self.owned_keys(db_connector, SOURCES)
+        
+        day_of_week = timestamp.weekday()
+        multiplier = 3.0 if day_of_week >= 5 else 2.0 if day_of_week == 4 else 1.0
+        # Share of a day's volume that falls into one bucket
+        fraction = self.points.resolution / 86400
+        
+        points = []
+        sketches = {}
+        for source in sources:
+            scale = multiplier * random.uniform(0.8, 1.2) * fraction
+            # Counts are rounded at random so small buckets still average out to the daily volume
+            metrics = {
+                "total_sales": round(5000 * scale, 2),
+                "total_orders": int(120 * scale + random.random()),
+                "unique_customers": int(100 * scale + random.random())
+            }
+            for metric_type, value in metrics.items():
+                points.append((timestamp, source, metric_type, value))
+            sketches[source] = self._order_sketches(
+                metrics["total_orders"], metrics["unique_customers"], metrics["total_sales"]
+            )
+        
+        if self.sketches is None:
+            self.sketches = SketchStore(db_connector)
+        date = timestamp.strftime("%Y-%m-%d")
+        
+        # Points are added to their bucket, so a bucket recorded before a restart must not be
+        # recorded again; the per-source checkpoint commits with the points
+        with self.phase("record"), db_connector.transaction():
+            collected = self.load_checkpoint(db_connector, "intraday", {})
+            due = [source for source in sources if collected.get(source, "") < bucket]
+            recorded = self.points.record([point for point in points if point[1] in due])
+            # The day's sketches absorb each bucket, like the points do
+            for source in due:
+                self.sketches.save(date, source, sketches[source], merge=True)
+            collected.update((source, bucket) for source in due)
+            self.save_checkpoint(db_connector, collected, "intraday")
+        
+        # Day-level readers keep using sales_metrics, which holds today's running totals
+        with self.phase("refresh_daily"):
+            self.points.refresh_daily(date, sources)
+        self.logger.info("Recorded %d points for bucket %s", recorded, bucket)
+        return recorded
+    
+    def _order_sketches(self, total_orders, unique_customers, total_sales):
+        """Sketches of simulated orders matching a source's figures: who ordered, and for how much"""
+        # Customers come from one shared pool, so the same client recurs across days and sources
+        pool = SKETCH_CONFIG.get("client_pool", 2000)
+        clients = random.sample(range(pool), min(unique_customers, pool, total_orders))
+        order_clients = clients + random.choices(clients, k=total_orders - len(clients)) if clients else []
+        
+        # Skewed order values that add up to the day's sales
+        weights = [random.lognormvariate(0, 0.6) for _ in order_clients]
+        scale = total_sales / sum(weights) if weights else 0
+        
+        return {
+            CLIENTS: HyperLogLog().update(f"client_{client}" for client in order_clients),
+            ORDER_VALUE: KLLSketch().update(weight * scale for weight in weights)
+        }
@@ -0,0 +1,42 @@
+from core.agent_base import BaseAgent
+from core.retention import RetentionManager
+from core.metric_points import MetricPointStore
+from config.settings import RETENTION_CONFIG
+
+class MaintenanceAgent(BaseAgent):
+    def __init__(self, agent_id=None):
+        super().__init__(agent_id, "maintenance")
+        self.maintenance_frequency = RETENTION_CONFIG.get("interval", 3600)
+        self.retention = None
+        self.points = None
+
+    def default_schedule(self):
+        return {"interval": self.maintenance_frequency}
+
+    def run_cycle(self, db_connector):
+        return self.run_maintenance(db_connector)
+
+    def run_maintenance(self, db_connector):
+        """Run one retention and compaction pass and log its metrics"""
+        if self.retention is None:
+            self.retention = RetentionManager(db_connector)
+            self.points = MetricPointStore(db_connector)
+
+        # Only one worker compacts the shared database at a time
+        if not self.acquire_leadership(db_connector):
+            self.logger.info("Another maintenance agent holds the lease; skipping pass")
+            return None
+
+        with self.phase("retention"):
+            summary = self.retention.run()
+        with self.phase("compaction"):
+            summary["points"] = self.points.compact()
+
+        removed = sum(table["deleted"] for table in summary["tables"].values())
+        archived = sum(table["archived"] for table in summary["tables"].values())
+        self.logger.info(
+            "Maintenance pass finished in %.2fs: %d rows removed, %d archived, %d pages freed",
+            summary["seconds"], removed, archived, summary["pages_freed"]
+        )
+
+        return summary
@@ -3,7 +3,19 @@ import json
 import time
 import random
 import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from core.agent_base import BaseAgent
+from core.report_catalog import ReportCatalog
+from core.report_planner import ReportPlanner, PeriodAggregator
+from core.checkpoints import dates_after
+from config.settings import CHECKPOINT_CONFIG, REPORT_CONFIG
+
+# Report files get the mode open() would give them. The umask can only be read by setting
+# it, which is process-wide, so it is read once here rather than from the writer threads.
+_umask = os.umask(0o022)
+os.umask(_umask)
+_REPORT_MODE = 0o666 & ~_umask
 
 class ReportingAgent(BaseAgent):
     def __init__(self, agent_id=None):
@@ -15,14 +27,31 @@ class ReportingAgent(BaseAgent):
         # Create reports directory if it doesn't exist
         self.report_directory = "reports"
         os.makedirs(self.report_directory, exist_ok=True)
+        self.catalog = None
+    
+    def default_schedule(self):
+        # Daily at daily_report_time, e.g. "08:00" -> cron "0 8 * * *"
+        hour, minute = self.daily_report_time.split(":")
+        return {"cron": f"{int(minute)} {int(hour)} * * *"}
     
-    def run(self, db_connector):
-        self.update_status(db_connector, "active")
+    def run_cycle(self, db_connector):
+        # Reports are a singleton role: only the lease holder generates them
+        if not self.acquire_leadership(db_connector):
+            self.logger.info("Another reporting agent holds the lease; skipping report generation")
+            return
+        
+        # Resume from the last archived report of each type instead of regenerating it
+        generated = self.load_checkpoint(db_connector, "reports", {})
+        reports = []
         
-        # Generate yesterday's report on startup
+        # Daily reports up to yesterday, including days missed while no agent was running;
+        # without a checkpoint only yesterday's is generated
         yesterday = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-        self.logger.info("Generating daily report for %s", yesterday)
-        self.generate_daily_report(db_connector, yesterday)
+        last_daily = generated.get("daily") or (
+            datetime.datetime.now() - datetime.timedelta(days=2)
+        ).strftime("%Y-%m-%d")
+        for date in dates_after(last_daily, yesterday, CHECKPOINT_CONFIG.get("max_catch_up_days", 7)):
+            reports.append(("daily", date, date))
         
         # Check if we need to generate weekly or monthly reports
         today = datetime.datetime.now().date()
@@ -31,7 +60,8 @@ class ReportingAgent(BaseAgent):
         if today.weekday() == self.weekly_report_day:
             end_date = (today - datetime.timedelta(days=1)).strftime("%Y-%m-%d")  # Yesterday
             start_date = (today - datetime.timedelta(days=7)).strftime("%Y-%m-%d")  # 7 days ago
-            self.generate_weekly_report(db_connector, start_date, end_date)
+            if generated.get("weekly", "") < end_date:
+                reports.append(("weekly", start_date, end_date))
         
         # If today is the monthly report day, generate last month's report
         if today.day == self.monthly_report_day:
@@ -44,269 +74,219 @@ class ReportingAgent(BaseAgent):
                 end_date = datetime.date(last_month_year, 12, 31)
             else:
                 end_date = datetime.date(last_month_year, last_month + 1, 1) - datetime.timedelta(days=1)
-                
-            self.generate_monthly_report(db_connector, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+            
+            if generated.get("monthly", "") < end_date.strftime("%Y-%m-%d"):
+                reports.append(("monthly", start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
         
-        # Sleep until tomorrow
-        self.logger.info("Reports generated. Sleeping until next reporting cycle.")
+        # Overlapping periods (e.g. on the 1st: yesterday, last week, last month) share one scan
+        self.generate_reports(db_connector, reports)
         
-        # In a real system, we would calculate the time until the next report
-        # and sleep until then. For simplicity, we'll just exit.
-        return
+        # The central scheduler triggers the next cycle at daily_report_time
+        self.logger.info("Reports generated. Waiting for next reporting cycle.")
     
     def generate_daily_report(self, db_connector, date):
         """Generate a daily sales report"""
-        try:
-            # Get sales metrics for the day
-            query = """
-            SELECT 
-                source,
-                metric_type,
-                value
-            FROM sales_metrics
-            WHERE date = ?
-            """
-            
-            sales_data = db_connector.query(query, (date,))
-            
-            # Get insights for the day
-            insights_query = """
-            SELECT insight_type, description, severity
-            FROM sales_insights
-            WHERE date = ?
-            """
-            
-            insights = db_connector.query(insights_query, (date,))
-            
-            # Process sales metrics
-            metrics = self._process_sales_metrics(sales_data)
-            
-            # Generate report content
-            report_data = {
-                "date": date,
-                "sales_data": sales_data,
-                "insights": insights,
-                "metrics": metrics
-            }
-            
-            # Save report to file
-            report_file_path = os.path.join(self.report_directory, f"daily_report_{date}.json")
-            with open(report_file_path, 'w') as f:
-                json.dump(report_data, f, indent=2)
-            
-            # Store report reference in database
-            store_query = """
-            INSERT INTO report_archive (
-                report_type, generated_at, file_path, parameters
-            ) VALUES (?, CURRENT_TIMESTAMP, ?, ?)
-            """
-            
-            parameters = json.dumps({
-                "date": date,
-                "report_id": f"daily_{date}"
-            })
-            
-            archive_id = db_connector.execute(store_query, (
-                "daily",
-                report_file_path,
-                parameters
-            ))
-            
-            self.logger.info("Daily report archived with ID: %s", archive_id)
-            return {
-                "status": "success",
-                "report_id": f"daily_{date}",
-                "archive_id": archive_id,
-                "file_path": report_file_path
-            }
-            
-        except Exception as e:
-            self.logger.error("Error generating daily report: %s", str(e))
-            return {
-                "status": "error",
-                "date": date,
-                "error": str(e)
-            }
+        return self.generate_reports(db_connector, [("daily", date, date)])[0]
     
     def generate_weekly_report(self, db_connector, start_date, end_date):
         """Generate a weekly sales report"""
-        self.logger.info("Generating weekly report for %s to %s", start_date, end_date)
+        return self.generate_reports(db_connector, [("weekly", start_date, end_date)])[0]
+    
+    def generate_monthly_report(self, db_connector, start_date, end_date):
+        """Generate a monthly sales report"""
+        return self.generate_reports(db_connector, [("monthly", start_date, end_date)])[0]
+    
+    def generate_reports(self, db_connector, reports, workers=None, failed=None):
+        """
+        Generate several reports, reading the data of overlapping periods in one shared scan
         
-        try:
-            # Get sales data for the week
-            query = """
-            SELECT 
-                source,
-                metric_type,
-                value,
-                date
-            FROM sales_metrics
-            WHERE date >= ? AND date <= ?
-            ORDER BY date ASC
-            """
-            
-            sales_data = db_connector.query(query, (start_date, end_date))
-            
-            # Get top insights for the week
-            insights_query = """
-            SELECT insight_type, description, severity, date
-            FROM sales_insights
-            WHERE date >= ? AND date <= ?
-            ORDER BY severity DESC, date DESC
-            LIMIT 10
-            """
-            
-            insights = db_connector.query(insights_query, (start_date, end_date))
-            
-            # Process sales data to get weekly metrics
-            weekly_metrics = self._process_weekly_metrics(sales_data)
-            
-            # Generate report content
+        Args:
+            reports (list): (report_type, start_date, end_date) tuples
+            workers (int): report files written in parallel, REPORT_CONFIG write_workers by default
+            failed (set): report types that already failed earlier in this run; updated in place
+        
+        Returns:
+            list: one result dict per report, in the order given
+        """
+        planner = ReportPlanner(db_connector)
+        workers = workers or REPORT_CONFIG.get("write_workers", 4)
+        results = {}
+        # Reports are archived oldest first; once one of a type fails, later ones of that type
+        # no longer move its checkpoint, so the failed period is generated again next run
+        failed = set() if failed is None else failed
+        
+        for batch in planner.batches(reports):
+            for report_type, start_date, end_date in batch:
+                self.logger.info("Generating %s report for %s to %s", report_type, start_date, end_date)
+            
+            try:
+                # One read-only snapshot over the union of the batch's periods
+                with self.phase("query"):
+                    aggregators = planner.scan(batch)
+                
+                with self.phase("process"):
+                    built = [self._build_report(report, aggregators[report]) for report in batch]
+            except Exception as e:
+                for report in batch:
+                    results[report] = self._report_error(report, e)
+                    failed.add(report[0])
+                continue
+            
+            # Report files do not depend on each other, so they are written in parallel
+            with self.phase("write"), ThreadPoolExecutor(max_workers=workers) as pool:
+                write_errors = list(pool.map(self._write_report, built))
+            
+            # Archived one by one on this thread, each in its own fenced transaction
+            for report, (report_data, file_path, parameters), error in zip(batch, built, write_errors):
+                if error is not None:
+                    results[report] = self._report_error(report, error)
+                    failed.add(report[0])
+                    continue
+                
+                try:
+                    archive_id = self._archive_report(
+                        db_connector, report[0], report[1], report[2], file_path, parameters,
+                        advance=report[0] not in failed
+                    )
+                except Exception as e:
+                    results[report] = self._report_error(report, e)
+                    failed.add(report[0])
+                    continue
+                
+                self.logger.info("%s report archived with ID: %s", report[0].capitalize(), archive_id)
+                results[report] = self._report_result(report, parameters, archive_id, file_path)
+        
+        return [results[report] for report in reports]
+    
+    def backfill_reports(self, db_connector, start_date, end_date, report_types=None, workers=None):
+        """
+        Regenerate every report whose period lies in a past date range
+        
+        Reports are grouped so each group is read in one scan, and their files are written
+        in parallel. The lease is renewed before each group.
+        
+        Returns:
+            list: one result dict per report, oldest period first
+        """
+        planner = ReportPlanner(db_connector)
+        reports = planner.plan(start_date, end_date, report_types, self.weekly_report_day)
+        self.logger.info("Backfilling %d reports from %s to %s", len(reports), start_date, end_date)
+        
+        results = []
+        failed = set()
+        for batch in planner.batches(reports):
+            if not self.acquire_leadership(db_connector):
+                self.logger.warning("Another reporting agent holds the lease; stopping the report backfill")
+                break
+            results.extend(self.generate_reports(db_connector, batch, workers, failed))
+        return results
+    
+    def _build_report(self, report, aggregator):
+        """(report_data, file_path, parameters) of a report from its aggregator"""
+        report_type, start_date, end_date = report
+        
+        if report_type == "daily":
+            report_data = {
+                "date": start_date,
+                "sales_data": aggregator.sales_data,
+                "insights": aggregator.insights,
+                "metrics": self._process_sales_metrics(aggregator.sales_data)
+            }
+            file_name = f"daily_report_{start_date}.json"
+            parameters = {
+                "date": start_date,
+                "report_id": f"daily_{start_date}"
+            }
+        else:
             report_data = {
                 "period": {
                     "start": start_date,
                     "end": end_date
                 },
-                "sales_data": weekly_metrics,
-                "insights": insights
+                "sales_data": aggregator.metrics(),
+                "insights": aggregator.top_insights()
             }
-            
-            # Generate report artifact
-            artifact_id = f"weekly_report_{start_date}_to_{end_date}_{random.randint(1000, 9999)}"
-            
-            # Store report reference
-            report_id = f"weekly_{start_date}_to_{end_date}"
-            store_query = """
-            INSERT INTO report_archive (
-                report_type, generated_at, file_path, parameters
-            ) VALUES (?, CURRENT_TIMESTAMP, ?, ?)
-            """
-            
-            # Create report file path
-            report_file_path = os.path.join(self.report_directory, f"weekly_report_{start_date}_to_{end_date}.json")
-            
-            # Save report data to file
-            with open(report_file_path, 'w') as f:
-                json.dump(report_data, f, indent=2)
-            
-            # Store report reference in database
-            parameters = json.dumps({
+            file_name = f"{report_type}_report_{start_date}_to_{end_date}.json"
+            parameters = {
                 "start_date": start_date,
                 "end_date": end_date,
-                "report_id": report_id
-            })
-            
-            archive_id = db_connector.execute(store_query, (
-                "weekly",
-                report_file_path,
-                parameters
-            ))
-            
-            self.logger.info("Weekly report archived with ID: %s", archive_id)
-            return {
-                "status": "success",
-                "report_id": report_id,
-                "archive_id": archive_id,
-                "artifact_id": artifact_id
-            }
-            
-        except Exception as e:
-            self.logger.error("Error generating weekly report: %s", str(e))
-            return {
-                "status": "error",
-                "period": {"start": start_date, "end": end_date},
-                "error": str(e)
+                "report_id": f"{report_type}_{start_date}_to_{end_date}"
             }
+        
+        return report_data, os.path.join(self.report_directory, file_name), parameters
     
-    def generate_monthly_report(self, db_connector, start_date, end_date):
-        """Generate a monthly sales report"""
-        self.logger.info("Generating monthly report for %s to %s", start_date, end_date)
+    def _write_report(self, built):
+        """Save one report file; returns the exception instead of raising it
         
+        Written to a temporary file and renamed over the old one, so a reader that has the
+        old file mapped keeps its contents instead of seeing it truncated.
+        """
+        report_data, file_path, _ = built
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", suffix=".tmp")
         try:
-            # Get sales data for the month
-            query = """
-            SELECT 
-                source,
-                metric_type,
-                value,
-                date
-            FROM sales_metrics
-            WHERE date >= ? AND date <= ?
-            ORDER BY date ASC
-            """
-            
-            sales_data = db_connector.query(query, (start_date, end_date))
-            
-            # Get insights for the month
-            insights_query = """
-            SELECT insight_type, description, severity, date
-            FROM sales_insights
-            WHERE date >= ? AND date <= ?
-            ORDER BY severity DESC, date DESC
-            """
-            
-            insights = db_connector.query(insights_query, (start_date, end_date))
-            
-            # Process monthly data
-            # Similar to weekly processing but with additional month-specific metrics
-            monthly_metrics = self._process_weekly_metrics(sales_data)  # Reuse weekly processing
-            
-            # Generate report content
-            report_data = {
-                "period": {
-                    "start": start_date,
-                    "end": end_date
-                },
-                "sales_data": monthly_metrics,
-                "insights": insights
-            }
-            
-            # Generate report artifact
-            artifact_id = f"monthly_report_{start_date}_to_{end_date}_{random.randint(1000, 9999)}"
-            
-            # Store report reference
-            report_id = f"monthly_{start_date}_to_{end_date}"
-            store_query = """
-            INSERT INTO report_archive (
-                report_type, generated_at, file_path, parameters
-            ) VALUES (?, CURRENT_TIMESTAMP, ?, ?)
-            """
-            
-            # Create report file path
-            report_file_path = os.path.join(self.report_directory, f"monthly_report_{start_date}_to_{end_date}.json")
-            
-            # Save report data to file
-            with open(report_file_path, 'w') as f:
+            with os.fdopen(fd, 'w') as f:
                 json.dump(report_data, f, indent=2)
-            
-            # Store report reference in database
-            parameters = json.dumps({
-                "start_date": start_date,
-                "end_date": end_date,
-                "report_id": report_id
-            })
-            
+            # mkstemp creates the file owner-only
+            os.chmod(temp_path, _REPORT_MODE)
+            os.replace(temp_path, file_path)
+        except Exception as e:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return e
+        return None
+    
+    def _report_result(self, report, parameters, archive_id, file_path):
+        report_type, start_date, end_date = report
+        result = {
+            "status": "success",
+            "report_id": parameters["report_id"],
+            "archive_id": archive_id
+        }
+        if report_type == "daily":
+            result["file_path"] = file_path
+        else:
+            result["artifact_id"] = f"{report_type}_report_{start_date}_to_{end_date}_{random.randint(1000, 9999)}"
+        return result
+    
+    def _report_error(self, report, error):
+        report_type, start_date, end_date = report
+        self.logger.error("Error generating %s report: %s", report_type, str(error))
+        if report_type == "daily":
+            return {"status": "error", "date": start_date, "error": str(error)}
+        return {"status": "error", "period": {"start": start_date, "end": end_date}, "error": str(error)}
+    
+    def _archive_report(self, db_connector, report_type, period_start, period_end, file_path, parameters,
+                        advance=True):
+        """Record a generated report in report_archive, with its catalog columns filled in
+        
+        advance=False leaves the checkpoint alone (an earlier report of the type failed).
+        """
+        store_query = """
+        INSERT INTO report_archive (
+            report_type, generated_at, file_path, parameters, report_id, period_start, period_end
+        ) VALUES (?, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?)
+        """
+        
+        # Only the current reporting leader may archive (no-op fence when uncoordinated)
+        with self.phase("archive"), self.fenced(db_connector):
             archive_id = db_connector.execute(store_query, (
-                "monthly",
-                report_file_path,
-                parameters
+                report_type,
+                file_path,
+                json.dumps(parameters),
+                parameters["report_id"],
+                period_start,
+                period_end
             ))
             
-            self.logger.info("Monthly report archived with ID: %s", archive_id)
-            return {
-                "status": "success",
-                "report_id": report_id,
-                "archive_id": archive_id,
-                "artifact_id": artifact_id
-            }
-            
-        except Exception as e:
-            self.logger.error("Error generating monthly report: %s", str(e))
-            return {
-                "status": "error",
-                "period": {"start": start_date, "end": end_date},
-                "error": str(e)
-            }
+            # Advanced in the same transaction and only over reports without a failed one before
+            # them, so a restart never skips a report (it may repeat those after a failure)
+            generated = self.load_checkpoint(db_connector, "reports", {})
+            if advance and period_end > generated.get(report_type, ""):
+                generated[report_type] = period_end
+                self.save_checkpoint(db_connector, generated, "reports")
+            return archive_id
     
     def _process_sales_metrics(self, sales_data):
         """
@@ -358,74 +338,52 @@ class ReportingAgent(BaseAgent):
         Process weekly sales metrics from the new database structure.
         
         Args:
-            sales_data (list): Raw sales metrics data from the database
-            
+            sales_data (iterable): (source, metric_type, value, date) rows from the database
+        
         Returns:
             dict: Processed weekly metrics with daily breakdown
         """
-        # Group by date and source
-        daily_metrics = {}
-        sources = set()
-        metric_types = set()
+        aggregator = PeriodAggregator()
+        for source, metric_type, value, date in sales_data:
+            aggregator.add(source, metric_type, value, date)
+        return aggregator.metrics()
+    
+    def _catalog(self, db_connector):
+        if self.catalog is None:
+            self.catalog = ReportCatalog(db_connector)
+        return self.catalog
+    
+    def list_reports(self, db_connector, report_type=None, start_date=None, end_date=None,
+                     limit=None, after=None):
+        """
+        List archived reports, newest period first, optionally filtered by type and period
         
-        for item in sales_data:
-            date = item.get("date")
-            source = item.get("source")
-            metric_type = item.get("metric_type")
-            value = item.get("value")
-            
-            sources.add(source)
-            metric_types.add(metric_type)
+        Args:
+            report_type (str): daily, weekly or monthly
+            start_date, end_date (str): only reports whose period overlaps this range
+            limit (int): page size, REPORT_CONFIG page_size by default
+            after (str): the "next" cursor of the previous page
             
-            if date not in daily_metrics:
-                daily_metrics[date] = {}
-                
-            if source not in daily_metrics[date]:
-                daily_metrics[date][source] = {}
-                
-            daily_metrics[date][source][metric_type] = value
-        
-        # Calculate weekly totals by source
-        weekly_totals = {}
-        for source in sources:
-            weekly_totals[source] = {}
-            for metric_type in metric_types:
-                total = 0
-                count = 0
-                
-                for date in daily_metrics:
-                    if source in daily_metrics[date] and metric_type in daily_metrics[date][source]:
-                        value = daily_metrics[date][source][metric_type]
-                        total += value
-                        count += 1
-                
-                if count > 0:
-                    if metric_type in ["average_order_value"]:
-                        # For averages, we take the average of daily averages
-                        weekly_totals[source][metric_type] = total / count
-                    else:
-                        # For other metrics, we sum them up
-                        weekly_totals[source][metric_type] = total
-        
-        # Calculate overall totals
-        overall_totals = {}
-        for metric_type in metric_types:
-            total = 0
-            for source in weekly_totals:
-                if metric_type in weekly_totals[source]:
-                    total += weekly_totals[source][metric_type]
-            overall_totals[metric_type] = total
-        
-        return {
-            "daily": daily_metrics,
-            "weekly": weekly_totals,
-            "total": overall_totals,
-            "sources": list(sources),
-            "metric_types": list(metric_types)
-        }
+        Returns:
+            dict: {"reports": [catalog entries], "next": cursor or None}
+        """
+        return self._catalog(db_connector).list(report_type, start_date, end_date, limit, after)
     
-    def list_reports(self, report_type=None):
+    def get_report(self, db_connector, report_id):
         """
-        List available reports, optionally filtered by type
+        Catalog entry and file contents of a report, by report_id (e.g. "daily_2024-01-31") or archive id
+        
+        Returns:
+            dict: the catalog entry plus "content" (bytes), or None if unknown or its file is gone
         """
-        pass
\ No newline at end of file
+        catalog = self._catalog(db_connector)
+        report = catalog.find(report_id)
+        if report is None:
+            return None
+        
+        try:
+            report["content"] = catalog.read(report["file_path"])
+        except FileNotFoundError:
+            self.logger.warning("Report file %s is missing", report["file_path"])
+            return None
+        return report
\ No newline at end of file
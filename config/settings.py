@@ -1,7 +1,200 @@
 # config/settings.py
 DATABASE_CONFIG = {
     "type": "sqlite",
-    "database": "mcp_agent_system.db"
+    "database": "mcp_agent_system.db",
+    "journal_mode": "wal",  # WAL lets snapshot readers run alongside writers
+    "row_mode": "dict",  # dict, tuple, row (sqlite3.Row) or namedtuple
+    "fetch_batch_size": 500,  # Rows per fetchmany() call in iter_query
+    # Non-critical writes (metrics, notifications, heartbeats, read marks) go through one
+    # writer thread that commits up to write_batch_size statements every write_batch_delay seconds
+    "write_behind": False,
+    "write_batch_size": 200,
+    "write_batch_delay": 0.005,
+    "write_lock_retries": 12,  # Busy timeouts the writer waits out before failing a batch's futures
+    # Run on an in-memory copy of "database" (restored from it at startup) and snapshot it back
+    # every backup_interval seconds and on shutdown; writes since the last snapshot can be lost
+    "in_memory": False,
+    "backup_interval": 300,
+    "backup_pages": 1024,  # Pages copied per backup step; writers get the database between steps
+    "backup_step_delay": 0.005,
+    "backup_max_restarts": 3  # Copies restarted by concurrent writes before one is done in a single step
+}
+
+AGENT_CONFIG = {
+    # Agent types to start; each is imported only if listed here
+    "enabled": ["data_collection", "analytics", "alert", "reporting", "maintenance"]
+}
+
+SCHEDULE_CONFIG = {
+    "workers": 4,  # Threads running agent cycles; idle agents hold none
+    # Applied to every agent; interval/cron default to the agent's own default_schedule()
+    "default": {
+        "jitter": 0,  # Random delay up to this many seconds, spreads out simultaneous starts
+        "catch_up": "once",  # Missed runs: skip, once (coalesce) or all
+        "max_concurrency": 1,  # Never overlap cycles of the same agent
+        "retry_delay": 60,  # Re-run a failed cycle after this many seconds
+        "misfire_grace": 60,  # How late a run may start under the skip policy
+        "run_at_start": True
+    },
+    "agents": {
+        "data_collection": {"jitter": 30},
+        "analytics": {"jitter": 60},
+        "alert": {"jitter": 10},
+        "maintenance": {"jitter": 300, "run_at_start": False}
+    }
+}
+
+ANALYTICS_CONFIG = {
+    "detector": "zscore",  # zscore (flat 30-day mean), or seasonal (per-weekday baseline) to opt in
+    "baseline_method": "median",  # median/MAD or mean/stdev
+    "baseline_weeks": 8,  # Samples kept per (source, metric, weekday)
+    "baseline_min_samples": 3,  # Weekday slots with fewer samples are not scored
+    # Historical recompute into sales_insights (python -m core.anomaly_backfill)
+    "backfill": {
+        "threshold": 2.0,  # Z-score threshold
+        "window": 30,  # Trailing points each point is compared with
+        "min_points": 7,  # Points needed in the window before scoring starts
+        "high_severity_z": 3.0,  # Anomalies at least this far out are stored as high severity
+        "metric_types": ["total_sales"],
+        "workers": 4  # Series scored and written in parallel
+    }
+}
+
+INGESTION_CONFIG = {
+    "resolution": 86400,  # Seconds per collected bucket; below 86400 records intraday points (e.g. 300)
+    "hourly_after_hours": 48,  # Raw points older than this are rolled up into hourly buckets
+    "daily_after_days": 14,  # Hourly buckets older than this are dropped; sales_metrics keeps the day
+    # How points of a metric combine into a coarser bucket: sum or avg
+    # (unique_customers is summed, so intraday totals overcount repeat customers)
+    "aggregation": {"total_sales": "sum", "total_orders": "sum", "unique_customers": "sum"},
+    # Daily ratios computed from the aggregated totals instead of being collected
+    "derived": {"average_order_value": ["total_sales", "total_orders"]},
+    "intraday_days": 14,  # Same-hour history used by the intraday detector
+    "intraday_min_samples": 5
+}
+
+REPORT_CONFIG = {
+    "page_size": 50,  # Default number of reports per list_reports page
+    "cache_size": 32,  # Recently read report files kept memory-mapped
+    "scan_span_days": 45,  # Longest combined period read in one shared scan by the report planner
+    "weekly_insight_limit": 10,  # Top insights listed in a weekly report
+    "write_workers": 4  # Report files written in parallel
+}
+
+COORDINATION_CONFIG = {
+    "enabled": True,
+    "lease_ttl": 60,  # Seconds a singleton lease stays valid without renewal
+    "heartbeat_interval": 15,  # How often the scheduler refreshes heartbeats and leases
+    "member_timeout": 60,  # Workers without a heartbeat for this long lose their share
+    # Name of this worker process in its agent ids (or set AGENT_WORKER_NAME per process).
+    # None uses "<host>_<pid>"; a named worker refuses to start while its name is still live.
+    "worker_name": None,
+    "virtual_nodes": 64,  # Points per worker on the consistent hash ring
+    "singleton_roles": ["reporting", "alert", "maintenance"],
+    "partitioned_roles": ["data_collection", "analytics"]
+}
+
+MESSAGE_CONFIG = {
+    "codec": "marshal",  # json or marshal (compact binary, repeated dict keys packed once)
+    "compress_threshold": 1024,  # zlib-compress payloads of at least this many bytes
+    "compress_level": 6,
+    "claim_check_threshold": 65536  # Store larger payloads once in message_payloads; None disables
+}
+
+TOPIC_CONFIG = {
+    "poll_limit": 100,  # Entries read per poll
+    "segment_size": 1000,  # Truncation drops whole runs of this many seqs once every subscriber is past them
+    "max_age_days": 7,  # Entries older than this go even if a subscriber never consumed them
+    "subscriptions": {
+        "anomalies": ["alert"]  # topic -> subscriber groups (agent types), created at registration
+    }
+}
+
+CDC_CONFIG = {
+    # Off until a consumer or the exporter is set up: the triggers add a change_log row to every
+    # write of the tables below. Enabling installs them on the next connect.
+    "enabled": False,
+    "tables": ["sales_metrics", "sales_insights", "system_notifications"],
+    "batch_size": 500,  # Change records read per poll
+    "segment_size": 10000,  # Truncation drops whole runs of this many seqs once every consumer is past them
+    "max_age_days": 7,  # Records older than this go even if a consumer never read them
+    "export_path": None,  # NDJSON file tailed from change_log by the scheduler, e.g. "exports/changes.ndjson"
+    "export_interval": 5,  # Seconds between export passes
+    "export_consumer": "ndjson_export"  # Consumer offset used by the exporter
+}
+
+SKETCH_CONFIG = {
+    "hll_precision": 12,  # 4096 registers, about 1.6% error on distinct customers
+    "kll_k": 200,  # Quantile sketch size; rank error is roughly 1.7 / k
+    "quantiles": [0.5, 0.95, 0.99],  # Order-value quantiles in weekly/monthly reports
+    "client_pool": 2000  # Simulated customers per source, so repeat customers span days
+}
+
+SERIES_CACHE_CONFIG = {
+    "days": 92,  # Days of sales_metrics kept in memory per (source, metric_type), warmed at startup
+    "memory_budget_mb": 16,  # Least recently read series are evicted beyond this
+    "refresh_interval": 600,  # Seconds between re-reads of recent days, for writes by other processes
+    "refresh_days": 3  # Days re-read by each refresh
+}
+
+CHECKPOINT_CONFIG = {
+    "max_catch_up_days": 7  # After downtime, days collected/reported at most; older gaps are left
+}
+
+PARTITION_CONFIG = {
+    "enabled": False,  # Keep sales tables in per-month files instead of the main database
+    "directory": "partitions",
+    "tables": ["sales_metrics", "sales_insights"],
+    "read_only_after_months": 2,  # Older partitions are attached with mode=ro
+    "max_attached": 8  # SQLite allows 10 attached databases per connection by default
+}
+
+RETENTION_CONFIG = {
+    "interval": 3600,  # Run maintenance hourly
+    "batch_size": 500,  # Rows per delete transaction, keeps write locks short
+    "archive_database": "mcp_agent_system_archive.db",  # None disables archiving
+    "vacuum_pages": 2000,  # Pages released per incremental_vacuum step
+    "convert_auto_vacuum": False,  # One-off full VACUUM to enable incremental mode on old files
+    "tables": {
+        "agent_messages": {"days": 7, "column": "timestamp", "condition": "read = 1"},
+        "agent_tasks": {"days": 7, "column": "completed_at", "condition": "status IN ('completed', 'failed')"},
+        "agent_cycle_metrics": {"days": 7, "column": "started_at"},
+        "system_notifications": {"days": 30, "column": "timestamp"},
+        "report_archive": {"days": 365, "column": "generated_at", "archive": True},
+        "sales_metrics": {"days": 730, "column": "date", "archive": True},
+        "sales_sketches": {"days": 730, "column": "date"}
+    }
+}
+
+PROFILING_CONFIG = {
+    "buffer_size": 100,  # Recent cycles kept in memory per agent
+    "persist": True,  # Also write one row per cycle to agent_cycle_metrics
+    # cProfile capture: "agent" is an agent type or id (None means every agent). On SIGUSR1,
+    # or at startup when on_start is set, the next "cycles" cycles are profiled into "directory".
+    "agent": None,
+    "cycles": 3,
+    "on_start": False,
+    "directory": "profiles"
+}
+
+TELEMETRY_CONFIG = {
+    "enabled": True,
+    "host": "127.0.0.1",  # Local only; scrape through a proxy or sidecar if needed elsewhere
+    "port": 9108  # GET /metrics returns Prometheus text format
+}
+
+LOAD_TEST_CONFIG = {
+    # Defaults for python -m core.load_test; every value can be overridden on the command line
+    "mode": "messages",  # messages (send_message/get_messages) or tasks (create_task/update_task_status)
+    "producers": 4,
+    "consumers": 2,
+    "replicas": 1,  # Consumer threads sharing one agent id; above 1 exposes duplicate deliveries
+    "rate": 50,  # Items per second per producer
+    "duration": 10,  # Seconds of producing
+    "payload_bytes": 256,
+    "poll_interval": 0.05,  # Seconds between consumer polls
+    "drain_timeout": 10,  # Seconds to wait for in-flight items after producing stops
+    "write_behind": False  # Run with DATABASE_CONFIG write_behind enabled
 }
 
 LOGGING_CONFIG = {
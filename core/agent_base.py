@@ -1,33 +1,72 @@
+import os
 import json
+import time
 import uuid
+import cProfile
 import datetime
 import logging
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from config.settings import COORDINATION_CONFIG, PROFILING_CONFIG, TOPIC_CONFIG
+from core.message_codec import MessageCodec
+from core.timing import CycleMetrics
+from core.topics import TopicBus
+from core.checkpoints import CheckpointStore
+from core.coordination import (
+    LeaseManager, ConsistentHashRing, DuplicateAgentError, live_members, retire_dead_workers, worker_name
+)
 
 class BaseAgent(ABC):
     def __init__(self, agent_id=None, agent_type=None):
-        self.agent_id = agent_id or f"{agent_type}_{uuid.uuid4()}"
+        # One id per process and role (see worker_name); several processes on a host each
+        # get their own leases and share of the hash ring
+        self.generated_id = agent_id is None
+        self.agent_id = agent_id or f"{agent_type}_{worker_name()}"
         self.agent_type = agent_type
         self.status = "inactive"
         self.logger = logging.getLogger(f"agent.{self.agent_type}")
+        self.codec = MessageCodec()
+        
+        # Lease state for singleton roles, created on first use
+        self.leases = None
+        self.lease_token = None
+        
+        # Recent cycle timings, and how many upcoming cycles to run under cProfile
+        self.cycle_metrics = CycleMetrics(PROFILING_CONFIG.get("buffer_size", 100))
+        self.profile_cycles = 0
+        if PROFILING_CONFIG.get("on_start") and self.matches(PROFILING_CONFIG.get("agent")):
+            self.request_profile()
         
     def register(self, db_connector):
-        """Register agent in the agent_registry table"""
-        # First try to update existing record
-        update_query = """
-        UPDATE agent_registry 
-        SET status = ?, last_heartbeat = CURRENT_TIMESTAMP
-        WHERE agent_id = ?
+        """Register agent in the agent_registry table
+        
+        Refuses (DuplicateAgentError) a generated id that another process still heartbeats
+        under, such as a worker_name given to two processes.
         """
-        result = db_connector.execute(update_query, (self.status, self.agent_id))
+        if self.generated_id and COORDINATION_CONFIG.get("enabled", True):
+            if self.agent_id in live_members(db_connector, self.agent_type):
+                raise DuplicateAgentError(
+                    f"Agent id {self.agent_id} is in use by a live process; give this worker "
+                    f"another worker_name, or wait member_timeout after a crash"
+                )
+            # Earlier processes of this host that exited without stopping give up their share now
+            for agent_id in retire_dead_workers(db_connector, self.agent_type):
+                self.logger.info("Retired registration %s of an exited process", agent_id)
         
-        # If no rows were affected, insert new record
-        if not result or result == 0:
-            insert_query = """
-            INSERT INTO agent_registry (agent_id, agent_type, status)
-            VALUES (?, ?, ?)
-            """
-            db_connector.execute(insert_query, (self.agent_id, self.agent_type, self.status))
+        # Insert, or refresh the existing record. execute() returns lastrowid, which
+        # cannot tell whether an UPDATE matched, so this is done as a single upsert.
+        query = """
+        INSERT INTO agent_registry (agent_id, agent_type, status)
+        VALUES (?, ?, ?)
+        ON CONFLICT(agent_id) DO UPDATE
+        SET status = excluded.status, last_heartbeat = CURRENT_TIMESTAMP
+        """
+        db_connector.execute(query, (self.agent_id, self.agent_type, self.status))
+        
+        # Cursors exist before anything is published, so the first entries are not skipped
+        for topic, groups in TOPIC_CONFIG.get("subscriptions", {}).items():
+            if self.agent_type in groups:
+                TopicBus(db_connector, self.codec).subscribe(topic, self.agent_type)
         
         self.logger.info("Agent %s registered successfully", self.agent_id)
         
@@ -42,39 +81,112 @@ class BaseAgent(ABC):
         db_connector.execute(query, (status, self.agent_id))
         self.logger.info("Agent %s status updated to %s", self.agent_id, status)
     
+    def heartbeat(self, db_connector):
+        """Refresh last_heartbeat and renew any leases this agent holds"""
+        query = """
+        UPDATE agent_registry
+        SET last_heartbeat = CURRENT_TIMESTAMP
+        WHERE agent_id = ?
+        """
+        # A late heartbeat is harmless, so it may be batched with other writes
+        db_connector.execute_deferred(query, (self.agent_id,))
+        
+        if self.leases is not None:
+            self.leases.renew_all()
+    
+    def acquire_leadership(self, db_connector, role=None):
+        """Try to become the one active instance of a singleton role across all processes"""
+        if not COORDINATION_CONFIG.get("enabled", True):
+            return True
+        
+        if self.leases is None:
+            self.leases = LeaseManager(db_connector, self.agent_id)
+        
+        self.lease_token = self.leases.acquire(role or self.agent_type)
+        return self.lease_token is not None
+    
+    def owned_keys(self, db_connector, keys):
+        """Subset of keys (e.g. sources) this agent handles among the live agents of its type"""
+        if not COORDINATION_CONFIG.get("enabled", True):
+            return list(keys)
+        
+        # Membership is re-read every time, so a lapsed worker's keys move on the next cycle
+        members = set(live_members(db_connector, self.agent_type))
+        members.add(self.agent_id)
+        ring = ConsistentHashRing(sorted(members))
+        
+        return [key for key in keys if ring.owner(key) == self.agent_id]
+    
+    @contextmanager
+    def fenced(self, db_connector, role=None):
+        """Transaction that only commits while this agent still holds its lease"""
+        if self.lease_token is None:
+            with db_connector.transaction():
+                yield
+        else:
+            with self.leases.fenced(role or self.agent_type, self.lease_token):
+                yield
+    
     def send_message(self, db_connector, recipient_id, message_type, content):
         """Send a message to another agent"""
         query = """
-        INSERT INTO agent_messages (sender_id, recipient_id, message_type, content)
-        VALUES (?, ?, ?, ?)
+        INSERT INTO agent_messages (sender_id, recipient_id, message_type, content, content_format)
+        VALUES (?, ?, ?, ?, ?)
         """
+        payload, content_format = self.codec.encode(content, db_connector)
         message_id = db_connector.execute(query, (
-            self.agent_id, recipient_id, message_type, json.dumps(content)
+            self.agent_id, recipient_id, message_type, payload, content_format
         ))
         self.logger.info("Message sent to %s, type: %s, id: %s", recipient_id, message_type, message_id)
         return message_id
     
     def get_messages(self, db_connector, mark_as_read=True):
-        """Get messages sent to this agent"""
+        """Get messages sent to this agent, with content already decoded"""
         query = """
-        SELECT id, sender_id, message_type, content, timestamp
+        SELECT id, sender_id, message_type, content, content_format, timestamp
         FROM agent_messages
         WHERE recipient_id = ? AND read = 0
         ORDER BY timestamp ASC
         """
+        # Read marks may still be queued; without this barrier they could be read again
+        db_connector.flush()
         messages = db_connector.query(query, (self.agent_id,))
         
+        for message in messages:
+            message["content"] = self.codec.decode(
+                message["content"], message.pop("content_format"), db_connector
+            )
+        
         if mark_as_read and messages:
-            for message in messages:
-                update_query = """
-                UPDATE agent_messages
-                SET read = 1
-                WHERE id = ?
-                """
-                db_connector.execute(update_query, (message["id"],))
+            update_query = """
+            UPDATE agent_messages
+            SET read = 1
+            WHERE id = ?
+            """
+            db_connector.execute_deferred(update_query, [(message["id"],) for message in messages], many=True)
             
         return messages
     
+    def publish(self, db_connector, topic, message_type, content):
+        """Publish to a topic once, however many groups subscribe to it"""
+        return TopicBus(db_connector, self.codec).publish(topic, self.agent_id, message_type, content)
+    
+    def poll_topic(self, db_connector, topic, limit=None):
+        """Unacknowledged entries of a topic for this agent's group (its agent type)"""
+        return TopicBus(db_connector, self.codec).poll(topic, self.agent_type, limit)
+    
+    def ack_topic(self, db_connector, topic, seq):
+        """Mark a topic consumed up to seq for this agent's group"""
+        TopicBus(db_connector, self.codec).ack(topic, self.agent_type, seq)
+    
+    def load_checkpoint(self, db_connector, name="default", default=None):
+        """Last progress saved by this agent type under name, or default"""
+        return CheckpointStore(db_connector).load(self.agent_type, name, default)
+    
+    def save_checkpoint(self, db_connector, state, name="default"):
+        """Save progress (any JSON value); call inside the transaction doing the work it covers"""
+        CheckpointStore(db_connector).save(self.agent_type, name, state, self.agent_id)
+    
     def create_task(self, db_connector, task_data, priority=5):
         """Create a new task for this agent"""
         task_id = f"task_{uuid.uuid4()}"
@@ -117,7 +229,101 @@ class BaseAgent(ABC):
         db_connector.execute(query, (status, result_json, task_id))
         self.logger.info("Task %s status updated to %s", task_id, status)
     
-    @abstractmethod
+    def default_schedule(self):
+        """Schedule used by the central scheduler unless SCHEDULE_CONFIG overrides it"""
+        return {"interval": 3600}
+    
+    def matches(self, name):
+        """Whether a configured agent name (type or id, None for any) refers to this agent"""
+        return name is None or name in (self.agent_type, self.agent_id)
+    
+    def request_profile(self, cycles=None):
+        """Capture cProfile stats for the next N cycles, one .prof file per cycle"""
+        self.profile_cycles = cycles or PROFILING_CONFIG.get("cycles", 3)
+        self.logger.info("Profiling the next %d cycles of %s", self.profile_cycles, self.agent_id)
+    
+    def phase(self, name):
+        """Time a named part of the current cycle (wall and CPU), e.g. with self.phase("query"):"""
+        return self.cycle_metrics.phase(name)
+    
+    def execute_cycle(self, db_connector):
+        """Run one cycle, timed (and profiled if requested), and keep the registry status in line"""
+        profiler = self._start_profiler()
+        try:
+            with self.cycle_metrics.cycle():
+                result = self.run_cycle(db_connector)
+        except Exception as e:
+            self.logger.error("Error in %s agent: %s", self.agent_type, str(e))
+            self.update_status(db_connector, "error")
+            raise
+        finally:
+            if profiler is not None:
+                self._stop_profiler(profiler)
+            self._record_cycle(db_connector, self.cycle_metrics.cycles[-1])
+        
+        if self.status != "active":
+            self.update_status(db_connector, "active")
+        return result
+    
+    def _record_cycle(self, db_connector, record):
+        """Persist one cycle's timings; never lets a metrics failure fail the cycle"""
+        if not PROFILING_CONFIG.get("persist", True):
+            return
+        
+        phases = {
+            name: [round(wall * 1000, 3), round(cpu * 1000, 3)]
+            for name, (wall, cpu) in record["phases"].items()
+        }
+        try:
+            db_connector.execute_deferred("""
+            INSERT INTO agent_cycle_metrics (agent_id, agent_type, started_at, wall_ms, cpu_ms, ok, phases)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (
+                self.agent_id, self.agent_type,
+                datetime.datetime.utcfromtimestamp(record["started_at"]).strftime("%Y-%m-%d %H:%M:%S"),
+                round(record["wall"] * 1000, 3), round(record["cpu"] * 1000, 3),
+                int(record["ok"]), json.dumps(phases, separators=(",", ":"))
+            ))
+        except Exception as e:
+            self.logger.warning("Could not record cycle metrics: %s", str(e))
+    
+    def _start_profiler(self):
+        if self.profile_cycles <= 0:
+            return None
+        
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active per process on newer Pythons
+            self.logger.warning("Another cycle is being profiled; %s runs unprofiled", self.agent_id)
+            return None
+        return profiler
+    
+    def _stop_profiler(self, profiler):
+        profiler.disable()
+        self.profile_cycles -= 1
+        
+        directory = PROFILING_CONFIG.get("directory", "profiles")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.agent_id}_{int(time.time() * 1000)}.prof")
+        # Readable with pstats.Stats(path) or snakeviz
+        profiler.dump_stats(path)
+        self.logger.info("Cycle profile written to %s (%d more to go)", path, self.profile_cycles)
+    
     def run(self, db_connector):
-        """Main agent execution method, must be implemented by subclasses"""
+        """Standalone loop for running the agent without the central scheduler"""
+        self.update_status(db_connector, "active")
+        interval = self.default_schedule().get("interval", 3600)
+        
+        while True:
+            try:
+                self.execute_cycle(db_connector)
+                time.sleep(interval)
+            except Exception:
+                time.sleep(60)  # Wait before retrying
+    
+    @abstractmethod
+    def run_cycle(self, db_connector):
+        """One unit of agent work, triggered by the scheduler; must be implemented by subclasses"""
         pass
\ No newline at end of file
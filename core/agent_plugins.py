@@ -0,0 +1,77 @@
+import logging
+import importlib
+from importlib import metadata
+
+# Built-in agent types, resolved to "module:Class" and imported only when used
+BUILTIN_AGENTS = {
+    "data_collection": "agents.data_collection_agent:DataCollectionAgent",
+    "analytics": "agents.analytics_agent:AnalyticsAgent",
+    "alert": "agents.alert_agent:AlertAgent",
+    "reporting": "agents.reporting_agent:ReportingAgent",
+    "maintenance": "agents.maintenance_agent:MaintenanceAgent"
+}
+
+# Third-party packages can add agent types through this entry point group
+ENTRY_POINT_GROUP = "mcp_agent_system.agents"
+
+class AgentPluginRegistry:
+    """Maps agent type names to agent classes, importing each module on first use"""
+
+    def __init__(self):
+        self.logger = logging.getLogger("agent.plugins")
+        self._targets = dict(BUILTIN_AGENTS)
+        self._classes = {}
+        self._entry_points_loaded = False
+
+    def register(self, agent_type, target):
+        """Register an agent type as a class or a "module:Class" string"""
+        if isinstance(target, str):
+            self._targets[agent_type] = target
+            self._classes.pop(agent_type, None)
+        else:
+            self._classes[agent_type] = target
+
+    def available_types(self):
+        """All known agent type names, including installed plugins"""
+        self._load_entry_points()
+        return sorted(set(self._targets) | set(self._classes))
+
+    def get(self, agent_type):
+        """Return the agent class for a type, importing its module if needed"""
+        if agent_type in self._classes:
+            return self._classes[agent_type]
+
+        if agent_type not in self._targets:
+            # Entry points are only scanned when a non built-in type is requested
+            self._load_entry_points()
+            if agent_type not in self._targets:
+                raise KeyError(f"Unknown agent type: {agent_type}")
+
+        target = self._targets[agent_type]
+        if isinstance(target, metadata.EntryPoint):
+            agent_class = target.load()
+        else:
+            module_name, class_name = target.split(":")
+            agent_class = getattr(importlib.import_module(module_name), class_name)
+
+        self._classes[agent_type] = agent_class
+        return agent_class
+
+    def create(self, agent_type, **kwargs):
+        """Instantiate an agent of the given type"""
+        return self.get(agent_type)(**kwargs)
+
+    def _load_entry_points(self):
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+
+        try:
+            entry_points = metadata.entry_points(group=ENTRY_POINT_GROUP)
+        except Exception as e:
+            self.logger.error("Error reading agent entry points: %s", str(e))
+            return
+
+        for entry_point in entry_points:
+            # Built-in names win so a plugin cannot silently replace a core agent
+            self._targets.setdefault(entry_point.name, entry_point)
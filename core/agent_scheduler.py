@@ -1,29 +1,315 @@
+import time
+import heapq
+import random
+import datetime
 import threading
+import itertools
 import logging
-from agents.data_collection_agent import DataCollectionAgent
-from agents.analytics_agent import AnalyticsAgent
-from agents.alert_agent import AlertAgent
-from agents.reporting_agent import ReportingAgent
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import AGENT_CONFIG, CDC_CONFIG, COORDINATION_CONFIG, DATABASE_CONFIG, SCHEDULE_CONFIG
+from core.agent_plugins import AgentPluginRegistry
+from core.change_export import NDJSONExporter
+
+CATCH_UP_POLICIES = ("skip", "once", "all")
+
+class IntervalSchedule:
+    """Fixed interval, counted from the previous nominal run time so cycles do not drift"""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = seconds
+
+    def next_after(self, timestamp):
+        return timestamp + self.seconds
+
+    def __str__(self):
+        return f"every {self.seconds}s"
+
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day-of-month month day-of-week), local time"""
+
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+
+        self.expression = expression
+        parsed = [self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # Cron allows both 0 and 7 for Sunday
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _parse_field(self, field, low, high):
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/")
+                step = int(step)
+
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-"))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron field out of range: {field!r}")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, moment):
+        day_of_month = moment.day in self.days
+        day_of_week = (moment.weekday() + 1) % 7 in self.weekdays  # cron counts from Sunday
+
+        # Standard cron: when both day fields are restricted, either may match
+        if self.any_day and self.any_weekday:
+            return True
+        if self.any_day:
+            return day_of_week
+        if self.any_weekday:
+            return day_of_month
+        return day_of_month or day_of_week
+
+    def next_after(self, timestamp):
+        moment = datetime.datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0)
+        moment += datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * 5)
+
+        # Skip whole months, days and hours at a time rather than stepping minute by minute
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+    def __str__(self):
+        return f"cron {self.expression!r}"
+
+
+class ScheduledJob:
+    """A recurring job on the timer heap, with its own overlap and catch-up rules"""
+
+    def __init__(self, name, func, schedule, jitter=0, catch_up="once", max_concurrency=1,
+                 retry_delay=None, misfire_grace=60, max_catch_up=10):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy: {catch_up}")
+
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.max_concurrency = max_concurrency
+        self.retry_delay = retry_delay
+        self.misfire_grace = misfire_grace
+        self.max_catch_up = max_catch_up
+
+        # Runtime state, guarded by the scheduler lock
+        self.running = 0
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.next_run = None
+        self.next_nominal = None
+        self.generation = 0
+        self.last_started = None
+        self.last_duration = None
+        self.last_error = None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "schedule": str(self.schedule),
+            "next_run": datetime.datetime.fromtimestamp(self.next_run).isoformat() if self.next_run else None,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error
+        }
+
+
+class TimerScheduler:
+    """Runs every job from one dispatcher thread and a timer heap; cycles execute on a small pool"""
+
+    def __init__(self, workers=4):
+        self.logger = logging.getLogger("agent.scheduler.timer")
+        self.jobs = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-cycle")
+        self._dispatcher = None
+        self._stopping = False
+
+    def add_job(self, job, run_at_start=False):
+        """Put a job on the heap; its first run is now or at the next scheduled time"""
+        now = time.time()
+        nominal = now if run_at_start else job.schedule.next_after(now)
+
+        with self._condition:
+            self.jobs[job.name] = job
+            self._push(job, nominal)
+            self._condition.notify()
+
+        self.logger.info("Scheduled %s (%s), next run at %s", job.name, job.schedule,
+                         datetime.datetime.fromtimestamp(job.next_run).strftime("%Y-%m-%d %H:%M:%S"))
+
+    def remove_job(self, name):
+        """Stop scheduling a job; a run already in progress finishes normally"""
+        with self._condition:
+            self.jobs.pop(name, None)
+
+    def _push(self, job, nominal, run_at=None):
+        """Schedule the job's next occurrence, superseding any entry already on the heap"""
+        if run_at is None:
+            run_at = nominal + (random.uniform(0, job.jitter) if job.jitter else 0)
+
+        # Older heap entries for the job are left in place and ignored when popped
+        job.generation += 1
+        job.next_run = run_at
+        job.next_nominal = nominal
+        heapq.heappush(self._heap, (run_at, next(self._sequence), job.name, nominal, job.generation))
+
+    def start(self):
+        if self._dispatcher is not None:
+            return
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="agent-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._executor.shutdown(wait=wait)
+
+    def status(self):
+        with self._condition:
+            return [job.status() for job in self.jobs.values()]
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while not self._stopping:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    # Sleep exactly until the earliest job, or until a job is added
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._condition.wait(timeout)
+
+                if self._stopping:
+                    return
+
+                _, _, name, nominal, generation = heapq.heappop(self._heap)
+                job = self.jobs.get(name)
+                if job is None or generation != job.generation:
+                    continue
+
+                self._dispatch(job, nominal, time.time())
+
+    def _dispatch(self, job, nominal, now):
+        """Decide how many times a due job runs and schedule its next occurrence (lock held)"""
+        # Every occurrence that is already due, not just the one popped from the heap
+        overdue = 1
+        following = job.schedule.next_after(nominal)
+        while following <= now:
+            overdue += 1
+            following = job.schedule.next_after(following)
+        self._push(job, following)
+
+        if job.catch_up == "all":
+            runs = min(overdue, job.max_catch_up)
+        elif job.catch_up == "once":
+            runs = 1
+        else:
+            # "skip": only an on-time run is executed; missed ones are dropped
+            runs = 1 if overdue == 1 and now - nominal <= job.misfire_grace else 0
+
+        if overdue > 1:
+            self.logger.info("%s missed %d run(s); catch-up policy %s runs it %d time(s)",
+                             job.name, overdue - 1, job.catch_up, runs)
+
+        if runs == 0:
+            job.skipped += 1
+            return
+
+        if job.running >= job.max_concurrency:
+            # Previous cycle still busy: never stack a second one on top
+            job.skipped += 1
+            self.logger.warning("%s still running, skipping this run", job.name)
+            return
+
+        job.running += 1
+        self._executor.submit(self._run_job, job, runs)
+
+    def _run_job(self, job, runs):
+        started = time.time()
+        failed = False
+        try:
+            for _ in range(runs):
+                job.func()
+        except Exception as e:
+            failed = True
+            job.last_error = str(e)
+            self.logger.error("Job %s failed: %s", job.name, str(e))
+        finally:
+            with self._condition:
+                job.running -= 1
+                job.runs += runs
+                job.last_started = started
+                job.last_duration = time.time() - started
+
+                if failed:
+                    job.failures += 1
+                    # Retry sooner than the regular schedule would; the retry takes
+                    # the place of the next regular occurrence
+                    retry_at = time.time() + job.retry_delay if job.retry_delay else None
+                    if retry_at and job.name in self.jobs and retry_at < job.next_run:
+                        self._push(job, job.next_nominal, run_at=retry_at)
+                        self._condition.notify()
+
 
 class AgentScheduler:
-    def __init__(self, db_connector):
+    def __init__(self, db_connector, plugins=None):
         self.db_connector = db_connector
         self.logger = logging.getLogger("agent.scheduler")
+        self.plugins = plugins or AgentPluginRegistry()
         self.agents = {}
         self.agent_threads = {}
-        
+        self.heartbeat_interval = COORDINATION_CONFIG.get("heartbeat_interval", 15)
+        self.timer = TimerScheduler(SCHEDULE_CONFIG.get("workers", 4))
+
     def register_agent(self, agent):
         """Register an agent with the scheduler"""
         agent.register(self.db_connector)
         self.agents[agent.agent_id] = agent
         self.logger.info("Agent %s registered with scheduler", agent.agent_id)
-        
+
     def start_agent(self, agent_id):
-        """Start a specific agent in a separate thread"""
+        """Start a specific agent in a separate thread running its own loop"""
         if agent_id not in self.agents:
             self.logger.error("Agent %s not registered", agent_id)
             return False
-            
+
         agent = self.agents[agent_id]
         agent_thread = threading.Thread(
             target=agent.run,
@@ -31,44 +317,135 @@ class AgentScheduler:
             daemon=True
         )
         agent_thread.start()
-        
+
         self.agent_threads[agent_id] = agent_thread
         self.logger.info("Agent %s started", agent_id)
         return True
-        
+
+    def schedule_agent(self, agent_id):
+        """Drive an agent's cycles from the central timer according to its schedule"""
+        if agent_id not in self.agents:
+            self.logger.error("Agent %s not registered", agent_id)
+            return False
+
+        agent = self.agents[agent_id]
+        options = dict(SCHEDULE_CONFIG.get("default", {}))
+        options.update(agent.default_schedule())
+        options.update(SCHEDULE_CONFIG.get("agents", {}).get(agent.agent_type, {}))
+
+        if options.get("cron"):
+            schedule = CronSchedule(options["cron"])
+        else:
+            schedule = IntervalSchedule(options["interval"])
+
+        job = ScheduledJob(
+            agent_id,
+            lambda: agent.execute_cycle(self.db_connector),
+            schedule,
+            jitter=options.get("jitter", 0),
+            catch_up=options.get("catch_up", "once"),
+            max_concurrency=options.get("max_concurrency", 1),
+            retry_delay=options.get("retry_delay"),
+            misfire_grace=options.get("misfire_grace", 60)
+        )
+
+        agent.update_status(self.db_connector, "active")
+        self.timer.add_job(job, run_at_start=options.get("run_at_start", False))
+        return True
+
     def start_agents(self):
-        """Start all registered agents"""
+        """Schedule all registered agents on the central timer and start it"""
         for agent_id in self.agents:
-            self.start_agent(agent_id)
-            
+            self.schedule_agent(agent_id)
+        self.start_heartbeats()
+        self.start_backups()
+        self.start_change_export()
+        self.timer.start()
+
+    def start_heartbeats(self):
+        """Keep heartbeats and leases of local agents fresh between cycles"""
+        if "heartbeat" in self.timer.jobs:
+            return
+
+        job = ScheduledJob("heartbeat", self._send_heartbeats, IntervalSchedule(self.heartbeat_interval),
+                           catch_up="once")
+        self.timer.add_job(job)
+
+    def start_backups(self):
+        """Snapshot an in-memory database to disk on a fixed interval"""
+        if not self.db_connector.in_memory or "db_backup" in self.timer.jobs:
+            return
+
+        interval = DATABASE_CONFIG.get("backup_interval", 300)
+        # Never two snapshots at once, and a late one is not worth repeating
+        job = ScheduledJob("db_backup", self.db_connector.backup, IntervalSchedule(interval),
+                           catch_up="skip")
+        self.timer.add_job(job)
+
+    def start_change_export(self):
+        """Tail change_log into the configured NDJSON file on a fixed interval"""
+        path = CDC_CONFIG.get("export_path")
+        if not path or not CDC_CONFIG.get("enabled", False) or "change_export" in self.timer.jobs:
+            return
+
+        exporter = NDJSONExporter(self.db_connector, path)
+        job = ScheduledJob("change_export", exporter.export, IntervalSchedule(CDC_CONFIG.get("export_interval", 5)),
+                           catch_up="skip")
+        self.timer.add_job(job)
+
+    def _send_heartbeats(self):
+        for agent in list(self.agents.values()):
+            try:
+                agent.heartbeat(self.db_connector)
+            except Exception as e:
+                self.logger.error("Heartbeat failed for %s: %s", agent.agent_id, str(e))
+
+    def job_status(self):
+        """Next run time, run counts and last duration of every scheduled job"""
+        return self.timer.status()
+
+    def cycle_stats(self):
+        """Average cycle and phase timings of every local agent, from its in-memory buffer"""
+        return {agent_id: agent.cycle_metrics.summary() for agent_id, agent in self.agents.items()}
+
+    def request_profile(self, name=None, cycles=None):
+        """Profile the next cycles of the agents matching a type or id (all if None)"""
+        matched = [agent for agent in self.agents.values() if agent.matches(name)]
+        for agent in matched:
+            agent.request_profile(cycles)
+        return [agent.agent_id for agent in matched]
+
     def stop_agent(self, agent_id):
         """Stop a specific agent"""
-        if agent_id not in self.agent_threads:
+        if agent_id not in self.agent_threads and agent_id not in self.timer.jobs:
             self.logger.error("Agent %s not running", agent_id)
             return False
-            
-        # Note: This doesn't actually stop the agent thread
-        # The agents would need to implement a stop mechanism
+
+        # Scheduled agents simply get no further cycles. Note: an agent started
+        # with start_agent() runs its own loop, which this does not interrupt.
+        self.timer.remove_job(agent_id)
         agent = self.agents[agent_id]
         agent.update_status(self.db_connector, "inactive")
+
+        # Hand singleton roles over immediately instead of waiting for lease expiry
+        if agent.leases is not None:
+            for role in list(agent.leases.held):
+                agent.leases.release(role)
         self.logger.info("Agent %s stopped", agent_id)
         return True
-        
-    def initialize_default_agents(self):
-        """Initialize and register default agent set"""
-        data_agent = DataCollectionAgent()
-        analytics_agent = AnalyticsAgent()
-        alert_agent = AlertAgent()
-        reporting_agent = ReportingAgent()
-        
-        self.register_agent(data_agent)
-        self.register_agent(analytics_agent)
-        self.register_agent(alert_agent)
-        self.register_agent(reporting_agent)
-        
-        return {
-            "data_collection": data_agent.agent_id,
-            "analytics": analytics_agent.agent_id,
-            "alert": alert_agent.agent_id,
-            "reporting": reporting_agent.agent_id
-        }
\ No newline at end of file
+
+    def shutdown(self):
+        """Stop dispatching and wait for running cycles to finish"""
+        self.timer.shutdown()
+
+    def initialize_default_agents(self, agent_types=None):
+        """Initialize and register the configured agent set"""
+        agent_ids = {}
+
+        for agent_type in agent_types or AGENT_CONFIG.get("enabled", []):
+            # The agent module is imported here, only for types that will run
+            agent = self.plugins.create(agent_type)
+            self.register_agent(agent)
+            agent_ids[agent_type] = agent.agent_id
+
+        return agent_ids
@@ -0,0 +1,198 @@
+# Historical anomaly backfill into sales_insights. Run from the project root, e.g.:
+#     python -m core.anomaly_backfill --start 2025-01-01 --end 2025-12-31 --threshold 2.5
+import json
+import math
+import time
+import logging
+import argparse
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import ANALYTICS_CONFIG
+from core.checkpoints import CheckpointStore
+from core.db_connector import DBConnector
+
+# insight_type of backfilled rows; a re-run replaces exactly these
+INSIGHT_TYPE = "backfill_anomaly"
+
+class AnomalyBackfill:
+    """Scores whole series against a trailing window in one pass each, writing one month per transaction"""
+
+    def __init__(self, db_connector, config=None, **overrides):
+        self.db_connector = db_connector
+        self.config = dict(config or ANALYTICS_CONFIG.get("backfill", {}), **overrides)
+        self.logger = logging.getLogger("agent.backfill")
+        self.threshold = self.config.get("threshold", 2.0)
+        self.window = self.config.get("window", 30)
+        self.min_points = max(2, self.config.get("min_points", 7))
+        self.high_z = self.config.get("high_severity_z", 3.0)
+        self.checkpoints = CheckpointStore(db_connector)
+
+    def run(self, start_date, end_date, metric_types=None, workers=None, resume=True):
+        """Backfill [start_date, end_date] for every (source, metric_type) series; returns a summary"""
+        started = time.perf_counter()
+        metric_types = metric_types or self.config.get("metric_types", ["total_sales"])
+        # Trailing points before start_date, so the first days are scored on a full window
+        lookback = (
+            datetime.datetime.strptime(start_date, "%Y-%m-%d") - datetime.timedelta(days=self.window * 2)
+        ).strftime("%Y-%m-%d")
+
+        # (source, metric_type) -> [(date, value)], read once for all series in date order. One
+        # month per read, since a long range spans more partitions than can be attached at once.
+        series = {}
+        for month in self._months(lookback, end_date):
+            for date, source, metric_type, value in self.db_connector.iter_range(
+                "sales_metrics", "date, source, metric_type, value",
+                max(lookback, f"{month}-01"), min(end_date, f"{month}-31"),
+                where=f"metric_type IN ({','.join('?' * len(metric_types))})", params=metric_types,
+                order_by="date ASC"
+            ):
+                series.setdefault((source, metric_type), []).append((date, value))
+
+        summary = {"series": len(series), "points": 0, "anomalies": 0, "skipped_months": 0}
+        with ThreadPoolExecutor(max_workers=workers or self.config.get("workers", 4)) as pool:
+            results = pool.map(
+                lambda item: self._backfill_series(item[0], item[1], start_date, end_date, resume),
+                sorted(series.items())
+            )
+            for points, anomalies, skipped in results:
+                summary["points"] += points
+                summary["anomalies"] += anomalies
+                summary["skipped_months"] += skipped
+
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        self.logger.info(
+            "Backfilled %d anomalies over %d points of %d series in %.3fs",
+            summary["anomalies"], summary["points"], summary["series"], summary["seconds"]
+        )
+        return summary
+
+    def _backfill_series(self, key, points, start_date, end_date, resume):
+        """Score one series and replace its backfilled insights month by month"""
+        source, metric_type = key
+        checkpoint = f"backfill:{source}:{metric_type}"
+        # A different range or setting starts over; the same one continues after the last month written
+        run = f"{start_date}:{end_date}:{self.threshold}:{self.window}"
+        state = self.checkpoints.load("analytics", checkpoint) if resume else None
+        done_through = state["through"] if state and state.get("run") == run else ""
+
+        months = {}
+        for date, value, z_score, expected in self._score(points, start_date):
+            if date > end_date:
+                break
+            months.setdefault(date[:7], []).append(self._insight(source, metric_type, date, value, z_score, expected))
+
+        skipped = 0
+        anomalies = 0
+        for month in self._months(start_date, end_date):
+            month_start = max(start_date, f"{month}-01")
+            month_end = min(end_date, f"{month}-31")
+            if month_end <= done_through:
+                skipped += 1
+                continue
+
+            rows = months.get(month, [])
+            # Replacing the month makes a retried or resumed month come out the same
+            self.db_connector.replace_range(
+                "sales_insights", month_start, month_end,
+                ("date", "insight_type", "description", "severity", "metrics"), rows,
+                where="insight_type = ? AND json_extract(metrics, '$.source') = ? "
+                      "AND json_extract(metrics, '$.metric_type') = ?",
+                params=(INSIGHT_TYPE, source, metric_type), allow_read_only=True
+            )
+            self.checkpoints.save("analytics", checkpoint, {"run": run, "through": month_end})
+            anomalies += len(rows)
+
+        return len(points), anomalies, skipped
+
+    def _score(self, points, start_date):
+        """(date, value, z_score, expected) of anomalous points from start_date on, in O(n)
+
+        Each point is compared with the mean and standard deviation of the previous window
+        points, kept as a running sum and sum of squares.
+        """
+        window = deque()
+        total = 0.0
+        squares = 0.0
+
+        for step, (date, value) in enumerate(points):
+            count = len(window)
+            if date >= start_date and count >= self.min_points:
+                mean = total / count
+                variance = (squares - total * total / count) / (count - 1)
+                if variance > 0:
+                    z_score = (value - mean) / math.sqrt(variance)
+                    if abs(z_score) >= self.threshold:
+                        yield date, value, z_score, mean
+
+            window.append(value)
+            total += value
+            squares += value * value
+            if len(window) > self.window:
+                dropped = window.popleft()
+                total -= dropped
+                squares -= dropped * dropped
+            # Rounding error of the running sums builds up; start them afresh now and then
+            if step % 1024 == 1023:
+                total = math.fsum(window)
+                squares = math.fsum(sample * sample for sample in window)
+
+    def _insight(self, source, metric_type, date, value, z_score, expected):
+        direction = "above" if z_score > 0 else "below"
+        return (
+            date,
+            INSIGHT_TYPE,
+            f"{source} {metric_type} {value:.2f} was {abs(z_score):.1f} standard deviations {direction} "
+            f"the {self.window}-point mean of {expected:.2f}",
+            "high" if abs(z_score) >= self.high_z else "medium",
+            json.dumps({
+                "source": source,
+                "metric_type": metric_type,
+                "value": value,
+                "expected": expected,
+                "z_score": z_score,
+                "threshold": self.threshold,
+                "window": self.window
+            })
+        )
+
+    def _months(self, start_date, end_date):
+        year, month = int(start_date[:4]), int(start_date[5:7])
+        months = []
+        while f"{year:04d}-{month:02d}" <= end_date[:7]:
+            months.append(f"{year:04d}-{month:02d}")
+            month += 1
+            if month > 12:
+                year += 1
+                month = 1
+        return months
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute historical anomalies into sales_insights")
+    parser.add_argument("--start", required=True, help="First date to score (YYYY-MM-DD)")
+    parser.add_argument("--end", default=datetime.date.today().strftime("%Y-%m-%d"))
+    parser.add_argument("--threshold", type=float, help="Z-score threshold (default from ANALYTICS_CONFIG)")
+    parser.add_argument("--window", type=int, help="Trailing points each day is compared with")
+    parser.add_argument("--metric", action="append", dest="metric_types", help="Metric type; repeatable")
+    parser.add_argument("--workers", type=int, help="Series scored and written in parallel")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoints of an earlier run")
+    parser.add_argument("--database", help="Database file instead of the configured one")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(name)s] %(message)s")
+
+    db_connector = DBConnector(args.database)
+    if not db_connector.connect():
+        raise SystemExit("Could not open database %s" % db_connector.db_path)
+
+    overrides = {name: getattr(args, name) for name in ("threshold", "window") if getattr(args, name) is not None}
+    summary = AnomalyBackfill(db_connector, **overrides).run(
+        args.start, args.end, args.metric_types, args.workers, resume=not args.restart
+    )
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
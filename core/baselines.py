@@ -0,0 +1,123 @@
+import json
+import logging
+import datetime
+import statistics
+from config.settings import ANALYTICS_CONFIG
+
+# Scales the median absolute deviation to a standard deviation for normal data
+MAD_SCALE = 0.6745
+
+class BaselineStore:
+    """Per-(source, metric, weekday) statistics, updated as days arrive and read in O(1)"""
+
+    def __init__(self, db_connector, weeks=None, min_samples=None):
+        self.db_connector = db_connector
+        self.logger = logging.getLogger("agent.baselines")
+        self.weeks = weeks or ANALYTICS_CONFIG.get("baseline_weeks", 8)
+        self.min_samples = min_samples or ANALYTICS_CONFIG.get("baseline_min_samples", 3)
+
+        # (source, metric_type, weekday) -> baseline dict, loaded once from metric_baselines
+        self._baselines = None
+        self._dirty = set()
+
+    def _load(self):
+        if self._baselines is not None:
+            return
+
+        self._baselines = {}
+        rows = self.db_connector.query("""
+        SELECT source, metric_type, weekday, samples, last_date, mean, stdev, median, mad
+        FROM metric_baselines
+        """, row_mode="tuple")
+
+        for source, metric_type, weekday, samples, last_date, mean, stdev, median, mad in rows:
+            self._baselines[(source, metric_type, weekday)] = {
+                "samples": json.loads(samples),
+                "last_date": last_date,
+                "mean": mean,
+                "stdev": stdev,
+                "median": median,
+                "mad": mad
+            }
+
+    def get(self, source, metric_type, weekday):
+        """Baseline for one weekday slot, or None if nothing has been observed yet"""
+        self._load()
+        return self._baselines.get((source, metric_type, weekday))
+
+    def last_date(self, source, metric_type, date):
+        """Last date already folded into the slot that a date belongs to"""
+        baseline = self.get(source, metric_type, self._weekday(date))
+        return baseline["last_date"] if baseline else None
+
+    def score(self, source, metric_type, date, value, method=None):
+        """Return (z_score, expected) against the weekday baseline, or None without enough history"""
+        method = method or ANALYTICS_CONFIG.get("baseline_method", "median")
+        baseline = self.get(source, metric_type, self._weekday(date))
+        if baseline is None or len(baseline["samples"]) < self.min_samples:
+            return None
+
+        if method == "median" and baseline["mad"]:
+            return MAD_SCALE * (value - baseline["median"]) / baseline["mad"], baseline["median"]
+
+        # Mean/stdev, also the fallback when more than half the samples are identical
+        if not baseline["stdev"]:
+            return None
+        return (value - baseline["mean"]) / baseline["stdev"], baseline["mean"]
+
+    def observe(self, source, metric_type, date, value):
+        """Fold one day in (in memory); returns False if the date is already part of the baseline"""
+        self._load()
+        key = (source, metric_type, self._weekday(date))
+        baseline = self._baselines.get(key)
+
+        if baseline is None:
+            baseline = {"samples": [], "last_date": None}
+            self._baselines[key] = baseline
+        elif baseline["last_date"] is not None and date <= baseline["last_date"]:
+            return False
+
+        # Keep only the most recent weeks, so the baseline follows slow trends
+        baseline["samples"] = (baseline["samples"] + [value])[-self.weeks:]
+        baseline["last_date"] = date
+        self._update_statistics(baseline)
+        self._dirty.add(key)
+        return True
+
+    def observe_many(self, observations):
+        """Fold (source, metric_type, date, value) observations in date order and persist them"""
+        for source, metric_type, date, value in sorted(observations, key=lambda item: item[2]):
+            self.observe(source, metric_type, date, value)
+        return self.flush()
+
+    def flush(self):
+        """Write every baseline changed since the last flush in one batch"""
+        if not self._dirty:
+            return 0
+
+        changed = [(key, self._baselines[key]) for key in self._dirty]
+        self.db_connector.executemany("""
+        INSERT INTO metric_baselines
+            (source, metric_type, weekday, samples, last_date, mean, stdev, median, mad)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(source, metric_type, weekday) DO UPDATE SET
+            samples = excluded.samples, last_date = excluded.last_date,
+            mean = excluded.mean, stdev = excluded.stdev,
+            median = excluded.median, mad = excluded.mad
+        """, [
+            key + (json.dumps(b["samples"]), b["last_date"], b["mean"], b["stdev"], b["median"], b["mad"])
+            for key, b in changed
+        ])
+
+        self._dirty.clear()
+        return len(changed)
+
+    def _update_statistics(self, baseline):
+        samples = baseline["samples"]
+        baseline["mean"] = statistics.mean(samples)
+        baseline["stdev"] = statistics.stdev(samples) if len(samples) > 1 else 0.0
+        baseline["median"] = statistics.median(samples)
+        baseline["mad"] = statistics.median(abs(value - baseline["median"]) for value in samples)
+
+    def _weekday(self, date):
+        return datetime.datetime.strptime(date, "%Y-%m-%d").weekday()
@@ -0,0 +1,88 @@
+# Tail change_log into a newline-delimited JSON file. Run from the project root, e.g.:
+#     python -m core.change_export --output exports/changes.ndjson --follow
+import os
+import json
+import time
+import logging
+import argparse
+from config.settings import CDC_CONFIG
+from core.db_connector import DBConnector
+
+class NDJSONExporter:
+    """Appends change records past its consumer offset to a file, one JSON object per line
+
+    Records are written and synced before the offset moves, so a crash in between can
+    repeat the last batch but never lose one; readers skip seqs they have already seen.
+    """
+
+    def __init__(self, db_connector, path, consumer=None, config=None):
+        self.db_connector = db_connector
+        self.path = path
+        self.config = config or CDC_CONFIG
+        self.consumer = consumer or self.config.get("export_consumer", "ndjson_export")
+        self.batch_size = self.config.get("batch_size", 500)
+        self.logger = logging.getLogger("agent.change_export")
+        self.exported = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, from_start=False):
+        """Append everything past the offset; returns the number of records written"""
+        self.db_connector.register_change_consumer(self.consumer, from_start)
+        written = 0
+
+        while True:
+            changes = self.db_connector.poll_changes(self.consumer, self.batch_size)
+            if not changes:
+                break
+
+            lines = "".join(json.dumps(change, separators=(",", ":")) + "\n" for change in changes)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.db_connector.ack_changes(self.consumer, changes[-1]["seq"])
+            written += len(changes)
+            if len(changes) < self.batch_size:
+                break
+
+        if written:
+            self.exported += written
+            self.logger.info("Exported %d change records to %s", written, self.path)
+        return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append change_log records to a newline-delimited JSON file")
+    parser.add_argument("--output", default=CDC_CONFIG.get("export_path"), required=not CDC_CONFIG.get("export_path"))
+    parser.add_argument("--consumer", default=CDC_CONFIG.get("export_consumer", "ndjson_export"))
+    parser.add_argument("--from-start", action="store_true", help="A new consumer starts at the oldest record")
+    parser.add_argument("--follow", action="store_true", help="Keep tailing until interrupted")
+    parser.add_argument("--interval", type=float, default=CDC_CONFIG.get("export_interval", 5))
+    parser.add_argument("--database", help="Database file instead of the configured one")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(name)s] %(message)s")
+    if not CDC_CONFIG.get("enabled", False):
+        logging.getLogger("agent.change_export").warning("CDC_CONFIG enabled is off; no new changes are recorded")
+
+    db_connector = DBConnector(args.database)
+    if not db_connector.connect():
+        raise SystemExit("Could not open database %s" % db_connector.db_path)
+
+    exporter = NDJSONExporter(db_connector, args.output, args.consumer)
+    try:
+        exporter.export(args.from_start)
+        while args.follow:
+            time.sleep(args.interval)
+            exporter.export()
+    except KeyboardInterrupt:
+        pass
+    return exporter.exported
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import json
+import logging
+import datetime
+
+class CheckpointStore:
+    """Named progress records in agent_checkpoints, one per (agent type, name)
+
+    Checkpoints belong to the role rather than the agent id, so a restarted agent (or
+    the next lease holder) picks up where the previous one stopped. Save inside the
+    transaction that does the work so the two commit or roll back together.
+    """
+
+    def __init__(self, db_connector):
+        self.db_connector = db_connector
+        self.logger = logging.getLogger("agent.checkpoints")
+
+    def load(self, agent_type, name, default=None):
+        rows = self.db_connector.query(
+            "SELECT state FROM agent_checkpoints WHERE agent_type = ? AND name = ?",
+            (agent_type, name), row_mode="tuple"
+        )
+        return json.loads(rows[0][0]) if rows else default
+
+    def save(self, agent_type, name, state, agent_id=None):
+        self.db_connector.execute("""
+        INSERT INTO agent_checkpoints (agent_type, name, state, agent_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(agent_type, name) DO UPDATE SET
+            state = excluded.state, agent_id = excluded.agent_id, updated_at = CURRENT_TIMESTAMP
+        """, (agent_type, name, json.dumps(state, separators=(",", ":")), agent_id))
+
+
+def dates_after(last, end, limit):
+    """Dates after last up to end ("YYYY-MM-DD"), keeping only the most recent limit of them"""
+    end_day = datetime.datetime.strptime(end, "%Y-%m-%d").date()
+    first = end_day - datetime.timedelta(days=limit - 1)
+    if last:
+        first = max(first, datetime.datetime.strptime(last, "%Y-%m-%d").date() + datetime.timedelta(days=1))
+    return [
+        (first + datetime.timedelta(days=offset)).strftime("%Y-%m-%d")
+        for offset in range((end_day - first).days + 1)
+    ]
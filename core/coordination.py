@@ -0,0 +1,173 @@
+import os
+import time
+import bisect
+import socket
+import hashlib
+import logging
+from contextlib import contextmanager
+from config.settings import COORDINATION_CONFIG
+
+class LeaseLostError(Exception):
+    """Raised when a fenced write is attempted with a token that is no longer current"""
+
+
+class DuplicateAgentError(Exception):
+    """Raised when an agent id is already in use by another live process"""
+
+
+class LeaseManager:
+    """Time-limited leases in agent_leases, with a fencing token that grows on every change of holder"""
+
+    def __init__(self, db_connector, holder_id, ttl=None):
+        self.db_connector = db_connector
+        self.holder_id = holder_id
+        self.ttl = ttl or COORDINATION_CONFIG.get("lease_ttl", 60)
+        self.logger = logging.getLogger("agent.coordination")
+
+        # role -> fencing token for leases this holder currently owns
+        self.held = {}
+
+    def acquire(self, role):
+        """Acquire or renew a lease; returns the fencing token, or None if someone else holds it"""
+        now = time.time()
+
+        with self.db_connector.transaction():
+            self.db_connector.execute(
+                "INSERT OR IGNORE INTO agent_leases (role, fencing_token, expires_at) VALUES (?, 0, 0)",
+                (role,)
+            )
+            holder_id, token, expires_at = self.db_connector.query(
+                "SELECT holder_id, fencing_token, expires_at FROM agent_leases WHERE role = ?",
+                (role,), row_mode="tuple"
+            )[0]
+
+            if holder_id == self.holder_id and expires_at > now:
+                # Renewal keeps the token, so writes already in flight stay valid
+                self.db_connector.execute(
+                    "UPDATE agent_leases SET expires_at = ? WHERE role = ?", (now + self.ttl, role)
+                )
+            elif holder_id is None or expires_at <= now:
+                token += 1
+                self.db_connector.execute("""
+                UPDATE agent_leases
+                SET holder_id = ?, fencing_token = ?, expires_at = ?, acquired_at = ?
+                WHERE role = ?
+                """, (self.holder_id, token, now + self.ttl, now, role))
+                self.logger.info("%s acquired lease %s (token %d)", self.holder_id, role, token)
+            else:
+                self.held.pop(role, None)
+                return None
+
+        self.held[role] = token
+        return token
+
+    def renew_all(self):
+        """Extend every lease still held; leases lost in the meantime are dropped"""
+        for role in list(self.held):
+            if self.acquire(role) is None:
+                self.logger.warning("%s lost lease %s", self.holder_id, role)
+
+    def release(self, role):
+        """Give a lease up early so another worker can take over without waiting for expiry"""
+        self.db_connector.execute(
+            "UPDATE agent_leases SET expires_at = 0 WHERE role = ? AND holder_id = ?",
+            (role, self.holder_id)
+        )
+        self.held.pop(role, None)
+
+    def current_holder(self, role):
+        """Holder of an unexpired lease, or None"""
+        rows = self.db_connector.query(
+            "SELECT holder_id FROM agent_leases WHERE role = ? AND expires_at > ?",
+            (role, time.time()), row_mode="tuple"
+        )
+        return rows[0][0] if rows else None
+
+    @contextmanager
+    def fenced(self, role, token):
+        """Transaction that only commits if the token is still the current one for the role"""
+        with self.db_connector.transaction():
+            rows = self.db_connector.query(
+                "SELECT fencing_token FROM agent_leases WHERE role = ? AND holder_id = ?",
+                (role, self.holder_id), row_mode="tuple"
+            )
+            if not rows or rows[0][0] != token:
+                self.held.pop(role, None)
+                raise LeaseLostError(f"Lease {role} is no longer held with token {token}")
+            yield
+
+
+class ConsistentHashRing:
+    """Maps keys to members so that a change of membership only moves the keys of that member"""
+
+    def __init__(self, members, virtual_nodes=None):
+        self.virtual_nodes = virtual_nodes or COORDINATION_CONFIG.get("virtual_nodes", 64)
+        self._ring = []
+        for member in members:
+            for replica in range(self.virtual_nodes):
+                self._ring.append((self._hash(f"{member}#{replica}"), member))
+        self._ring.sort()
+        self._points = [point for point, _ in self._ring]
+
+    def _hash(self, value):
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def owner(self, key):
+        """Member responsible for a key, or None for an empty ring"""
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+def live_members(db_connector, agent_type, timeout=None):
+    """Agent ids of a type whose heartbeat is recent enough to count them as alive"""
+    timeout = timeout or COORDINATION_CONFIG.get("member_timeout", 60)
+    rows = db_connector.query("""
+    SELECT agent_id
+    FROM agent_registry
+    WHERE agent_type = ? AND status != 'inactive'
+    AND last_heartbeat >= datetime('now', ?)
+    ORDER BY agent_id
+    """, (agent_type, f"-{int(timeout)} seconds"), row_mode="tuple")
+    return [agent_id for (agent_id,) in rows]
+
+
+def worker_name():
+    """Name of this worker process, part of its default agent ids
+
+    COORDINATION_CONFIG worker_name or the AGENT_WORKER_NAME environment variable give a
+    stable name (one per process); otherwise it is "<host>_<pid>", unique to the process.
+    """
+    return (
+        COORDINATION_CONFIG.get("worker_name") or os.environ.get("AGENT_WORKER_NAME")
+        or f"{socket.gethostname()}_{os.getpid()}"
+    )
+
+
+def retire_dead_workers(db_connector, agent_type):
+    """Mark inactive the registrations of this host's exited processes, so their share moves now
+
+    Only "<agent_type>_<host>_<pid>" ids are recognised; on platforms without signal 0,
+    they are left to lapse after member_timeout instead.
+    """
+    if os.name != "posix":
+        return []
+    prefix = f"{agent_type}_{socket.gethostname()}_"
+    retired = []
+    for agent_id in live_members(db_connector, agent_type):
+        pid = agent_id[len(prefix):]
+        if not agent_id.startswith(prefix) or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        try:
+            os.kill(int(pid), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue  # Alive, owned by another user
+        db_connector.execute(
+            "UPDATE agent_registry SET status = 'inactive' WHERE agent_id = ? AND status != 'inactive'", (agent_id,)
+        )
+        retired.append(agent_id)
+    return retired
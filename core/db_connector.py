@@ -1,28 +1,116 @@
+import os
+import time
 import sqlite3
 import logging
 import json
+import pathlib
 import threading
-from config.settings import DATABASE_CONFIG
+import urllib.parse
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future
+from config.settings import DATABASE_CONFIG, PARTITION_CONFIG, CDC_CONFIG
+from core.partitioning import PartitionManager
+from core.write_queue import WriteBehindQueue
+
+ROW_MODES = ("dict", "tuple", "row", "namedtuple")
+
+# Bump whenever _initialize_schema changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 13
+
+# Statement of each change_log trigger, and the operation code it records
+CHANGE_OPERATIONS = (("insert", "I"), ("update", "U"), ("delete", "D"))
+
+# (kind, table, owner column, pending condition, age column) of every backlog counted by triggers
+BACKLOGS = (
+    ("messages", "agent_messages", "recipient_id", "{row}read = 0", "timestamp"),
+    ("tasks", "agent_tasks", "agent_id", "{row}status = 'pending'", "created_at"),
+    ("notifications", "system_notifications", "severity", "{row}acknowledged = 0", "timestamp")
+)
+
+class BackupRestarted(Exception):
+    """Raised from the backup progress callback to stop a copy that keeps restarting"""
+
 
 class DBConnector:
     """Database connector for SQLite with thread-local storage for connections"""
     
-    _local = threading.local()
-    
-    def __init__(self):
+    def __init__(self, db_path=None, in_memory=None):
         self.logger = logging.getLogger("agent.db_connector")
         self.db_config = DATABASE_CONFIG
         self.db_type = self.db_config.get("type", "sqlite")
-        self.db_path = self.db_config.get("database", "mcp_agent_system.db")
+        # An explicit path (e.g. a temp database for load tests) overrides the configured one
+        self.db_path = db_path or self.db_config.get("database", "mcp_agent_system.db")
+        self.journal_mode = self.db_config.get("journal_mode", "wal")
+        
+        # In-memory mode: every connection opens one named memdb database, shared by all threads
+        # of the process, and db_path only holds its snapshots
+        self.in_memory = self.db_config.get("in_memory", False) if in_memory is None else in_memory
+        self.memory_uri = None
+        self._memory_anchor = None
+        self._backup_lock = threading.Lock()
+        if self.in_memory:
+            name = urllib.parse.quote(str(pathlib.Path(self.db_path).resolve()), safe="")
+            self.memory_uri = f"file:/{name}?vfs=memdb"
+        
+        # Per instance, so read-only and read-write connectors never share a connection
+        self._local = threading.local()
+        # Read-only connector behind snapshot(), created on first use like the writer below
+        self._reader = None
+        self._reader_lock = threading.Lock()
+        self.row_mode = self.db_config.get("row_mode", "dict")
+        self.fetch_batch_size = self.db_config.get("fetch_batch_size", 500)
+        
+        # Column names -> namedtuple class, shared by all cursors with the same shape
+        self._row_classes = {}
+        
+        # Optional per-month files for the sales tables
+        self.partitions = PartitionManager(self) if PARTITION_CONFIG.get("enabled") else None
+        
+        # Whether the last connect() had to run the schema statements
+        self.schema_initialized = False
+        
+        # Write-behind: deferred writes go to one group-committing writer thread, started on first use
+        self.write_behind = self.db_config.get("write_behind", False)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        
+        # table -> callbacks(columns, rows), told about rows written through insert_rows/replace_range
+        self.write_hooks = {}
         
     def connect(self):
         """Connect to the database and initialize tables if needed"""
         try:
+            if self.in_memory and self._memory_anchor is None:
+                self._open_memory()
+            
             # Create connection for the main thread
-            self._get_connection()
+            conn = self._get_connection()
+            
+            # Fast path: an up-to-date database skips schema setup entirely
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == SCHEMA_VERSION:
+                self.schema_initialized = False
+                # CDC can be switched on or off without a schema change
+                self._sync_change_triggers(conn)
+                return True
+            
+            if version > SCHEMA_VERSION:
+                self.logger.warning("Database schema version %d is newer than %d", version, SCHEMA_VERSION)
+                return True
             
             # Initialize database schema
             self._initialize_schema()
+            self.schema_initialized = True
+            
+            # Persistent per database file, so setting it once is enough for all threads.
+            # Runs after the schema so auto_vacuum is applied before the file is first written.
+            # An in-memory database always journals in memory; its snapshots get the mode instead.
+            if self.journal_mode and not self.in_memory:
+                conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.logger.info("Database schema initialized at version %d", SCHEMA_VERSION)
             return True
         except Exception as e:
             self.logger.error("Database connection error: %s", str(e))
@@ -33,24 +121,111 @@ class DBConnector:
         thread_id = threading.current_thread().name
         
         if not hasattr(self._local, 'connection') or self._local.connection is None:
-            self._local.connection = sqlite3.connect(self.db_path)
-            self._local.connection.row_factory = self._dict_factory
+            # uri=True lets ATTACH open old partitions with mode=ro
+            self._local.connection = sqlite3.connect(self.memory_uri or self.db_path, uri=True)
+            # Rows are fetched as plain tuples and decoded per query (see _decode_rows)
+            self._local.connection.row_factory = None
             self.logger.info("Database connection established for thread %s", thread_id)
             
         return self._local.connection
     
-    def _dict_factory(self, cursor, row):
-        """Convert database row to dictionary"""
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            d[col[0]] = row[idx]
-        return d
+    def _open_memory(self):
+        """Create the in-memory database and load the last snapshot into it"""
+        started = time.perf_counter()
+        # The database lives as long as one connection to it is open; this one is never used for queries
+        self._memory_anchor = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False)
+        
+        if os.path.exists(self.db_path):
+            disk = sqlite3.connect(self.db_path)
+            try:
+                # memdb cannot open a WAL database, so the file is switched back before copying
+                disk.execute("PRAGMA journal_mode = delete")
+                disk.backup(self._memory_anchor)
+            finally:
+                disk.close()
+            self.logger.info(
+                "Restored %s into memory in %.3fs", self.db_path, time.perf_counter() - started
+            )
+    
+    def backup(self):
+        """Snapshot the in-memory database to db_path a few pages at a time; returns seconds taken"""
+        if not self.in_memory or self._memory_anchor is None:
+            return 0.0
+        
+        with self._backup_lock:
+            started = time.perf_counter()
+            temp_path = f"{self.db_path}.backup"
+            source = sqlite3.connect(self.memory_uri, uri=True)
+            target = sqlite3.connect(temp_path)
+            progress = {"remaining": None, "restarts": 0}
+            
+            def on_progress(status, remaining, total):
+                # A write from another connection restarts the copy, so remaining goes back up
+                if progress["remaining"] is not None and remaining > progress["remaining"]:
+                    progress["restarts"] += 1
+                    if progress["restarts"] > self.db_config.get("backup_max_restarts", 3):
+                        raise BackupRestarted()
+                progress["remaining"] = remaining
+            
+            try:
+                try:
+                    source.backup(
+                        target, pages=self.db_config.get("backup_pages", 1024), progress=on_progress,
+                        sleep=self.db_config.get("backup_step_delay", 0.005)
+                    )
+                except BackupRestarted:
+                    # Under constant writes the stepped copy never finishes; one step holds
+                    # writers off only for a memory-speed copy
+                    self.logger.warning("Backup restarted %d times, finishing in one step", progress["restarts"])
+                    source.backup(target)
+                
+                # The file is also opened directly when in-memory mode is off again
+                if self.journal_mode:
+                    target.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            finally:
+                target.close()
+                source.close()
+            
+            # Swapped in whole, so a crash mid-copy leaves the previous snapshot intact
+            os.replace(temp_path, self.db_path)
+            elapsed = time.perf_counter() - started
+            self.logger.info("Backed up in-memory database to %s in %.3fs", self.db_path, elapsed)
+            return elapsed
+    
+    def _prepare_cursor(self, cursor, row_mode):
+        """Configure a cursor for the requested row mode"""
+        if row_mode not in ROW_MODES:
+            raise ValueError("Unknown row mode: %s" % row_mode)
+        
+        # sqlite3.Row is built in C, every other mode starts from plain tuples
+        cursor.row_factory = sqlite3.Row if row_mode == "row" else None
+    
+    def _decode_rows(self, cursor, rows, row_mode):
+        """Convert a batch of fetched rows to the requested row mode"""
+        if row_mode in ("tuple", "row") or not rows:
+            return rows
+        
+        # Column names are resolved once per batch instead of once per row
+        columns = tuple(col[0] for col in cursor.description)
+        
+        if row_mode == "dict":
+            return [dict(zip(columns, row)) for row in rows]
+        
+        row_class = self._row_classes.get(columns)
+        if row_class is None:
+            row_class = namedtuple("Row", columns, rename=True)
+            self._row_classes[columns] = row_class
+        return [row_class._make(row) for row in rows]
     
     def _initialize_schema(self):
         """Initialize database schema if tables don't exist"""
         conn = self._get_connection()
         cursor = conn.cursor()
         
+        # Free pages can be released in small steps by the retention job.
+        # Only takes effect on a fresh database; RetentionManager converts old ones.
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
         # Agent registry table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS agent_registry (
@@ -62,6 +237,17 @@ class DBConnector:
         )
         """)
         
+        # Leases for singleton roles shared by several worker processes
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_leases (
+            role TEXT PRIMARY KEY,
+            holder_id TEXT,
+            fencing_token INTEGER NOT NULL DEFAULT 0,
+            expires_at REAL NOT NULL DEFAULT 0,
+            acquired_at REAL
+        )
+        """)
+        
         # Agent messages table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS agent_messages (
@@ -71,10 +257,94 @@ class DBConnector:
             message_type TEXT NOT NULL,
             content TEXT NOT NULL,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            read INTEGER DEFAULT 0
+            read INTEGER DEFAULT 0,
+            content_format TEXT NOT NULL DEFAULT 'json'
+        )
+        """)
+        
+        # Messages written before the codec existed are JSON text
+        self._add_column(cursor, "agent_messages", "content_format", "TEXT NOT NULL DEFAULT 'json'")
+        
+        # Claim-check storage for large message payloads, shared by digest
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS message_payloads (
+            digest TEXT PRIMARY KEY,
+            content BLOB NOT NULL,
+            content_format TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        
+        # Topics: one log row per publish, read by every subscriber group through its own cursor.
+        # AUTOINCREMENT keeps seq from being reused once old entries are truncated.
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS topic_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            sender_id TEXT NOT NULL,
+            message_type TEXT NOT NULL,
+            content BLOB NOT NULL,
+            content_format TEXT NOT NULL DEFAULT 'json',
+            published_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_topic_log_topic_seq ON topic_log (topic, seq)")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS topic_subscriptions (
+            topic TEXT NOT NULL,
+            subscriber TEXT NOT NULL,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (topic, subscriber)
+        ) WITHOUT ROWID
+        """)
+        
+        # Change-data capture: triggers append one record per changed row of the CDC_CONFIG
+        # tables, and external consumers read past their own offset by seq
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            row_id INTEGER,
+            data TEXT,
+            changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_consumers (
+            consumer TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        """)
+        
+        # Mergeable per-day sketches (HyperLogLog of clients, KLL of order values), so distinct
+        # counts and quantiles over any period come from blobs instead of raw orders
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_sketches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            source TEXT NOT NULL,
+            sketch_type TEXT NOT NULL,
+            data BLOB NOT NULL,
+            UNIQUE (date, source, sketch_type)
         )
         """)
         
+        # Progress of each agent role, so restarts resume instead of replaying work
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_checkpoints (
+            agent_type TEXT NOT NULL,
+            name TEXT NOT NULL,
+            state TEXT NOT NULL,
+            agent_id TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (agent_type, name)
+        ) WITHOUT ROWID
+        """)
+        
         # Agent tasks table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS agent_tasks (
@@ -89,6 +359,23 @@ class DBConnector:
         )
         """)
         
+        # One row per agent cycle: wall/CPU time and per-phase breakdown ({phase: [wall_ms, cpu_ms]})
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_cycle_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_id TEXT NOT NULL,
+            agent_type TEXT NOT NULL,
+            started_at TIMESTAMP NOT NULL,
+            wall_ms REAL NOT NULL,
+            cpu_ms REAL NOT NULL,
+            ok INTEGER NOT NULL,
+            phases TEXT
+        )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_agent_cycle_metrics_agent ON agent_cycle_metrics (agent_id, started_at)"
+        )
+        
         # Sales metrics table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS sales_metrics (
@@ -100,6 +387,36 @@ class DBConnector:
         )
         """)
         
+        # One row per (date, source, metric_type). Older databases may hold duplicates from
+        # re-run collections: keep the newest of each, then enforce the key.
+        key_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_sales_metrics_key'"
+        ).fetchone()
+        if not key_exists:
+            removed = cursor.execute("""
+            DELETE FROM sales_metrics WHERE id NOT IN (
+                SELECT MAX(id) FROM sales_metrics GROUP BY date, source, metric_type
+            )
+            """).rowcount
+            if removed:
+                self.logger.info("Removed %d duplicate sales_metrics rows", removed)
+            cursor.execute(
+                "CREATE UNIQUE INDEX idx_sales_metrics_key ON sales_metrics (date, source, metric_type)"
+            )
+        
+        # Sub-daily metric points; compacted into hourly buckets, then into sales_metrics
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales_metric_points (
+            resolution INTEGER NOT NULL,
+            bucket_start TEXT NOT NULL,
+            source TEXT NOT NULL,
+            metric_type TEXT NOT NULL,
+            value REAL NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (resolution, bucket_start, source, metric_type)
+        ) WITHOUT ROWID
+        """)
+        
         # Sales insights table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS sales_insights (
@@ -112,6 +429,22 @@ class DBConnector:
         )
         """)
         
+        # Per-weekday baselines for the seasonal anomaly detector
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS metric_baselines (
+            source TEXT NOT NULL,
+            metric_type TEXT NOT NULL,
+            weekday INTEGER NOT NULL,
+            samples TEXT NOT NULL,
+            last_date TEXT,
+            mean REAL,
+            stdev REAL,
+            median REAL,
+            mad REAL,
+            PRIMARY KEY (source, metric_type, weekday)
+        )
+        """)
+        
         # System notifications table
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS system_notifications (
@@ -135,8 +468,197 @@ class DBConnector:
         )
         """)
         
+        # Catalog columns, so reports are listed by index instead of parsing parameters
+        self._add_column(cursor, "report_archive", "report_id", "TEXT")
+        self._add_column(cursor, "report_archive", "period_start", "TEXT")
+        self._add_column(cursor, "report_archive", "period_end", "TEXT")
+        cursor.execute("""
+        UPDATE report_archive
+        SET report_id = json_extract(parameters, '$.report_id'),
+            period_start = COALESCE(json_extract(parameters, '$.start_date'), json_extract(parameters, '$.date')),
+            period_end = COALESCE(json_extract(parameters, '$.end_date'), json_extract(parameters, '$.date'))
+        WHERE period_end IS NULL AND json_valid(parameters)
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_report_archive_type_period "
+            "ON report_archive (report_type, period_end, id)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_report_archive_period ON report_archive (period_end, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_report_archive_report_id ON report_archive (report_id)")
+        
+        # Backlog gauges for telemetry, kept current by triggers instead of COUNT(*) scans
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS backlog_counters (
+            kind TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            depth INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, owner)
+        ) WITHOUT ROWID
+        """)
+        for kind, table, owner, pending, age_column in BACKLOGS:
+            self._create_backlog_triggers(cursor, kind, table, owner, pending)
+            condition = pending.format(row="")
+            # Partial index: the oldest pending item is one index lookup away
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_backlog "
+                f"ON {table} ({age_column}) WHERE {condition}"
+            )
+            # Recount once, for rows written before the triggers existed
+            cursor.execute("DELETE FROM backlog_counters WHERE kind = ?", (kind,))
+            cursor.execute(
+                f"INSERT INTO backlog_counters (kind, owner, depth) "
+                f"SELECT ?, {owner}, COUNT(*) FROM {table} WHERE {condition} GROUP BY {owner}",
+                (kind,)
+            )
+        
+        # Recreated, so they pick up columns added by this schema version
+        self._sync_change_triggers(conn, rebuild=True)
+        
         conn.commit()
     
+    def _create_backlog_triggers(self, cursor, kind, table, owner, pending):
+        """Triggers keeping backlog_counters in step with inserts, updates and deletes of a table"""
+        was_pending = pending.format(row="OLD.")
+        is_pending = pending.format(row="NEW.")
+        
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {kind}_backlog_insert AFTER INSERT ON {table}
+        WHEN {is_pending}
+        BEGIN
+            INSERT INTO backlog_counters (kind, owner, depth) VALUES ('{kind}', NEW.{owner}, 1)
+            ON CONFLICT(kind, owner) DO UPDATE SET depth = depth + 1;
+        END
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {kind}_backlog_update AFTER UPDATE ON {table}
+        WHEN ({was_pending}) IS NOT ({is_pending}) OR OLD.{owner} IS NOT NEW.{owner}
+        BEGIN
+            UPDATE backlog_counters SET depth = depth - 1
+            WHERE kind = '{kind}' AND owner = OLD.{owner} AND ({was_pending});
+            INSERT INTO backlog_counters (kind, owner, depth) SELECT '{kind}', NEW.{owner}, 1 WHERE {is_pending}
+            ON CONFLICT(kind, owner) DO UPDATE SET depth = depth + 1;
+        END
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {kind}_backlog_delete AFTER DELETE ON {table}
+        WHEN {was_pending}
+        BEGIN
+            UPDATE backlog_counters SET depth = depth - 1 WHERE kind = '{kind}' AND owner = OLD.{owner};
+        END
+        """)
+    
+    def _change_tables(self):
+        return set(CDC_CONFIG.get("tables", [])) if CDC_CONFIG.get("enabled", False) else set()
+    
+    def _change_trigger_sql(self, conn, table, schema="main"):
+        """{trigger name: CREATE TRIGGER statement} recording every change of a table in change_log
+        
+        Tables in attached partitions get TEMP triggers on this connection: a trigger stored
+        in the partition file could not write to the main database.
+        """
+        columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+        
+        def row_json(row, names):
+            return "json_object(" + ", ".join(f"'{name}', {row}.{name}" for name in names) + ")"
+        
+        # A delete only needs to say which row went
+        key_columns = [name for name in ("id", "date") if name in columns]
+        records = {
+            "insert": ("NEW", row_json("NEW", columns)),
+            "update": ("NEW", row_json("NEW", columns)),
+            "delete": ("OLD", row_json("OLD", key_columns))
+        }
+        # Upserts that leave a row as it was record nothing
+        changed = " OR ".join(f"OLD.{name} IS NOT NEW.{name}" for name in columns)
+        
+        statements = {}
+        for statement, operation in CHANGE_OPERATIONS:
+            row, data = records[statement]
+            if schema == "main":
+                name = f"cdc_{table}_{statement}"
+                create = f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {statement.upper()} ON {table}"
+            else:
+                name = f"cdc_{schema}_{table}_{statement}"
+                create = f"CREATE TEMP TRIGGER IF NOT EXISTS {name} AFTER {statement.upper()} ON {schema}.{table}"
+            statements[name] = f"""
+            {create}
+            {f"WHEN {changed}" if statement == "update" else ""}
+            BEGIN
+                INSERT INTO change_log (table_name, operation, row_id, data)
+                VALUES ('{table}', '{operation}', {row}.rowid, {data});
+            END
+            """
+        return statements
+    
+    def _sync_change_triggers(self, conn, rebuild=False):
+        """Create the change_log triggers of the CDC tables in main, and drop those of other tables"""
+        existing = {
+            row[0] for row in conn.execute(
+                "SELECT name FROM main.sqlite_master WHERE type = 'trigger' AND name LIKE 'cdc\\_%' ESCAPE '\\'"
+            ).fetchall()
+        }
+        wanted = {
+            f"cdc_{table}_{statement}": table
+            for table in self._change_tables() for statement, _ in CHANGE_OPERATIONS
+        }
+        
+        for name in existing:
+            if rebuild or name not in wanted:
+                conn.execute(f"DROP TRIGGER IF EXISTS main.{name}")
+        for table in sorted({table for name, table in wanted.items() if rebuild or name not in existing}):
+            for sql in self._change_trigger_sql(conn, table).values():
+                conn.execute(sql)
+    
+    def _attach_change_triggers(self, conn, schema, tables):
+        """TEMP change_log triggers on the CDC tables of a partition attached read-write"""
+        for table in sorted(self._change_tables() & set(tables)):
+            exists = conn.execute(
+                "SELECT 1 FROM temp.sqlite_master WHERE type = 'trigger' AND name = ?",
+                (f"cdc_{schema}_{table}_insert",)
+            ).fetchone()
+            if not exists:
+                for sql in self._change_trigger_sql(conn, table, schema).values():
+                    conn.execute(sql)
+    
+    def _detach_change_triggers(self, conn, schema, tables):
+        """Drop a partition's TEMP triggers before it is detached; they would never fire again"""
+        for table in tables:
+            for statement, _ in CHANGE_OPERATIONS:
+                conn.execute(f"DROP TRIGGER IF EXISTS temp.cdc_{schema}_{table}_{statement}")
+    
+    def _in_transaction(self):
+        """Whether the current thread is inside a transaction() block"""
+        return getattr(self._local, "transaction_depth", 0) > 0
+    
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Group several execute() calls into a single commit; nested blocks join the outer one"""
+        conn = self._get_connection()
+        depth = getattr(self._local, "transaction_depth", 0)
+        
+        if depth == 0:
+            # IMMEDIATE takes the write lock up front instead of failing midway
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        self._local.transaction_depth = depth + 1
+        
+        try:
+            yield conn
+        except Exception:
+            self._local.transaction_depth = depth
+            if depth == 0:
+                conn.rollback()
+            raise
+        
+        self._local.transaction_depth = depth
+        if depth == 0:
+            conn.commit()
+    
+    def _add_column(self, cursor, table, column, definition):
+        """Add a column to a table created by an older schema version"""
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
     def execute(self, query, params=()):
         """Execute a query and return the last row id"""
         conn = self._get_connection()
@@ -144,27 +666,443 @@ class DBConnector:
         
         try:
             cursor.execute(query, params)
-            conn.commit()
+            if not self._in_transaction():
+                conn.commit()
             return cursor.lastrowid
         except Exception as e:
-            conn.rollback()
+            if not self._in_transaction():
+                conn.rollback()
+            self.logger.error("Query error: %s", str(e))
+            raise
+    
+    def executemany(self, query, param_rows):
+        """Execute a query for every parameter tuple and return the number of affected rows"""
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany(query, param_rows)
+            if not self._in_transaction():
+                conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            if not self._in_transaction():
+                conn.rollback()
             self.logger.error("Query error: %s", str(e))
             raise
     
-    def query(self, query, params=()):
-        """Execute a query and return all results as a list of dictionaries"""
+    def execute_deferred(self, query, params=(), many=False):
+        """Write that may be batched by the writer thread; returns a Future of lastrowid (rowcount if many)
+        
+        Without write_behind, or inside a transaction() block, the write runs immediately
+        and the returned future is already resolved.
+        """
+        if not self.write_behind or self._in_transaction():
+            future = Future()
+            try:
+                future.set_result(self.executemany(query, params) if many else self.execute(query, params))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = WriteBehindQueue(
+                    self,
+                    batch_size=self.db_config.get("write_batch_size", 200),
+                    batch_delay=self.db_config.get("write_batch_delay", 0.005),
+                    lock_retries=self.db_config.get("write_lock_retries", 12)
+                )
+            writer = self._writer
+        return writer.submit(query, params, many)
+    
+    def flush(self, timeout=None):
+        """Barrier: wait until every deferred write queued so far is committed
+        
+        Skipped inside a transaction() block, returning False: the writer thread cannot commit
+        while this thread holds the write lock, so waiting would never end. Reads there see
+        only what was committed before the transaction began, plus its own writes.
+        """
+        if self._in_transaction():
+            self.logger.debug("flush() skipped inside a transaction")
+            return False
+        if self._writer is not None:
+            self._writer.flush(timeout)
+        return True
+    
+    def stop_writer(self):
+        """Commit queued deferred writes and stop the writer thread"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.stop()
+    
+    def query(self, query, params=(), row_mode=None):
+        """Execute a query and return all results (dictionaries unless row_mode says otherwise)"""
+        row_mode = row_mode or self.row_mode
         conn = self._get_connection()
         cursor = conn.cursor()
         
         try:
+            self._prepare_cursor(cursor, row_mode)
             cursor.execute(query, params)
-            return cursor.fetchall()
+            return self._decode_rows(cursor, cursor.fetchall(), row_mode)
         except Exception as e:
             self.logger.error("Query error: %s", str(e))
             raise
     
+    def iter_query(self, query, params=(), row_mode="tuple", batch_size=None):
+        """Execute a query and stream results in fetchmany() batches instead of materializing them"""
+        batch_size = batch_size or self.fetch_batch_size
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            self._prepare_cursor(cursor, row_mode)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from self._decode_rows(cursor, rows, row_mode)
+        except Exception as e:
+            self.logger.error("Query error: %s", str(e))
+            raise
+        finally:
+            cursor.close()
+    
+    def _range_query(self, conn, table, columns, start_date, end_date, where, params, order_by, limit):
+        """Build the SQL for a date range read, fanned out over the partitions that cover it"""
+        condition = "date >= ? AND date <= ?"
+        if where:
+            condition += f" AND ({where})"
+        part_params = (start_date, end_date) + tuple(params)
+        
+        if self.partitions and self.partitions.is_partitioned(table):
+            schemas = self.partitions.attach_for_read(conn, start_date, end_date)
+        else:
+            schemas = ["main"]
+        
+        if not schemas:
+            return None, ()
+        
+        parts = [f"SELECT {columns} FROM {schema}.{table} WHERE {condition}" for schema in schemas]
+        sql = parts[0] if len(parts) == 1 else "SELECT * FROM (" + " UNION ALL ".join(parts) + ")"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        
+        return sql, part_params * len(parts)
+    
+    def query_range(self, table, columns, start_date, end_date, where="", params=(),
+                    order_by=None, limit=None, row_mode=None):
+        """Read rows of a table within an inclusive date range, across partitions if enabled"""
+        sql, sql_params = self._range_query(
+            self._get_connection(), table, columns, start_date, end_date, where, params, order_by, limit
+        )
+        if sql is None:
+            return []
+        return self.query(sql, sql_params, row_mode=row_mode)
+    
+    def iter_range(self, table, columns, start_date, end_date, where="", params=(),
+                   order_by=None, limit=None, row_mode="tuple"):
+        """Streaming variant of query_range"""
+        sql, sql_params = self._range_query(
+            self._get_connection(), table, columns, start_date, end_date, where, params, order_by, limit
+        )
+        if sql is None:
+            return iter(())
+        return self.iter_query(sql, sql_params, row_mode=row_mode)
+    
+    def add_write_hook(self, table, callback):
+        """Call callback(columns, rows, replaced) after rows are written to table (queued, for deferred writes)
+        
+        replaced is the (start_date, end_date) a replace_range call cleared first, else None.
+        """
+        hooks = self.write_hooks.setdefault(table, [])
+        if callback not in hooks:
+            hooks.append(callback)
+    
+    def _run_write_hooks(self, table, columns, rows, replaced=None):
+        for callback in self.write_hooks.get(table, ()):
+            try:
+                callback(columns, rows, replaced)
+            except Exception as e:
+                # A failing observer must not fail the write that already happened
+                self.logger.error("Write hook on %s failed: %s", table, str(e))
+    
+    def insert_rows(self, table, columns, rows, allow_read_only=False, deferred=False, update_on=None):
+        """Insert many rows, routing each to its partition by the "date" column if enabled
+        
+        deferred hands unpartitioned inserts to the write-behind queue; partitioned ones
+        always run immediately, since partitions are attached per connection.
+        update_on names the columns of a unique key: rows that already exist are updated
+        instead of duplicated, so re-running an insert is harmless.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" * len(columns))
+        conflict = ""
+        if update_on:
+            updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in update_on)
+            conflict = f" ON CONFLICT({', '.join(update_on)}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+        
+        if not (self.partitions and self.partitions.is_partitioned(table)):
+            sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}){conflict}"
+            if deferred:
+                self.execute_deferred(sql, rows, many=True)
+            else:
+                self.executemany(sql, rows)
+            self._run_write_hooks(table, columns, rows)
+            return len(rows)
+        
+        # Group by month so each partition file is locked once
+        date_index = list(columns).index("date")
+        by_partition = {}
+        for row in rows:
+            by_partition.setdefault(self.partitions.partition_key(row[date_index]), []).append(row)
+        
+        conn = self._get_connection()
+        for key, partition_rows in by_partition.items():
+            schema = self.partitions.attach_for_write(conn, key, allow_read_only)
+            self.executemany(
+                f"INSERT INTO {schema}.{table} ({column_list}) VALUES ({placeholders}){conflict}", partition_rows
+            )
+        
+        self._run_write_hooks(table, columns, rows)
+        return len(rows)
+    
+    def replace_day(self, table, date, columns, rows, where="", params=()):
+        """Atomically replace the rows of one day (optionally narrowed by where) with new rows"""
+        return self.replace_range(table, date, date, columns, rows, where, params)
+    
+    def replace_range(self, table, start_date, end_date, columns, rows, where="", params=(),
+                      allow_read_only=False):
+        """Atomically replace the rows of an inclusive date range (optionally narrowed by where)
+        
+        Rows must fall inside the range. Across partitions, the range is held to one
+        transaction over every partition file it touches.
+        """
+        rows = list(rows)
+        column_list = ", ".join(columns)
+        placeholders = ", ".join("?" * len(columns))
+        condition = "date >= ? AND date <= ?"
+        if where:
+            condition += f" AND ({where})"
+        
+        if self.partitions and self.partitions.is_partitioned(table):
+            # Attach before the transaction starts; ATTACH is not allowed inside one
+            conn = self._get_connection()
+            schemas = {
+                key: self.partitions.attach_for_write(conn, key, allow_read_only)
+                for key in self.partitions.partition_keys(start_date, end_date)
+            }
+            date_index = list(columns).index("date")
+            by_schema = {schema: [] for schema in schemas.values()}
+            for row in rows:
+                by_schema[schemas[self.partitions.partition_key(row[date_index])]].append(row)
+        else:
+            by_schema = {"main": rows}
+        
+        with self.transaction():
+            for schema, schema_rows in by_schema.items():
+                self.execute(f"DELETE FROM {schema}.{table} WHERE {condition}", (start_date, end_date) + tuple(params))
+                if schema_rows:
+                    self.executemany(
+                        f"INSERT INTO {schema}.{table} ({column_list}) VALUES ({placeholders})", schema_rows
+                    )
+        
+        self._run_write_hooks(table, columns, rows, replaced=(start_date, end_date))
+        return len(rows)
+    
+    def read_changes(self, after_seq=0, limit=None, tables=None):
+        """
+        Change records after a seq, oldest first
+        
+        Returns:
+            list: dicts of seq, table_name, operation (I, U or D), row_id, data (the row's
+            columns, or only id and date for a delete) and changed_at (UTC, milliseconds)
+        """
+        where = ""
+        params = [after_seq]
+        if tables:
+            where = f"AND table_name IN ({','.join('?' * len(tables))})"
+            params.extend(tables)
+        params.append(limit or CDC_CONFIG.get("batch_size", 500))
+        
+        # Range scan on the seq primary key, starting right after the offset
+        changes = self.query(f"""
+        SELECT seq, table_name, operation, row_id, data, changed_at
+        FROM change_log
+        WHERE seq > ? {where}
+        ORDER BY seq
+        LIMIT ?
+        """, params, row_mode="dict")
+        
+        for change in changes:
+            change["data"] = json.loads(change["data"]) if change["data"] else None
+        return changes
+    
+    def register_change_consumer(self, consumer, from_start=False):
+        """Create a consumer offset at the end of change_log (or before its oldest record)"""
+        start = "0" if from_start else "(SELECT COALESCE(MAX(seq), 0) FROM change_log)"
+        self.execute(f"""
+        INSERT INTO change_consumers (consumer, last_seq)
+        VALUES (?, {start})
+        ON CONFLICT(consumer) DO NOTHING
+        """, (consumer,))
+    
+    def poll_changes(self, consumer, limit=None):
+        """Change records past a consumer's offset; nothing is consumed until ack_changes"""
+        offset = self.query(
+            "SELECT last_seq FROM change_consumers WHERE consumer = ?", (consumer,), row_mode="tuple"
+        )
+        if not offset:
+            self.register_change_consumer(consumer)
+            return []
+        return self.read_changes(offset[0][0], limit)
+    
+    def ack_changes(self, consumer, seq):
+        """Advance a consumer's offset to seq; an offset never moves backwards"""
+        self.execute("""
+        UPDATE change_consumers
+        SET last_seq = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE consumer = ? AND last_seq < ?
+        """, (seq, consumer, seq))
+    
+    def change_lag(self):
+        """[(consumer, last_seq, records not yet consumed)] for every consumer"""
+        return self.query("""
+        SELECT c.consumer, c.last_seq, (SELECT COUNT(*) FROM change_log WHERE seq > c.last_seq)
+        FROM change_consumers c
+        ORDER BY c.consumer
+        """, row_mode="tuple")
+    
+    def truncate_changes(self):
+        """Drop whole segments of change_log every consumer has passed, and records past max_age_days"""
+        removed = 0
+        conn = self._get_connection()
+        segment_size = CDC_CONFIG.get("segment_size", 10000)
+        
+        consumed = conn.execute("SELECT MIN(last_seq) FROM change_consumers").fetchone()[0]
+        if consumed:
+            # Only segments entirely at or below the slowest offset go
+            boundary = (consumed + 1) // segment_size * segment_size
+            if boundary:
+                removed += conn.execute("DELETE FROM change_log WHERE seq < ?", (boundary,)).rowcount
+                conn.commit()
+        
+        # A consumer that stopped reading must not pin the log forever
+        max_age = CDC_CONFIG.get("max_age_days")
+        if max_age:
+            removed += conn.execute(
+                "DELETE FROM change_log WHERE changed_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)",
+                (f"-{max_age} days",)
+            ).rowcount
+            conn.commit()
+        
+        if removed:
+            self.logger.info("Truncated %d change records", removed)
+        return removed
+    
+    def snapshot(self, start_date=None, end_date=None):
+        """Read-only transaction giving a consistent view for a whole report or analysis run"""
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = ReadOnlyConnection(self.db_path, self.in_memory)
+            reader = self._reader
+        return reader.snapshot(start_date, end_date)
+    
     def close(self):
         """Close the database connection for the current thread"""
+        if hasattr(self._local, 'connection') and self._local.connection:
+            self._local.connection.close()
+            self._local.connection = None
+        if self._reader is not None:
+            self._reader.close()
+
+
+class ReadOnlyConnection(DBConnector):
+    """Read-only connector (mode=ro, query_only) for long scans that must not block writers"""
+    
+    def __init__(self, db_path=None, in_memory=None):
+        super().__init__(db_path, in_memory)
+        self.logger = logging.getLogger("agent.db_reader")
+    
+    def connect(self):
+        """Open the read-only connection; the schema is owned by the read-write connector"""
+        try:
+            self._get_connection()
+            return True
+        except Exception as e:
+            self.logger.error("Database connection error: %s", str(e))
+            return False
+    
+    def _get_connection(self):
+        """Get or create a thread-local read-only connection"""
+        if not hasattr(self._local, 'connection') or self._local.connection is None:
+            if self.memory_uri:
+                # No WAL in memory: a snapshot here makes writers wait (busy timeout) until it ends
+                uri = self.memory_uri + "&mode=ro"
+            else:
+                uri = pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            # Autocommit mode, so read transactions are only opened by snapshot()
+            conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+            conn.execute("PRAGMA query_only = 1")
+            self._local.connection = conn
+            self.logger.info("Read-only connection established for thread %s", threading.current_thread().name)
+        
+        return self._local.connection
+    
+    def execute(self, query, params=()):
+        raise sqlite3.OperationalError("attempt to write through a read-only connection")
+    
+    def executemany(self, query, param_rows):
+        raise sqlite3.OperationalError("attempt to write through a read-only connection")
+    
+    def execute_deferred(self, query, params=(), many=False):
+        raise sqlite3.OperationalError("attempt to write through a read-only connection")
+    
+    def insert_rows(self, table, columns, rows, allow_read_only=False, deferred=False, update_on=None):
+        raise sqlite3.OperationalError("attempt to write through a read-only connection")
+    
+    def replace_day(self, table, date, columns, rows, where="", params=()):
+        raise sqlite3.OperationalError("attempt to write through a read-only connection")
+    
+    def replace_range(self, table, start_date, end_date, columns, rows, where="", params=(),
+                      allow_read_only=False):
+        raise sqlite3.OperationalError("attempt to write through a read-only connection")
+    
+    @contextmanager
+    def snapshot(self, start_date=None, end_date=None):
+        """Hold one read transaction open; every query inside sees the same point in time"""
+        conn = self._get_connection()
+        
+        if conn.in_transaction:
+            # Nested snapshot on the same thread joins the outer one
+            yield self
+            return
+        
+        # ATTACH is not allowed inside a transaction, so partitions are attached up front
+        schemas = ["main"]
+        if self.partitions and start_date and end_date:
+            schemas += self.partitions.attach_for_read(conn, start_date, end_date)
+        
+        conn.execute("BEGIN")
+        try:
+            # A snapshot is fixed by the first read of each file, so touch them all now
+            for schema in schemas:
+                conn.execute(f"SELECT 1 FROM {schema}.sqlite_master LIMIT 1").fetchall()
+            yield self
+        finally:
+            conn.execute("COMMIT")
+    
+    def close(self):
+        """Close the read-only connection for the current thread"""
         if hasattr(self._local, 'connection') and self._local.connection:
             self._local.connection.close()
             self._local.connection = None
\ No newline at end of file
@@ -0,0 +1,294 @@
+# Load test for the agent message and task bus. Run from the project root, e.g.:
+#     python -m core.load_test --mode messages --producers 8 --consumers 2 --rate 100 --duration 30
+import os
+import json
+import time
+import shutil
+import random
+import string
+import sqlite3
+import logging
+import argparse
+import tempfile
+import threading
+from config.settings import LOAD_TEST_CONFIG
+from core.db_connector import DBConnector
+from core.agent_base import BaseAgent
+
+class SyntheticAgent(BaseAgent):
+    """Agent that only produces or consumes bus traffic; its cycle does nothing"""
+
+    def __init__(self, agent_id):
+        super().__init__(agent_id, "synthetic")
+
+    def run_cycle(self, db_connector):
+        pass
+
+
+class TimedConnector(DBConnector):
+    """DBConnector that records the duration of every write statement"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.write_times = []
+        self.errors = 0
+
+    def execute(self, query, params=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params)
+        except sqlite3.OperationalError:
+            self.errors += 1
+            raise
+        finally:
+            self.write_times.append(time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class LoadTest:
+    """Drives synthetic producers and consumers against one database and reports what it saw"""
+
+    def __init__(self, db_path, config=None, **overrides):
+        self.config = dict(config or LOAD_TEST_CONFIG, **overrides)
+        self.logger = logging.getLogger("agent.load_test")
+        self.db = TimedConnector(db_path)
+        self.db.write_behind = self.config.get("write_behind", False)
+        self.mode = self.config["mode"]
+        if self.mode not in ("messages", "tasks"):
+            raise ValueError("Unknown load test mode: %s" % self.mode)
+
+        self.producers = [SyntheticAgent(f"producer_{i}") for i in range(self.config["producers"])]
+        self.consumers = [SyntheticAgent(f"consumer_{i}") for i in range(self.config["consumers"])]
+
+        # (producer_id, seq) -> send time, and one (key, latency) entry per delivery
+        self.sent = {}
+        self.received = []
+        self.last_received_at = None
+        self._lock = threading.Lock()
+        self._stop_consuming = threading.Event()
+
+    def run(self):
+        """Calibrate, run producers and consumers, drain, and return the report dict"""
+        if not self.db.connect():
+            raise RuntimeError("Could not open load test database %s" % self.db.db_path)
+        for agent in self.producers + self.consumers:
+            agent.register(self.db)
+
+        baseline = self._calibrate()
+        self.db.write_times = []
+        self.db.errors = 0
+
+        consumer_threads = [
+            threading.Thread(target=self._consume, args=(agent,), name=f"{agent.agent_id}#{replica}", daemon=True)
+            for agent in self.consumers
+            for replica in range(self.config["replicas"])
+        ]
+        producer_threads = [
+            threading.Thread(target=self._produce, args=(agent, index), name=agent.agent_id, daemon=True)
+            for index, agent in enumerate(self.producers)
+        ]
+
+        self.logger.info(
+            "Running %s load: %d producers x %s/s, %d consumers x %d replicas for %ss",
+            self.mode, len(self.producers), self.config["rate"], len(self.consumers),
+            self.config["replicas"], self.config["duration"]
+        )
+
+        self.started = time.perf_counter()
+        self.produce_until = self.started + self.config["duration"]
+        for thread in consumer_threads + producer_threads:
+            thread.start()
+        for thread in producer_threads:
+            thread.join()
+        produce_seconds = time.perf_counter() - self.started
+
+        # Give in-flight items a chance to arrive before counting them as lost
+        drain_until = time.perf_counter() + self.config["drain_timeout"]
+        while time.perf_counter() < drain_until:
+            with self._lock:
+                if len({key for key, _ in self.received}) >= len(self.sent):
+                    break
+            time.sleep(self.config["poll_interval"])
+
+        self._stop_consuming.set()
+        for thread in consumer_threads:
+            thread.join()
+
+        return self._report(produce_seconds, baseline)
+
+    def _calibrate(self, samples=100):
+        """Median write time of the producing operation with no contention at all"""
+        agent = self.producers[0] if self.producers else SyntheticAgent("calibration")
+        target = self.consumers[0] if self.consumers else agent
+        self.db.write_times = []
+
+        for seq in range(samples):
+            self._send(agent, target, {"calibration": seq})
+
+        baseline = percentile(self.db.write_times, 0.5) or 0.0
+        # Drop the calibration items so they are not counted by the consumers
+        self.db.execute("DELETE FROM agent_messages WHERE message_type = 'calibration'")
+        self.db.execute("DELETE FROM agent_tasks WHERE task_type = 'calibration'")
+        return baseline
+
+    def _send(self, agent, target, content):
+        if self.mode == "messages":
+            message_type = "calibration" if "calibration" in content else "load_test"
+            agent.send_message(self.db, target.agent_id, message_type, content)
+        else:
+            # Tasks belong to the agent that runs them, so they are created on the consumer's behalf
+            task_type = "calibration" if "calibration" in content else "load_test"
+            target.create_task(self.db, dict(content, type=task_type))
+
+    def _produce(self, agent, index):
+        """Open-loop producer: sends on a fixed schedule regardless of how consumers keep up"""
+        interval = 1.0 / self.config["rate"]
+        padding = "".join(random.choices(string.ascii_letters, k=self.config["payload_bytes"]))
+        next_send = time.perf_counter()
+        seq = 0
+
+        while next_send < self.produce_until:
+            target = self.consumers[(index + seq) % len(self.consumers)]
+            sent_at = time.perf_counter()
+            content = {"producer": agent.agent_id, "seq": seq, "sent_at": sent_at, "padding": padding}
+
+            try:
+                self._send(agent, target, content)
+                with self._lock:
+                    self.sent[(agent.agent_id, seq)] = sent_at
+            except sqlite3.OperationalError as e:
+                self.logger.warning("%s send failed: %s", agent.agent_id, str(e))
+
+            seq += 1
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _consume(self, agent):
+        """Poll for new items and record their end-to-end latency"""
+        while not self._stop_consuming.is_set():
+            try:
+                items = self._receive(agent)
+            except sqlite3.OperationalError as e:
+                self.logger.warning("%s receive failed: %s", agent.agent_id, str(e))
+                items = []
+
+            now = time.perf_counter()
+            with self._lock:
+                for item in items:
+                    self.received.append(((item["producer"], item["seq"]), now - item["sent_at"]))
+                if items:
+                    self.last_received_at = now
+
+            if not items:
+                self._stop_consuming.wait(self.config["poll_interval"])
+
+    def _receive(self, agent):
+        if self.mode == "messages":
+            return [message["content"] for message in agent.get_messages(self.db)]
+
+        items = []
+        for task in agent.get_pending_tasks(self.db):
+            agent.update_task_status(self.db, task["id"], "completed")
+            items.append(json.loads(task["parameters"]))
+        return items
+
+    def _report(self, produce_seconds, baseline):
+        delivered = {key for key, _ in self.received}
+        latencies = [latency for _, latency in self.received]
+        write_times = list(self.db.write_times)
+        deliver_seconds = (self.last_received_at or self.started) - self.started
+
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+
+        writer = self.db._writer
+        return {
+            "config": self.config,
+            "sent": len(self.sent),
+            "delivered": len(delivered & set(self.sent)),
+            "duplicates": len(self.received) - len(delivered),
+            "lost": len(set(self.sent) - delivered),
+            "throughput": {
+                "offered_per_second": round(len(self.sent) / produce_seconds, 1) if produce_seconds else 0.0,
+                "delivered_per_second": round(len(delivered) / deliver_seconds, 1) if deliver_seconds else 0.0
+            },
+            "latency_ms": {
+                "p50": ms(percentile(latencies, 0.5)),
+                "p90": ms(percentile(latencies, 0.9)),
+                "p99": ms(percentile(latencies, 0.99)),
+                "max": ms(max(latencies) if latencies else None)
+            },
+            "writes": {
+                "count": len(write_times),
+                "errors": self.db.errors,
+                "p50_ms": ms(percentile(write_times, 0.5)),
+                "p99_ms": ms(percentile(write_times, 0.99)),
+                "max_ms": ms(max(write_times) if write_times else None),
+                "uncontended_ms": ms(baseline),
+                # Time beyond the uncontended write time, i.e. spent waiting for the write lock
+                "lock_wait_seconds": round(sum(max(0.0, t - baseline) for t in write_times), 3)
+            },
+            # Deferred writes bypass execute(), so they are reported from the writer instead
+            "write_behind": dict(writer.metrics) if writer is not None else None
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the agent message/task bus on a temporary database")
+    parser.add_argument("--mode", choices=("messages", "tasks"), default=LOAD_TEST_CONFIG["mode"])
+    for name in ("producers", "consumers", "replicas", "payload_bytes"):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=LOAD_TEST_CONFIG[name])
+    for name in ("rate", "duration", "poll_interval", "drain_timeout"):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, default=LOAD_TEST_CONFIG[name])
+    parser.add_argument("--write-behind", action="store_true", default=LOAD_TEST_CONFIG.get("write_behind", False),
+                        help="Send deferred writes through the group-committing writer thread")
+    parser.add_argument("--database", help="Database file to use instead of a temporary one")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary database")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(name)s] %(message)s")
+    # Per-message agent logging would dominate the measurement
+    logging.getLogger("agent").setLevel(logging.WARNING)
+    logging.getLogger("agent.load_test").setLevel(logging.INFO)
+
+    temp_dir = None
+    db_path = args.database
+    if not db_path:
+        temp_dir = tempfile.mkdtemp(prefix="agent_load_test_")
+        db_path = os.path.join(temp_dir, "load_test.db")
+
+    overrides = {
+        name: getattr(args, name)
+        for name in ("mode", "producers", "consumers", "replicas", "rate", "duration",
+                     "payload_bytes", "poll_interval", "drain_timeout", "write_behind")
+    }
+
+    try:
+        test = LoadTest(db_path, **overrides)
+        report = test.run()
+        test.db.stop_writer()
+        test.db.close()
+    finally:
+        if temp_dir and not args.keep:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
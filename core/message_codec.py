@@ -0,0 +1,121 @@
+import json
+import zlib
+import marshal
+import hashlib
+import logging
+from config.settings import MESSAGE_CONFIG
+
+# Format tags stored in agent_messages.content_format
+FORMAT_JSON = "json"
+FORMAT_MARSHAL = "marshal"
+FORMAT_REF = "ref"
+ZLIB_SUFFIX = "+zlib"
+
+# Marshal output is pinned so every process in a deployment writes the same layout
+MARSHAL_VERSION = 4
+
+# Key marking a list of same-shaped dicts packed as one key row plus value rows
+TABLE_KEY = "\x00table"
+
+class MessageCodec:
+    """Encodes message content with a per-message format tag, compression and claim-check storage"""
+
+    def __init__(self, config=None):
+        self.config = config or MESSAGE_CONFIG
+        self.logger = logging.getLogger("agent.codec")
+        self.codec = self.config.get("codec", FORMAT_JSON)
+        self.compress_threshold = self.config.get("compress_threshold", 1024)
+        self.compress_level = self.config.get("compress_level", 6)
+        self.claim_check_threshold = self.config.get("claim_check_threshold")
+
+        if self.codec not in (FORMAT_JSON, FORMAT_MARSHAL):
+            raise ValueError("Unknown message codec: %s" % self.codec)
+
+    def encode(self, content, db_connector=None):
+        """Return (payload, format tag) for a message body"""
+        if self.codec == FORMAT_MARSHAL:
+            payload = marshal.dumps(self._pack(content), MARSHAL_VERSION)
+        else:
+            payload = json.dumps(content)
+        fmt = self.codec
+
+        if self.compress_threshold is not None and len(payload) >= self.compress_threshold:
+            raw = payload.encode("utf-8") if isinstance(payload, str) else payload
+            compressed = zlib.compress(raw, self.compress_level)
+            # Small or already dense payloads can grow; keep whichever is smaller
+            if len(compressed) < len(raw):
+                payload = compressed
+                fmt += ZLIB_SUFFIX
+
+        if db_connector is not None and self.claim_check_threshold and len(payload) >= self.claim_check_threshold:
+            return self._store_payload(db_connector, payload, fmt), FORMAT_REF
+
+        return payload, fmt
+
+    def decode(self, payload, fmt, db_connector=None):
+        """Turn a stored payload back into the original content"""
+        fmt = fmt or FORMAT_JSON
+
+        if fmt == FORMAT_REF:
+            if db_connector is None:
+                raise ValueError("Claim-check message needs a database connector to decode")
+            payload, fmt = self._load_payload(db_connector, payload)
+
+        if fmt.endswith(ZLIB_SUFFIX):
+            payload = zlib.decompress(payload)
+            fmt = fmt[:-len(ZLIB_SUFFIX)]
+
+        if fmt == FORMAT_MARSHAL:
+            return self._unpack(marshal.loads(payload))
+
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        return json.loads(payload)
+
+    def _store_payload(self, db_connector, payload, fmt):
+        """Store a large payload once, keyed by its digest, and return the reference"""
+        digest = hashlib.sha1(payload if isinstance(payload, bytes) else payload.encode("utf-8")).hexdigest()
+
+        # Identical payloads (e.g. the same anomaly batch to every alert agent) share one row
+        db_connector.execute("""
+        INSERT OR IGNORE INTO message_payloads (digest, content, content_format, size)
+        VALUES (?, ?, ?, ?)
+        """, (digest, payload, fmt, len(payload)))
+
+        return digest
+
+    def _load_payload(self, db_connector, digest):
+        rows = db_connector.query(
+            "SELECT content, content_format FROM message_payloads WHERE digest = ?",
+            (digest,), row_mode="tuple"
+        )
+        if not rows:
+            raise KeyError("Message payload %s not found" % digest)
+        return rows[0]
+
+    def _pack(self, value):
+        """Replace lists of same-keyed dicts by one key row plus value rows"""
+        if isinstance(value, dict):
+            return {key: self._pack(item) for key, item in value.items()}
+
+        if isinstance(value, (list, tuple)):
+            items = [self._pack(item) for item in value]
+            if len(items) > 1 and all(isinstance(item, dict) for item in items):
+                keys = tuple(items[0])
+                if all(tuple(item) == keys for item in items):
+                    return {TABLE_KEY: (keys, [tuple(item.values()) for item in items])}
+            return items
+
+        return value
+
+    def _unpack(self, value):
+        if isinstance(value, dict):
+            if TABLE_KEY in value and len(value) == 1:
+                keys, rows = value[TABLE_KEY]
+                return [dict(zip(keys, (self._unpack(item) for item in row))) for row in rows]
+            return {key: self._unpack(item) for key, item in value.items()}
+
+        if isinstance(value, list):
+            return [self._unpack(item) for item in value]
+
+        return value
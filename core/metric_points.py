@@ -0,0 +1,171 @@
+import logging
+import datetime
+from config.settings import INGESTION_CONFIG
+
+BUCKET_FORMAT = "%Y-%m-%d %H:%M:%S"
+HOURLY = 3600
+DAILY = 86400
+
+class MetricPointStore:
+    """Time-bucketed metric points in sales_metric_points, downsampled raw -> hourly -> daily"""
+
+    def __init__(self, db_connector, config=None):
+        self.db_connector = db_connector
+        self.config = config or INGESTION_CONFIG
+        self.logger = logging.getLogger("agent.metric_points")
+        self.resolution = int(self.config.get("resolution", DAILY))
+        self.aggregation = self.config.get("aggregation", {})
+        self.derived = self.config.get("derived", {})
+
+    @property
+    def intraday(self):
+        """Whether collection runs below day level"""
+        return self.resolution < DAILY
+
+    def bucket_start(self, timestamp, resolution=None):
+        """Start of the bucket a timestamp falls into, as stored in bucket_start"""
+        resolution = resolution or self.resolution
+        midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        offset = int((timestamp - midnight).total_seconds()) // resolution * resolution
+        return (midnight + datetime.timedelta(seconds=offset)).strftime(BUCKET_FORMAT)
+
+    def record(self, points, resolution=None):
+        """Add (timestamp, source, metric_type, value) points; repeats in a bucket are merged"""
+        resolution = resolution or self.resolution
+        rows = [
+            (resolution, self.bucket_start(timestamp, resolution), source, metric_type, value)
+            for timestamp, source, metric_type, value in points
+        ]
+        if not rows:
+            return 0
+
+        # Values are stored as sums with a sample count, so avg metrics stay exact after merging
+        self.db_connector.execute_deferred("""
+        INSERT INTO sales_metric_points (resolution, bucket_start, source, metric_type, value, samples)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT(resolution, bucket_start, source, metric_type) DO UPDATE SET
+            value = value + excluded.value, samples = samples + excluded.samples
+        """, rows, many=True)
+        return len(rows)
+
+    def compact(self, now=None):
+        """Roll old raw points up into hourly buckets and retire hourly buckets into sales_metrics"""
+        now = now or datetime.datetime.now()
+        summary = {"rolled_up": 0, "days_finalized": 0}
+
+        # Cut on an hour boundary so no hour is split between two tiers
+        raw_cutoff = self.bucket_start(
+            now - datetime.timedelta(hours=self.config.get("hourly_after_hours", 48)), HOURLY
+        )
+        if self.resolution < HOURLY:
+            summary["rolled_up"] = self._roll_up(self.resolution, HOURLY, raw_cutoff)
+
+        daily_cutoff = (now - datetime.timedelta(days=self.config.get("daily_after_days", 14))).strftime("%Y-%m-%d")
+        days = self.db_connector.query("""
+        SELECT DISTINCT substr(bucket_start, 1, 10)
+        FROM sales_metric_points
+        WHERE resolution IN (?, ?) AND bucket_start < ?
+        """, (self.resolution, HOURLY, daily_cutoff), row_mode="tuple")
+
+        for (date,) in days:
+            # The daily tier is sales_metrics itself; refresh it once more before dropping the points
+            self.refresh_daily(date)
+            self.db_connector.execute("""
+            DELETE FROM sales_metric_points
+            WHERE resolution IN (?, ?) AND bucket_start >= ? AND bucket_start < ?
+            """, (self.resolution, HOURLY, date, self._next_day(date)))
+            summary["days_finalized"] += 1
+
+        if summary["rolled_up"] or summary["days_finalized"]:
+            self.logger.info(
+                "Compacted %d raw buckets into hourly, finalized %d days",
+                summary["rolled_up"], summary["days_finalized"]
+            )
+        return summary
+
+    def _roll_up(self, resolution, target, cutoff):
+        """Merge buckets of one resolution older than cutoff into a coarser one, in one transaction"""
+        with self.db_connector.transaction():
+            self.db_connector.execute("""
+            INSERT INTO sales_metric_points (resolution, bucket_start, source, metric_type, value, samples)
+            SELECT ?, substr(bucket_start, 1, 13) || ':00:00', source, metric_type, SUM(value), SUM(samples)
+            FROM sales_metric_points
+            WHERE resolution = ? AND bucket_start < ?
+            GROUP BY 2, source, metric_type
+            ON CONFLICT(resolution, bucket_start, source, metric_type) DO UPDATE SET
+                value = value + excluded.value, samples = samples + excluded.samples
+            """, (target, resolution, cutoff))
+            conn = self.db_connector._get_connection()
+            cursor = conn.execute(
+                "DELETE FROM sales_metric_points WHERE resolution = ? AND bucket_start < ?",
+                (resolution, cutoff)
+            )
+            return cursor.rowcount
+
+    def daily_totals(self, date, sources=None):
+        """Aggregate every tier of one day into {(source, metric_type): value}"""
+        self.db_connector.flush()  # Include points still in the write-behind queue
+        where = ""
+        params = [self.resolution, HOURLY, date, self._next_day(date)]
+        if sources:
+            where = f"AND source IN ({','.join('?' * len(sources))})"
+            params.extend(sources)
+
+        rows = self.db_connector.query(f"""
+        SELECT source, metric_type, SUM(value), SUM(samples)
+        FROM sales_metric_points
+        WHERE resolution IN (?, ?) AND bucket_start >= ? AND bucket_start < ? {where}
+        GROUP BY source, metric_type
+        """, params, row_mode="tuple")
+
+        totals = {}
+        for source, metric_type, value, samples in rows:
+            if self.aggregation.get(metric_type, "sum") == "avg":
+                value = value / samples
+            totals[(source, metric_type)] = value
+
+        for metric_type, (numerator, denominator) in self.derived.items():
+            for source in {source for source, _ in totals}:
+                divisor = totals.get((source, denominator))
+                if divisor:
+                    totals[(source, metric_type)] = totals.get((source, numerator), 0) / divisor
+
+        return totals
+
+    def refresh_daily(self, date, sources=None):
+        """Rewrite the sales_metrics rows of a day from its points, so day-level readers see them"""
+        totals = self.daily_totals(date, sources)
+        sources = sorted(sources or {source for source, _ in totals})
+        if not sources:
+            return 0
+
+        rows = [
+            (date, source, metric_type, round(value, 2))
+            for (source, metric_type), value in sorted(totals.items())
+        ]
+        return self.db_connector.replace_day(
+            "sales_metrics", date, ("date", "source", "metric_type", "value"), rows,
+            where=f"source IN ({','.join('?' * len(sources))})", params=sources
+        )
+
+    def hourly_series(self, metric_type, start, end, sources=None, hour=None):
+        """(source, hour_start, value) rows across tiers, optionally only for one hour of the day"""
+        where = ""
+        params = [self.resolution, HOURLY, metric_type, start, end]
+        if hour is not None:
+            where += " AND substr(bucket_start, 12, 2) = ?"
+            params.append(f"{hour:02d}")
+        if sources:
+            where += f" AND source IN ({','.join('?' * len(sources))})"
+            params.extend(sources)
+
+        return self.db_connector.query(f"""
+        SELECT source, substr(bucket_start, 1, 13) || ':00:00' AS hour_start, SUM(value)
+        FROM sales_metric_points
+        WHERE resolution IN (?, ?) AND metric_type = ? AND bucket_start >= ? AND bucket_start < ? {where}
+        GROUP BY source, hour_start
+        ORDER BY hour_start
+        """, params, row_mode="tuple")
+
+    def _next_day(self, date):
+        return (datetime.datetime.strptime(date, "%Y-%m-%d") + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
@@ -0,0 +1,180 @@
+import os
+import logging
+import pathlib
+import sqlite3
+import datetime
+import threading
+from collections import OrderedDict
+from config.settings import PARTITION_CONFIG
+
+class PartitionManager:
+    """Routes the sales tables to per-month SQLite files that are attached on demand"""
+
+    def __init__(self, db_connector, config=None):
+        self.db_connector = db_connector
+        self.config = config or PARTITION_CONFIG
+        self.logger = logging.getLogger("agent.partitioning")
+        self.directory = self.config.get("directory", "partitions")
+        self.tables = set(self.config.get("tables", []))
+        self.read_only_after_months = self.config.get("read_only_after_months", 2)
+        self.max_attached = self.config.get("max_attached", 8)
+
+        # Per thread: id(connection) -> OrderedDict(alias -> attached read-only), in LRU order
+        self._local = threading.local()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def is_partitioned(self, table):
+        """Whether rows of this table live in partition files"""
+        return table in self.tables
+
+    def partition_key(self, date):
+        """Partition key ("YYYY_MM") for a YYYY-MM-DD date"""
+        return date[:7].replace("-", "_")
+
+    def partition_keys(self, start_date, end_date):
+        """All month keys overlapping an inclusive date range"""
+        year, month = int(start_date[:4]), int(start_date[5:7])
+        end = (int(end_date[:4]), int(end_date[5:7]))
+
+        keys = []
+        while (year, month) <= end:
+            keys.append(f"{year:04d}_{month:02d}")
+            month += 1
+            if month > 12:
+                year += 1
+                month = 1
+        return keys
+
+    def partition_path(self, key):
+        return os.path.join(self.directory, f"sales_{key}.db")
+
+    def existing_keys(self):
+        """Keys of the partition files on disk, oldest first"""
+        keys = []
+        for name in os.listdir(self.directory):
+            key = name[len("sales_"):-len(".db")]
+            if name.startswith("sales_") and name.endswith(".db") and len(key) == 7 and key[4] == "_":
+                keys.append(key)
+        return sorted(keys)
+
+    def is_empty(self, conn, alias):
+        """Whether an attached partition holds no rows of any partitioned table"""
+        return not any(
+            conn.execute(f"SELECT 1 FROM {alias}.{table} LIMIT 1").fetchone() for table in sorted(self.tables)
+        )
+
+    def drop(self, conn, key):
+        """Detach a partition from this connection and delete its file
+
+        Other connections that still have it attached keep reading their open copy.
+        """
+        alias = f"p_{key}"
+        if alias in self._attached(conn):
+            self._detach(conn, alias)
+        path = self.partition_path(key)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def is_read_only(self, key):
+        """Partitions older than read_only_after_months are frozen"""
+        today = datetime.date.today()
+        year, month = int(key[:4]), int(key[5:7])
+        age = (today.year - year) * 12 + (today.month - month)
+        return age >= self.read_only_after_months
+
+    def attach_for_read(self, conn, start_date, end_date):
+        """Attach every existing partition overlapping the range and return their aliases"""
+        aliases = []
+        for key in self.partition_keys(start_date, end_date):
+            # A month without a file simply has no rows
+            if not os.path.exists(self.partition_path(key)):
+                continue
+            aliases.append(self._attach(conn, key, read_only=self.is_read_only(key)))
+        return aliases
+
+    def attach_for_write(self, conn, key, allow_read_only=False):
+        """Attach a partition read-write, creating its file and schema if needed"""
+        if self.is_read_only(key) and not allow_read_only:
+            raise ValueError(f"Partition {key} is read-only")
+
+        alias = self._attach(conn, key, read_only=False)
+        self._ensure_schema(conn, alias)
+        self.db_connector._attach_change_triggers(conn, alias, self.tables)
+        return alias
+
+    def _attached(self, conn):
+        """LRU map of partitions attached to this connection"""
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        return self._local.connections.setdefault(id(conn), OrderedDict())
+
+    def _attach(self, conn, key, read_only):
+        alias = f"p_{key}"
+        attached = self._attached(conn)
+        databases = {row[1] for row in conn.execute("PRAGMA database_list").fetchall()}
+
+        # Forget entries for databases detached behind our back (e.g. a reused connection id)
+        for stale in [name for name in attached if name not in databases]:
+            del attached[stale]
+
+        if alias in attached:
+            if read_only or not attached[alias]:
+                attached.move_to_end(alias)
+                return alias
+            # Attached read-only earlier but now needed for writing
+            self._detach(conn, alias)
+
+        while len(attached) >= self.max_attached:
+            self._detach(conn, next(iter(attached)))
+
+        path = self.partition_path(key)
+        if read_only:
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (pathlib.Path(path).resolve().as_uri() + "?mode=ro",))
+        else:
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+
+        attached[alias] = read_only
+        return alias
+
+    def _detach(self, conn, alias):
+        self.db_connector._detach_change_triggers(conn, alias, self.tables)
+        conn.execute(f"DETACH DATABASE {alias}")
+        self._attached(conn).pop(alias, None)
+
+    def _ensure_schema(self, conn, alias):
+        """Mirror the main schema (tables and indexes) of partitioned tables into a partition"""
+        placeholders = ",".join("?" * len(self.tables))
+        rows = conn.execute(
+            f"SELECT type, name, tbl_name, sql FROM main.sqlite_master "
+            f"WHERE tbl_name IN ({placeholders}) AND type IN ('table', 'index') AND sql IS NOT NULL "
+            f"ORDER BY type = 'index'",
+            tuple(self.tables)
+        ).fetchall()
+
+        for _, name, table, sql in rows:
+            try:
+                conn.execute(self._qualify_ddl(sql, alias))
+            except sqlite3.IntegrityError:
+                # A unique index added to main after this partition was written: drop
+                # duplicates (keeping the newest row) so the partition can take it too
+                columns = [row[2] for row in conn.execute(f"PRAGMA main.index_info({name})").fetchall()]
+                removed = conn.execute(
+                    f"DELETE FROM {alias}.{table} WHERE id NOT IN "
+                    f"(SELECT MAX(id) FROM {alias}.{table} GROUP BY {', '.join(columns)})"
+                ).rowcount
+                self.logger.info("Removed %d duplicate rows from %s.%s", removed, alias, table)
+                conn.execute(self._qualify_ddl(sql, alias))
+        conn.commit()
+
+        journal_mode = getattr(self.db_connector, "journal_mode", None)
+        if journal_mode:
+            conn.execute(f"PRAGMA {alias}.journal_mode = {journal_mode}")
+
+    def _qualify_ddl(self, sql, alias):
+        """Rewrite a stored CREATE statement so it targets another schema"""
+        for prefix in ("CREATE TABLE ", "CREATE UNIQUE INDEX ", "CREATE INDEX "):
+            if sql.startswith(prefix):
+                return f"{prefix}IF NOT EXISTS {alias}.{sql[len(prefix):]}"
+        return sql
@@ -0,0 +1,139 @@
+import os
+import mmap
+import logging
+import threading
+from collections import OrderedDict
+from config.settings import REPORT_CONFIG
+
+# Catalog columns only; the parameters JSON is never read for listing
+CATALOG_COLUMNS = "id, report_id, report_type, period_start, period_end, generated_at, file_path"
+
+class ReportCatalog:
+    """Indexed listing of archived reports and cached, memory-mapped access to their files"""
+
+    def __init__(self, db_connector, cache_size=None):
+        self.db_connector = db_connector
+        self.logger = logging.getLogger("agent.report_catalog")
+        self.page_size = REPORT_CONFIG.get("page_size", 50)
+        self.cache_size = cache_size or REPORT_CONFIG.get("cache_size", 32)
+
+        # file_path -> (inode, mtime, size, mmap), least recently used first
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def list(self, report_type=None, start_date=None, end_date=None, limit=None, after=None):
+        """One page of reports, newest period first; pass the returned "next" cursor as after"""
+        limit = int(limit or self.page_size)
+        conditions = []
+        params = []
+
+        if report_type:
+            conditions.append("report_type = ?")
+            params.append(report_type)
+        # Reports whose period overlaps [start_date, end_date]
+        if start_date:
+            conditions.append("period_end >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("period_start <= ?")
+            params.append(end_date)
+        if after:
+            # Keyset pagination: continue strictly below the last (period_end, id) seen
+            period_end, last_id = self._decode_cursor(after)
+            conditions.append("(period_end < ? OR (period_end = ? AND id < ?))")
+            params.extend([period_end, period_end, last_id])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.db_connector.query(f"""
+        SELECT {CATALOG_COLUMNS}
+        FROM report_archive
+        {where}
+        ORDER BY period_end DESC, id DESC
+        LIMIT ?
+        """, params + [limit + 1], row_mode="dict")
+
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = f"{last['period_end']}:{last['id']}"
+
+        return {"reports": page, "next": next_cursor}
+
+    def find(self, report_id):
+        """Catalog entry of the newest report with a report_id (or archive id), or None"""
+        column = "id" if isinstance(report_id, int) else "report_id"
+        rows = self.db_connector.query(
+            f"SELECT {CATALOG_COLUMNS} FROM report_archive WHERE {column} = ? ORDER BY id DESC LIMIT 1",
+            (report_id,), row_mode="dict"
+        )
+        return rows[0] if rows else None
+
+    def read(self, file_path):
+        """Whole contents of a report file, served from the mapping cache"""
+        stat = os.stat(file_path)
+
+        with self._lock:
+            # Copied under the lock, so no other thread closes the map mid-read
+            return self._mapping(file_path, stat)[:]
+
+    def iter_chunks(self, file_path, chunk_size=65536):
+        """Stream a report file in chunks without reading it into memory at once
+
+        Uses a mapping of its own rather than a cached one, which may be closed on
+        eviction while the stream is still being consumed.
+        """
+        with open(file_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for offset in range(0, size, chunk_size):
+                yield mapping[offset:offset + chunk_size]
+        finally:
+            mapping.close()
+
+    def close(self):
+        """Unmap every cached mapping"""
+        with self._lock:
+            while self._cache:
+                self._close(self._cache.popitem()[1])
+
+    def _mapping(self, file_path, stat):
+        """mmap of a report file; reopened if the file changed since it was cached (call with the lock held)
+
+        Report files are replaced by rename, never rewritten in place, so an open map
+        keeps the old contents instead of faulting when the file is regenerated.
+        """
+        key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        cached = self._cache.get(file_path)
+        if cached and cached[:3] == key:
+            self._cache.move_to_end(file_path)
+            return cached[3]
+
+        with open(file_path, "rb") as f:
+            # The file opened may be newer than the one stat saw
+            stat = os.fstat(f.fileno())
+            key = (stat.st_ino, stat.st_mtime, stat.st_size)
+            # mmap refuses empty files
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+
+        if cached:
+            self._close(cached)
+        self._cache[file_path] = key + (mapping,)
+        self._cache.move_to_end(file_path)
+        while len(self._cache) > self.cache_size:
+            self._close(self._cache.popitem(last=False)[1])
+
+        return mapping
+
+    def _close(self, cached):
+        mapping = cached[3]
+        if isinstance(mapping, mmap.mmap):
+            mapping.close()
+
+    def _decode_cursor(self, cursor):
+        period_end, _, last_id = str(cursor).rpartition(":")
+        return period_end, int(last_id)
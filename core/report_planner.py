@@ -0,0 +1,240 @@
+# Regenerate archived reports over a past range. Run from the project root, e.g.:
+#     python -m core.report_planner --start 2025-01-01 --end 2025-03-31 --type daily --type monthly
+import json
+import logging
+import argparse
+import datetime
+from config.settings import REPORT_CONFIG
+from core.sketches import SketchStore
+
+REPORT_TYPES = ("daily", "weekly", "monthly")
+
+class DayAggregator:
+    """Rows and insights of a daily report"""
+
+    def __init__(self):
+        self.sales_data = []
+        self.insights = []
+
+    def add(self, source, metric_type, value, date):
+        self.sales_data.append({"source": source, "metric_type": metric_type, "value": value})
+
+    def add_insight(self, insight):
+        self.insights.append({
+            "insight_type": insight["insight_type"],
+            "description": insight["description"],
+            "severity": insight["severity"]
+        })
+
+
+class PeriodAggregator:
+    """Per-day breakdown, per-source totals and top insights of a weekly or monthly report"""
+
+    def __init__(self, insight_limit=None):
+        self.insight_limit = insight_limit
+        self.daily = {}
+        self.sources = set()
+        self.metric_types = set()
+        self.insights = []
+        self.sketches = None  # SketchStore.summarize() of the period, if read
+
+    def add(self, source, metric_type, value, date):
+        self.sources.add(source)
+        self.metric_types.add(metric_type)
+        self.daily.setdefault(date, {}).setdefault(source, {})[metric_type] = value
+
+    def add_insight(self, insight):
+        self.insights.append(insight)
+
+    def metrics(self):
+        totals = {}
+        for source in self.sources:
+            totals[source] = {}
+            for metric_type in self.metric_types:
+                values = [
+                    day[source][metric_type] for day in self.daily.values()
+                    if source in day and metric_type in day[source]
+                ]
+                if values:
+                    # Averages are averaged over the days, everything else is summed
+                    if metric_type in ["average_order_value"]:
+                        totals[source][metric_type] = sum(values) / len(values)
+                    else:
+                        totals[source][metric_type] = sum(values)
+
+        overall = {}
+        for metric_type in self.metric_types:
+            overall[metric_type] = sum(
+                totals[source][metric_type] for source in totals if metric_type in totals[source]
+            )
+
+        # Merged distinct estimates replace summed daily customer counts; adds order-value quantiles
+        if self.sketches:
+            for source, values in self.sketches["by_source"].items():
+                totals.setdefault(source, {}).update(values)
+            overall.update(self.sketches["total"])
+
+        return {
+            "daily": self.daily,
+            "weekly": totals,
+            "total": overall,
+            "sources": list(self.sources),
+            "metric_types": list(self.metric_types)
+        }
+
+    def top_insights(self):
+        # Same order as the former ORDER BY severity DESC, date DESC
+        ranked = sorted(self.insights, key=lambda insight: (insight["severity"], insight["date"]), reverse=True)
+        return ranked[:self.insight_limit] if self.insight_limit else ranked
+
+
+class ReportPlanner:
+    """Groups reports with overlapping periods and reads each group's data in one scan
+
+    A month-start run (yesterday's daily, last week's and last month's report) reads
+    sales_metrics and sales_insights once over the union of the periods, and every row
+    is handed to each report whose period contains its date.
+    """
+
+    def __init__(self, db_connector, config=None):
+        self.db_connector = db_connector
+        self.config = config or REPORT_CONFIG
+        self.logger = logging.getLogger("agent.report_planner")
+        self.scan_span_days = self.config.get("scan_span_days", 45)
+        self.weekly_insight_limit = self.config.get("weekly_insight_limit", 10)
+
+    def plan(self, start_date, end_date, report_types=None, weekly_day=1):
+        """Every report whose whole period lies in [start_date, end_date]
+
+        Weekly periods are the 7 days before a weekly_day (0=Monday), as run_cycle makes them;
+        monthly periods are calendar months.
+        """
+        report_types = report_types or REPORT_TYPES
+        first = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+        last = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
+        reports = []
+
+        day = first
+        while day <= last:
+            if "daily" in report_types:
+                reports.append(("daily", day.isoformat(), day.isoformat()))
+            if "weekly" in report_types and day.weekday() == (weekly_day - 1) % 7 \
+                    and day - datetime.timedelta(days=6) >= first:
+                reports.append(("weekly", (day - datetime.timedelta(days=6)).isoformat(), day.isoformat()))
+            if "monthly" in report_types and (day + datetime.timedelta(days=1)).day == 1 \
+                    and day.replace(day=1) >= first:
+                reports.append(("monthly", day.replace(day=1).isoformat(), day.isoformat()))
+            day += datetime.timedelta(days=1)
+
+        return reports
+
+    def batches(self, reports):
+        """Split reports into groups whose combined period spans at most scan_span_days
+
+        Keeps every scan within a few partitions, and the rows of one scan in memory.
+        """
+        batches = []
+        batch = []
+        batch_start = batch_end = None
+        # Longer periods first among those starting the same day, so a month leads its days
+        for report in sorted(set(reports), key=lambda report: (report[1], -self._days(report[1], report[2]))):
+            _, start_date, end_date = report
+            if batch and self._days(batch_start, max(batch_end, end_date)) > self.scan_span_days:
+                batches.append(batch)
+                batch = []
+            if not batch:
+                batch_start, batch_end = start_date, end_date
+            batch.append(report)
+            batch_end = max(batch_end, end_date)
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def scan(self, reports):
+        """{report: aggregator} for (report_type, start_date, end_date) reports, from one snapshot"""
+        start_date = min(report[1] for report in reports)
+        end_date = max(report[2] for report in reports)
+
+        aggregators = {}
+        by_date = {}
+        for report in reports:
+            report_type, period_start, period_end = report
+            if report_type == "daily":
+                aggregator = DayAggregator()
+            else:
+                aggregator = PeriodAggregator(self.weekly_insight_limit if report_type == "weekly" else None)
+            aggregators[report] = aggregator
+            for date in self._dates(period_start, period_end):
+                by_date.setdefault(date, []).append(aggregator)
+
+        rows = 0
+        # Metrics, insights and sketches all come from one snapshot, so a report shows a single
+        # point in time (the series cache may lag other processes, and holds floats only)
+        with self.db_connector.snapshot(start_date, end_date) as reader:
+            for source, metric_type, value, date in reader.iter_range(
+                "sales_metrics", "source, metric_type, value, date", start_date, end_date, order_by="date ASC"
+            ):
+                rows += 1
+                for aggregator in by_date.get(date, ()):
+                    aggregator.add(source, metric_type, value, date)
+
+            for insight in reader.query_range(
+                "sales_insights", "insight_type, description, severity, date", start_date, end_date
+            ):
+                for aggregator in by_date.get(insight["date"], ()):
+                    aggregator.add_insight(insight)
+
+            # Sketches merge over a period, so each weekly or monthly report reads its own
+            sketches = SketchStore(reader)
+            for report, aggregator in aggregators.items():
+                if report[0] != "daily":
+                    aggregator.sketches = sketches.summarize(report[1], report[2])
+
+        self.logger.info(
+            "Read %d metric rows for %d reports over %s to %s", rows, len(reports), start_date, end_date
+        )
+        return aggregators
+
+    def _days(self, start_date, end_date):
+        return (
+            datetime.datetime.strptime(end_date, "%Y-%m-%d") - datetime.datetime.strptime(start_date, "%Y-%m-%d")
+        ).days + 1
+
+    def _dates(self, start_date, end_date):
+        first = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+        return [(first + datetime.timedelta(days=offset)).isoformat() for offset in range(self._days(start_date, end_date))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate the reports of a past date range")
+    parser.add_argument("--start", required=True, help="First day of the range (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="Last day of the range (YYYY-MM-DD)")
+    parser.add_argument("--type", action="append", dest="report_types", choices=REPORT_TYPES,
+                        help="Report type; repeatable, all types by default")
+    parser.add_argument("--workers", type=int, help="Report files written in parallel")
+    parser.add_argument("--database", help="Database file instead of the configured one")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(name)s] %(message)s")
+
+    # Imported here: the agent itself plans its reports with this module
+    from core.db_connector import DBConnector
+    from agents.reporting_agent import ReportingAgent
+
+    db_connector = DBConnector(args.database)
+    if not db_connector.connect():
+        raise SystemExit("Could not open database %s" % db_connector.db_path)
+
+    agent = ReportingAgent("reporting_backfill")
+    results = agent.backfill_reports(db_connector, args.start, args.end, args.report_types, args.workers)
+    summary = {
+        "reports": len(results),
+        "errors": [result for result in results if result.get("status") != "success"]
+    }
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import time
+import logging
+import datetime
+from config.settings import RETENTION_CONFIG
+from core.topics import TopicBus
+
+class RetentionManager:
+    """Applies per-table retention policies and compacts the database file"""
+
+    ARCHIVE_ALIAS = "archive"
+
+    def __init__(self, db_connector, config=None):
+        self.db_connector = db_connector
+        self.config = config or RETENTION_CONFIG
+        self.logger = logging.getLogger("agent.retention")
+        self.batch_size = self.config.get("batch_size", 500)
+        self.archive_path = self.config.get("archive_database")
+        self.vacuum_pages = self.config.get("vacuum_pages", 2000)
+
+        # Cumulative counters, reported by the maintenance agent after every run
+        self.metrics = {
+            "runs": 0,
+            "rows_deleted": {},
+            "rows_archived": {},
+            "pages_freed": 0,
+            "last_run_seconds": 0.0,
+            "last_run_at": None
+        }
+
+    def run(self):
+        """Apply every configured policy, then release free pages. Returns a per-run summary."""
+        started = time.time()
+        summary = {"tables": {}, "pages_freed": 0}
+
+        self._check_auto_vacuum()
+
+        policies = self.config.get("tables", {})
+        wants_archive = any(policy.get("archive") for policy in policies.values())
+        archive_ready = wants_archive and self._attach_archive()
+
+        for table, policy in policies.items():
+            deleted, archived = self.apply_policy(table, policy, archive_ready and policy.get("archive", False))
+            summary["tables"][table] = {"deleted": deleted, "archived": archived}
+
+            self.metrics["rows_deleted"][table] = self.metrics["rows_deleted"].get(table, 0) + deleted
+            self.metrics["rows_archived"][table] = self.metrics["rows_archived"].get(table, 0) + archived
+
+        summary["topic_entries_truncated"] = TopicBus(self.db_connector).truncate()
+        summary["changes_truncated"] = self.db_connector.truncate_changes()
+        summary["payloads_purged"] = self.purge_message_payloads()
+        summary["pages_freed"] = self.incremental_vacuum()
+        summary["seconds"] = time.time() - started
+
+        self.metrics["runs"] += 1
+        self.metrics["pages_freed"] += summary["pages_freed"]
+        self.metrics["last_run_seconds"] = summary["seconds"]
+        self.metrics["last_run_at"] = datetime.datetime.now().isoformat()
+
+        return summary
+
+    def apply_policy(self, table, policy, archive=False):
+        """Delete (and optionally archive) rows older than the policy allows, one batch per transaction"""
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=policy["days"])).strftime("%Y-%m-%d %H:%M:%S")
+
+        where = f"{policy['column']} < ?"
+        if policy.get("condition"):
+            where += f" AND ({policy['condition']})"
+
+        partitions = self.db_connector.partitions
+        if partitions and partitions.is_partitioned(table):
+            deleted, archived = self._apply_to_partitions(table, where, cutoff, archive)
+        else:
+            deleted, archived = self._purge("main", table, where, cutoff, archive)
+
+        if deleted:
+            self.logger.info("Retention removed %d rows from %s (%d archived)", deleted, table, archived)
+
+        return deleted, archived
+
+    def _apply_to_partitions(self, table, where, cutoff, archive):
+        """Apply a policy to every month file that starts before the cutoff
+
+        Ids restart in every partition, so archived rows get new ids in the archive. A month
+        left without rows in any partitioned table has its file removed.
+        """
+        partitions = self.db_connector.partitions
+        conn = self.db_connector._get_connection()
+        deleted = 0
+        archived = 0
+
+        for key in partitions.existing_keys():
+            if key > partitions.partition_key(cutoff):
+                break
+            alias = partitions.attach_for_write(conn, key, allow_read_only=True)
+            removed, copied = self._purge(alias, table, where, cutoff, archive, keep_ids=False)
+            deleted += removed
+            archived += copied
+            if removed and partitions.is_empty(conn, alias):
+                partitions.drop(conn, key)
+                self.logger.info("Removed empty partition %s", key)
+
+        return deleted, archived
+
+    def _purge(self, schema, table, where, cutoff, archive, keep_ids=True):
+        select_query = f"SELECT id FROM {schema}.{table} WHERE {where} ORDER BY id LIMIT ?"
+        columns = ", ".join(
+            column for column in self._columns(schema, table) if keep_ids or column != "id"
+        )
+        deleted = 0
+        archived = 0
+
+        while True:
+            rows = self.db_connector.query(select_query, (cutoff, self.batch_size), row_mode="tuple")
+            if not rows:
+                break
+
+            ids = [row[0] for row in rows]
+            placeholders = ",".join("?" * len(ids))
+
+            # One short write transaction per batch so agents are never locked out for long
+            with self.db_connector.transaction():
+                if archive:
+                    self.db_connector.execute(
+                        f"INSERT OR IGNORE INTO {self.ARCHIVE_ALIAS}.{table} ({columns}) "
+                        f"SELECT {columns} FROM {schema}.{table} WHERE id IN ({placeholders})",
+                        ids
+                    )
+                    archived += len(ids)
+
+                self.db_connector.execute(f"DELETE FROM {schema}.{table} WHERE id IN ({placeholders})", ids)
+                deleted += len(ids)
+
+            if len(ids) < self.batch_size:
+                break
+
+        return deleted, archived
+
+    def purge_message_payloads(self):
+        """Drop claim-check payloads no longer referenced by any message or topic entry"""
+        conn = self.db_connector._get_connection()
+        # The grace period covers payloads stored just before their message row
+        cursor = conn.execute("""
+        DELETE FROM message_payloads
+        WHERE created_at < datetime('now', '-1 hour')
+        AND digest NOT IN (
+            SELECT content FROM agent_messages WHERE content_format = 'ref'
+            UNION ALL
+            SELECT content FROM topic_log WHERE content_format = 'ref'
+        )
+        """)
+        conn.commit()
+        return cursor.rowcount
+
+    def incremental_vacuum(self):
+        """Return up to vacuum_pages free pages to the filesystem"""
+        conn = self.db_connector._get_connection()
+
+        before = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+        if before == 0:
+            return 0
+
+        # The pragma frees one page per step, so the cursor must be drained
+        conn.execute(f"PRAGMA main.incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+        after = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+
+        return before - after
+
+    def _check_auto_vacuum(self):
+        """Make sure the database file can be compacted incrementally"""
+        conn = self.db_connector._get_connection()
+        mode = conn.execute("PRAGMA main.auto_vacuum").fetchone()[0]
+
+        if mode == 2:  # INCREMENTAL
+            return
+
+        if self.config.get("convert_auto_vacuum"):
+            self.logger.info("Converting database to auto_vacuum=INCREMENTAL (full VACUUM)")
+            conn.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        elif self.metrics["runs"] == 0:
+            self.logger.warning(
+                "Database was created without auto_vacuum=INCREMENTAL; "
+                "set convert_auto_vacuum to reclaim space from deleted rows"
+            )
+
+    def _attach_archive(self):
+        """Attach the archive database and mirror the schema of archived tables into it"""
+        if not self.archive_path:
+            return False
+
+        conn = self.db_connector._get_connection()
+        attached = [row[1] for row in conn.execute("PRAGMA database_list").fetchall()]
+
+        if self.ARCHIVE_ALIAS not in attached:
+            conn.execute(f"ATTACH DATABASE ? AS {self.ARCHIVE_ALIAS}", (self.archive_path,))
+
+        for table, policy in self.config.get("tables", {}).items():
+            if not policy.get("archive"):
+                continue
+
+            row = conn.execute(
+                "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+            if row:
+                # Same columns and primary key as the live table, so archived ids stay unique
+                create_sql = row[0].replace(
+                    f"CREATE TABLE {table}",
+                    f"CREATE TABLE IF NOT EXISTS {self.ARCHIVE_ALIAS}.{table}",
+                    1
+                )
+                conn.execute(create_sql)
+
+                # Archives created before a column was added to the live table
+                archived = set(self._columns(self.ARCHIVE_ALIAS, table))
+                for _, name, column_type, *_ in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+                    if name not in archived:
+                        conn.execute(f"ALTER TABLE {self.ARCHIVE_ALIAS}.{table} ADD COLUMN {name} {column_type}")
+
+        conn.commit()
+        return True
+
+    def _columns(self, schema, table):
+        conn = self.db_connector._get_connection()
+        return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
@@ -0,0 +1,242 @@
+import sys
+import time
+import array
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from config.settings import SERIES_CACHE_CONFIG
+
+class Series:
+    """Recent daily values of one (source, metric_type) in a ring of slots; a day's slot is its ordinal % size"""
+
+    __slots__ = ("days", "values")
+
+    def __init__(self, size):
+        self.days = array.array("l", [0]) * size  # Ordinal of the day held in each slot, 0 if none
+        self.values = array.array("d", [0.0]) * size
+
+    def set(self, ordinal, value):
+        slot = ordinal % len(self.days)
+        # An older day never overwrites a newer one that shares its slot
+        if ordinal >= self.days[slot]:
+            self.days[slot] = ordinal
+            self.values[slot] = value
+
+    def window(self, first, last):
+        """(ordinals, array('d') of values) of the days in [first, last] that have a value"""
+        size = len(self.days)
+        ordinals = []
+        values = array.array("d")
+        for ordinal in range(first, last + 1):
+            slot = ordinal % size
+            if self.days[slot] == ordinal:
+                ordinals.append(ordinal)
+                values.append(self.values[slot])
+        return ordinals, values
+
+    def clear(self, first, last):
+        """Forget the days in [first, last]"""
+        size = len(self.days)
+        for ordinal in range(first, last + 1):
+            if self.days[ordinal % size] == ordinal:
+                self.days[ordinal % size] = 0
+
+    def nbytes(self):
+        return sys.getsizeof(self.days) + sys.getsizeof(self.values)
+
+
+class SeriesCache:
+    """The last few months of sales_metrics, per series, shared by every agent of the process
+
+    Warmed with one bulk read, then kept current from the connector's write hooks on
+    sales_metrics; recent days are re-read every refresh_interval to pick up writes from
+    other processes. Beyond the memory budget, the least recently read series are evicted
+    and reloaded on their next read. Ranges older than the cache holds go to the database.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or SERIES_CACHE_CONFIG
+        self.logger = logging.getLogger("agent.series_cache")
+        self.size = self.config.get("days", 92)
+        self.memory_budget = self.config.get("memory_budget_mb", 16) * 1024 * 1024
+        self.refresh_interval = self.config.get("refresh_interval", 600)
+        self.refresh_days = self.config.get("refresh_days", 3)
+
+        self.series = OrderedDict()  # (source, metric_type) -> Series, least recently read first
+        self.known = set()  # Every key with data, evicted ones included
+        self.nbytes = 0
+        self.warm_from = None  # First ordinal read by warm(); None until warmed
+        self.refreshed_at = 0
+        self.stale = []  # (first, last) ordinals replaced in the database, re-read on the next access
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def warm(self, db_connector):
+        """Load every series for the days the cache holds, in one pass over sales_metrics"""
+        started = time.perf_counter()
+        today = datetime.date.today().toordinal()
+        with self._lock:
+            self.series.clear()
+            self.known.clear()
+            self.nbytes = 0
+            self.warm_from = today - self.size + 1
+            rows = self._load(db_connector, self.warm_from, today)
+            self.refreshed_at = time.time()
+
+        self.logger.info(
+            "Warmed %d series (%d values, %d bytes) in %.3fs",
+            len(self.series), rows, self.nbytes, time.perf_counter() - started
+        )
+        return rows
+
+    def observe(self, columns, rows, replaced=None):
+        """Write hook for sales_metrics: fold newly written (date, source, metric_type, value) rows in"""
+        index = {column: position for position, column in enumerate(columns)}
+        if not {"date", "source", "metric_type", "value"} <= set(index):
+            return
+        with self._lock:
+            if self.warm_from is None:
+                return  # warm() will read them
+            if replaced:
+                # Rows the replace deleted are not among the new ones, so the days are read again
+                self.stale.append((self._ordinal(replaced[0]), self._ordinal(replaced[1])))
+            for row in rows:
+                self._put(
+                    row[index["source"]], row[index["metric_type"]],
+                    self._ordinal(row[index["date"]]), row[index["value"]]
+                )
+            self._evict()
+
+    def keys(self, db_connector):
+        """(source, metric_type) of every series the cache knows of, sorted"""
+        with self._lock:
+            self._ensure_current(db_connector)
+            return sorted(self.known)
+
+    def window(self, db_connector, source, metric_type, start_date, end_date):
+        """(dates, array('d') of values) of one series in [start_date, end_date], in date order"""
+        first, last = self._ordinal(start_date), self._ordinal(end_date)
+        with self._lock:
+            self._ensure_current(db_connector)
+            if self._covers(first):
+                key = (source, metric_type)
+                series = self.series.get(key)
+                if series is None and key in self.known:
+                    # Evicted earlier; bring the whole series back for the next reads, after
+                    # queued writes are committed
+                    self.misses += 1
+                    db_connector.flush()
+                    series = self.series[key] = Series(self.size)
+                    self.nbytes += series.nbytes()
+                    self._load(db_connector, self.warm_from, datetime.date.today().toordinal(), key)
+                if series is None:
+                    return [], array.array("d")
+
+                self.hits += 1
+                self.series.move_to_end(key)
+                ordinals, values = series.window(first, last)
+                return [self._date(ordinal) for ordinal in ordinals], values
+
+        self.misses += 1
+        rows = db_connector.query_range(
+            "sales_metrics", "date, value", start_date, end_date,
+            where="source = ? AND metric_type = ?", params=(source, metric_type),
+            order_by="date ASC", row_mode="tuple"
+        )
+        return [date for date, _ in rows], array.array("d", [value for _, value in rows])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "series": len(self.series),
+                "known": len(self.known),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def _ensure_current(self, db_connector):
+        if self.warm_from is None:
+            self.warm(db_connector)
+            return
+
+        while self.stale:
+            first, last = self.stale.pop()
+            for series in self.series.values():
+                series.clear(first, last)
+            self._load(db_connector, first, last)
+        if time.time() - self.refreshed_at >= self.refresh_interval:
+            today = datetime.date.today().toordinal()
+            self._load(db_connector, today - self.refresh_days + 1, today)
+            self.refreshed_at = time.time()
+
+    def _covers(self, first):
+        # Every day from warm_from on was read or observed; slots older than size days are reused
+        return first >= max(self.warm_from, datetime.date.today().toordinal() - self.size + 1)
+
+    def _load(self, db_connector, first, last, key=None):
+        """Read days [first, last] of one or every series into the cache; returns the number of values"""
+        where = ""
+        params = ()
+        if key is not None:
+            where = "source = ? AND metric_type = ?"
+            params = key
+
+        count = 0
+        # One read per month, so a long cache never attaches more partitions than allowed at once
+        month_start = datetime.date.fromordinal(first)
+        end = datetime.date.fromordinal(last)
+        while month_start <= end:
+            next_month = (month_start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            month_end = min(end, next_month - datetime.timedelta(days=1))
+            for date, source, metric_type, value in db_connector.iter_range(
+                "sales_metrics", "date, source, metric_type, value",
+                month_start.isoformat(), month_end.isoformat(), where=where, params=params
+            ):
+                self._put(source, metric_type, self._ordinal(date), value)
+                count += 1
+            month_start = next_month
+
+        self._evict()
+        return count
+
+    def _put(self, source, metric_type, ordinal, value):
+        key = (source, metric_type)
+        series = self.series.get(key)
+        if series is None:
+            if key in self.known:
+                return  # Evicted; reloaded whole on its next read
+            series = self.series[key] = Series(self.size)
+            self.known.add(key)
+            self.nbytes += series.nbytes()
+        series.set(ordinal, value)
+
+    def _evict(self):
+        # The most recently read series always stays
+        while self.nbytes > self.memory_budget and len(self.series) > 1:
+            _, series = self.series.popitem(last=False)
+            self.nbytes -= series.nbytes()
+            self.evictions += 1
+
+    def _ordinal(self, date):
+        return datetime.date.fromisoformat(date[:10]).toordinal()
+
+    def _date(self, ordinal):
+        return datetime.date.fromordinal(ordinal).isoformat()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def series_cache(db_connector):
+    """The process-wide SeriesCache of a database, hooked into the connector's sales_metrics writes"""
+    with _caches_lock:
+        cache = _caches.get(db_connector.db_path)
+        if cache is None:
+            cache = _caches[db_connector.db_path] = SeriesCache()
+    db_connector.add_write_hook("sales_metrics", cache.observe)
+    return cache
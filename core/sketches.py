@@ -0,0 +1,243 @@
+import math
+import zlib
+import array
+import random
+import struct
+import hashlib
+import logging
+from config.settings import SKETCH_CONFIG
+
+# sketch_type values in sales_sketches
+CLIENTS = "clients"
+ORDER_VALUE = "order_value"
+
+class HyperLogLog:
+    """Distinct-count sketch: 2**precision one-byte registers, mergeable by register-wise max"""
+
+    def __init__(self, precision=None, registers=None):
+        self.precision = precision or SKETCH_CONFIG.get("hll_precision", 12)
+        self.size = 1 << self.precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        # Position of the first 1 bit in the remaining bits, counted from 1
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        """Estimated number of distinct values (about 1.04 / sqrt(2**precision) relative error)"""
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * self.size and zeros:
+            return self.size * math.log(self.size / zeros)
+        return estimate
+
+    def to_bytes(self):
+        # Registers are small numbers, mostly repeated, so they compress well
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data[0], zlib.decompress(data[1:]))
+
+
+class KLLSketch:
+    """Quantile sketch (Karnin-Lang-Liberty): sorted compactors that keep every other item as they fill
+
+    Level h items stand for 2**h inputs. Memory stays around 3k values however many are added,
+    and two sketches merge level by level.
+    """
+
+    HEADER = struct.Struct("<HQB")
+
+    def __init__(self, k=None, compactors=None, n=0):
+        self.k = k or SKETCH_CONFIG.get("kll_k", 200)
+        self.compactors = compactors or [[]]
+        self.n = n
+        self._random = random.Random()
+        self._resize()
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def _resize(self):
+        self.max_size = sum(self._capacity(level) for level in range(len(self.compactors)))
+        self.size = sum(len(compactor) for compactor in self.compactors)
+
+    def add(self, value):
+        self.compactors[0].append(float(value))
+        self.n += 1
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+        return self
+
+    def _compress(self):
+        while self.size >= self.max_size:
+            for level, compactor in enumerate(self.compactors):
+                if len(compactor) >= self._capacity(level):
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                    compactor.sort()
+                    # An odd item out stays behind; the rest are halved, keeping odd or even positions
+                    kept = [compactor.pop()] if len(compactor) % 2 else []
+                    self.compactors[level + 1].extend(compactor[self._random.randint(0, 1)::2])
+                    self.compactors[level] = kept
+                    break
+            self._resize()
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+        self.n += other.n
+        self._resize()
+        self._compress()
+        return self
+
+    def quantiles(self, fractions):
+        """{fraction: value} for fractions in [0, 1]; empty if nothing was added"""
+        weighted = sorted(
+            (value, 1 << level) for level, compactor in enumerate(self.compactors) for value in compactor
+        )
+        if not weighted:
+            return {}
+
+        total = sum(weight for _, weight in weighted)
+        results = {}
+        targets = sorted(fractions)
+        cumulative = 0
+        position = 0
+        for value, weight in weighted:
+            cumulative += weight
+            while position < len(targets) and cumulative >= targets[position] * total:
+                results[targets[position]] = value
+                position += 1
+        for fraction in targets[position:]:
+            results[fraction] = weighted[-1][0]
+        return results
+
+    def to_bytes(self):
+        parts = [self.HEADER.pack(self.k, self.n, len(self.compactors))]
+        parts.append(array.array("I", [len(compactor) for compactor in self.compactors]).tobytes())
+        for compactor in self.compactors:
+            parts.append(array.array("d", compactor).tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        k, n, levels = cls.HEADER.unpack_from(data)
+        offset = cls.HEADER.size
+        lengths = array.array("I")
+        lengths.frombytes(data[offset:offset + levels * lengths.itemsize])
+        offset += levels * lengths.itemsize
+
+        compactors = []
+        for length in lengths:
+            values = array.array("d")
+            values.frombytes(data[offset:offset + length * values.itemsize])
+            offset += length * values.itemsize
+            compactors.append(values.tolist())
+        return cls(k, compactors, n)
+
+
+SKETCH_TYPES = {CLIENTS: HyperLogLog, ORDER_VALUE: KLLSketch}
+
+
+class SketchStore:
+    """Per-(date, source) sketch blobs in sales_sketches, merged on read over any period"""
+
+    def __init__(self, db_connector):
+        self.db_connector = db_connector
+        self.logger = logging.getLogger("agent.sketches")
+
+    def save(self, date, source, sketches, merge=False):
+        """Store {sketch_type: sketch} for a day; merge=True folds them into what is stored"""
+        if merge:
+            stored = self.load(date, date, [source]).get(source, {})
+            for sketch_type, sketch in sketches.items():
+                if sketch_type in stored:
+                    sketch.merge(stored[sketch_type])
+
+        rows = [(date, source, sketch_type, sketch.to_bytes()) for sketch_type, sketch in sketches.items()]
+        return self.db_connector.insert_rows(
+            "sales_sketches", ("date", "source", "sketch_type", "data"), rows,
+            deferred=not merge, update_on=("date", "source", "sketch_type")
+        )
+
+    def load(self, start_date, end_date, sources=None):
+        """{source: {sketch_type: sketch}} merged over every day in [start_date, end_date]"""
+        where = ""
+        params = [start_date, end_date]
+        if sources:
+            where = f"AND source IN ({','.join('?' * len(sources))})"
+            params.extend(sources)
+
+        merged = {}
+        for source, sketch_type, data in self.db_connector.iter_query(f"""
+        SELECT source, sketch_type, data
+        FROM sales_sketches
+        WHERE date >= ? AND date <= ? {where}
+        """, params, row_mode="tuple"):
+            sketch_class = SKETCH_TYPES.get(sketch_type)
+            if sketch_class is None:
+                continue
+            sketch = sketch_class.from_bytes(data)
+            by_type = merged.setdefault(source, {})
+            if sketch_type in by_type:
+                by_type[sketch_type].merge(sketch)
+            else:
+                by_type[sketch_type] = sketch
+        return merged
+
+    def summarize(self, start_date, end_date, quantiles=None):
+        """Distinct clients and order-value quantiles per source and over all sources"""
+        quantiles = quantiles or SKETCH_CONFIG.get("quantiles", [0.5, 0.95, 0.99])
+        by_source = self.load(start_date, end_date)
+
+        totals = {}
+        for sketches in by_source.values():
+            for sketch_type, sketch in sketches.items():
+                if sketch_type in totals:
+                    totals[sketch_type].merge(SKETCH_TYPES[sketch_type].from_bytes(sketch.to_bytes()))
+                else:
+                    totals[sketch_type] = SKETCH_TYPES[sketch_type].from_bytes(sketch.to_bytes())
+
+        def describe(sketches):
+            summary = {}
+            if CLIENTS in sketches:
+                summary["unique_customers"] = round(sketches[CLIENTS].count())
+            if ORDER_VALUE in sketches:
+                summary["order_value_quantiles"] = {
+                    f"p{fraction * 100:g}": round(value, 2)
+                    for fraction, value in sketches[ORDER_VALUE].quantiles(quantiles).items()
+                }
+            return summary
+
+        return {
+            "by_source": {source: describe(sketches) for source, sketches in by_source.items()},
+            "total": describe(totals)
+        }
@@ -0,0 +1,181 @@
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from config.settings import TELEMETRY_CONFIG
+from core.db_connector import BACKLOGS
+from core.topics import TopicBus
+
+# Metric name and owner label of each backlog counted in backlog_counters
+BACKLOG_GAUGES = {
+    "messages": ("agent_messages_unread", "recipient", "Unread messages per recipient"),
+    "tasks": ("agent_tasks_pending", "agent_id", "Pending tasks per agent"),
+    "notifications": ("system_notifications_unacknowledged", "severity", "Unacknowledged notifications")
+}
+
+class Telemetry:
+    """Collects backlog, heartbeat and cycle gauges and renders them in Prometheus text format"""
+
+    def __init__(self, db_connector, scheduler=None):
+        self.db_connector = db_connector
+        self.scheduler = scheduler
+        self.logger = logging.getLogger("agent.telemetry")
+
+    def collect(self):
+        """List of (name, type, help, [(labels, value)]) metric families"""
+        started = time.perf_counter()
+        families = []
+
+        # Depths come from the trigger-maintained counters: one small indexed read
+        depths = {kind: [] for kind in BACKLOG_GAUGES}
+        for kind, owner, depth in self.db_connector.query(
+            "SELECT kind, owner, depth FROM backlog_counters ORDER BY kind, owner", row_mode="tuple"
+        ):
+            if kind in depths:
+                depths[kind].append(({BACKLOG_GAUGES[kind][1]: owner}, depth))
+        for kind, (name, _, help_text) in BACKLOG_GAUGES.items():
+            families.append((name, "gauge", help_text, depths[kind]))
+
+        # MIN over each table's partial backlog index, so this stays a lookup however big the table is
+        oldest = []
+        for kind, table, _, pending, age_column in BACKLOGS:
+            age = self.db_connector.query(
+                f"SELECT (julianday('now') - julianday(MIN({age_column}))) * 86400 "
+                f"FROM {table} WHERE {pending.format(row='')}",
+                row_mode="tuple"
+            )[0][0]
+            oldest.append(({"kind": kind}, age or 0.0))
+        families.append((
+            "agent_backlog_oldest_age_seconds", "gauge", "Age of the oldest unprocessed item", oldest
+        ))
+
+        # Counted past each cursor on the (topic, seq) index, so only unconsumed entries are visited
+        families.append((
+            "topic_consumer_lag", "gauge", "Topic entries not yet acknowledged by a subscriber group",
+            [({"topic": t, "subscriber": s}, lag) for t, s, lag in TopicBus(self.db_connector).lag()]
+        ))
+        families.append((
+            "change_consumer_lag", "gauge", "Change records not yet acknowledged by a CDC consumer",
+            [({"consumer": c}, lag) for c, _, lag in self.db_connector.change_lag()]
+        ))
+
+        heartbeats = self.db_connector.query("""
+        SELECT agent_id, agent_type, status, (julianday('now') - julianday(last_heartbeat)) * 86400
+        FROM agent_registry
+        WHERE status != 'inactive'
+        """, row_mode="tuple")
+        families.append((
+            "agent_heartbeat_age_seconds", "gauge", "Seconds since the agent's last heartbeat",
+            [({"agent_id": a, "agent_type": t, "status": s}, age or 0.0) for a, t, s, age in heartbeats]
+        ))
+
+        if self.scheduler is not None:
+            families.extend(self._cycle_families())
+
+        families.append((
+            "telemetry_collect_seconds", "gauge", "Time taken to collect these metrics",
+            [({}, time.perf_counter() - started)]
+        ))
+        return families
+
+    def _cycle_families(self):
+        """Counters of the agents and jobs run by this process"""
+        cycles, failed, wall, cpu = [], [], [], []
+        for agent in self.scheduler.agents.values():
+            labels = {"agent_id": agent.agent_id, "agent_type": agent.agent_type}
+            totals = agent.cycle_metrics.totals
+            cycles.append((labels, totals["cycles"]))
+            failed.append((labels, totals["failed"]))
+            wall.append((labels, totals["wall"]))
+            cpu.append((labels, totals["cpu"]))
+
+        runs, skipped, running = [], [], []
+        for job in self.scheduler.job_status():
+            labels = {"job": job["name"]}
+            runs.append((labels, job["runs"]))
+            skipped.append((labels, job["skipped"]))
+            running.append((labels, job["running"]))
+
+        return [
+            ("agent_cycles_total", "counter", "Agent cycles run", cycles),
+            ("agent_cycle_failures_total", "counter", "Agent cycles that raised", failed),
+            ("agent_cycle_seconds_total", "counter", "Wall time spent in agent cycles", wall),
+            ("agent_cycle_cpu_seconds_total", "counter", "CPU time spent in agent cycles", cpu),
+            ("scheduler_job_runs_total", "counter", "Scheduled job runs", runs),
+            ("scheduler_job_skipped_total", "counter", "Runs skipped by the catch-up policy or overlap", skipped),
+            ("scheduler_job_running", "gauge", "Runs of a job currently executing", running)
+        ]
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, metric_type, help_text, samples in self.collect():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if labels:
+                    label_text = ",".join(f'{key}="{self._escape(val)}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {float(value)!r}")
+                else:
+                    lines.append(f"{name} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def _escape(self, value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TelemetryServer:
+    """Serves GET /metrics from a daemon thread"""
+
+    def __init__(self, telemetry, host=None, port=None):
+        self.telemetry = telemetry
+        self.host = host or TELEMETRY_CONFIG.get("host", "127.0.0.1")
+        self.port = port if port is not None else TELEMETRY_CONFIG.get("port", 9108)
+        self.logger = logging.getLogger("agent.telemetry")
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        telemetry = self.telemetry
+        logger = self.logger
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            timeout = 10  # A stalled client must not hold the one serving thread
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                try:
+                    body = telemetry.render().encode("utf-8")
+                except Exception as e:
+                    logger.error("Telemetry collection failed: %s", str(e))
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Telemetry request: " + format, *args)
+
+        # Scrapes are served one at a time on this thread, so collection always uses the same
+        # database connection (connections are per thread)
+        self.server = HTTPServer((self.host, self.port), MetricsHandler)
+        self.thread = threading.Thread(target=self._serve, name="telemetry", daemon=True)
+        self.thread.start()
+        self.logger.info("Telemetry endpoint listening on http://%s:%d/metrics", self.host, self.server.server_port)
+
+    def _serve(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.telemetry.db_connector.close()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
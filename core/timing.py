@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+class StartupTimer:
+    """Records how long each startup phase takes and logs a one-line breakdown"""
+
+    def __init__(self):
+        self.logger = logging.getLogger("agent.startup")
+        self.started = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a named phase"""
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - phase_start))
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        """Phase name -> milliseconds, plus the total since the timer was created"""
+        breakdown = {name: round(seconds * 1000, 2) for name, seconds in self.phases}
+        breakdown["total"] = round(self.total() * 1000, 2)
+        return breakdown
+
+    def log_summary(self):
+        parts = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.phases)
+        self.logger.info("Startup timing: %s (total %.1fms)", parts, self.total() * 1000)
+
+
+class CycleMetrics:
+    """Wall and CPU time of an agent's recent cycles and their named phases, in a ring buffer"""
+
+    def __init__(self, size=100):
+        self.cycles = deque(maxlen=size)
+        self._local = threading.local()
+        # Monotonic totals since start, exported as telemetry counters
+        self.totals = {"cycles": 0, "failed": 0, "wall": 0.0, "cpu": 0.0}
+
+    @contextmanager
+    def cycle(self):
+        """Time one cycle; yields its record, which phases entered meanwhile are added to"""
+        record = {"started_at": time.time(), "ok": True, "phases": {}}
+        self._local.current = record
+        wall_start = time.perf_counter()
+        # thread_time only counts this worker thread, not other agents running alongside
+        cpu_start = time.thread_time()
+        try:
+            yield record
+        except Exception:
+            record["ok"] = False
+            raise
+        finally:
+            record["wall"] = time.perf_counter() - wall_start
+            record["cpu"] = time.thread_time() - cpu_start
+            self._local.current = None
+            self.cycles.append(record)
+            self.totals["cycles"] += 1
+            self.totals["failed"] += 0 if record["ok"] else 1
+            self.totals["wall"] += record["wall"]
+            self.totals["cpu"] += record["cpu"]
+
+    @contextmanager
+    def phase(self, name):
+        """Time a named part of the current cycle; a phase entered twice accumulates"""
+        record = getattr(self._local, "current", None)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            if record is not None:
+                wall, cpu = record["phases"].get(name, (0.0, 0.0))
+                record["phases"][name] = (
+                    wall + time.perf_counter() - wall_start,
+                    cpu + time.thread_time() - cpu_start
+                )
+
+    def summary(self):
+        """Averages over the buffered cycles, in milliseconds"""
+        cycles = list(self.cycles)
+        if not cycles:
+            return {"cycles": 0}
+
+        phases = {}
+        for record in cycles:
+            for name, (wall, _) in record["phases"].items():
+                phases.setdefault(name, []).append(wall)
+
+        return {
+            "cycles": len(cycles),
+            "failed": sum(1 for record in cycles if not record["ok"]),
+            "wall_ms_avg": round(sum(r["wall"] for r in cycles) / len(cycles) * 1000, 2),
+            "wall_ms_max": round(max(r["wall"] for r in cycles) * 1000, 2),
+            "cpu_ms_avg": round(sum(r["cpu"] for r in cycles) / len(cycles) * 1000, 2),
+            "phases_ms_avg": {
+                name: round(sum(values) / len(values) * 1000, 2) for name, values in phases.items()
+            }
+        }
@@ -0,0 +1,106 @@
+import time
+import logging
+from config.settings import TOPIC_CONFIG
+from core.message_codec import MessageCodec
+
+class TopicBus:
+    """Publish/subscribe over topic_log: one row per publish, one cursor per subscriber group"""
+
+    def __init__(self, db_connector, codec=None, config=None):
+        self.db_connector = db_connector
+        self.codec = codec or MessageCodec()
+        self.config = config or TOPIC_CONFIG
+        self.logger = logging.getLogger("agent.topics")
+        self.poll_limit = self.config.get("poll_limit", 100)
+        self.segment_size = self.config.get("segment_size", 1000)
+
+    def publish(self, topic, sender_id, message_type, content):
+        """Append one entry to a topic, whatever the number of subscribers; returns its seq"""
+        payload, content_format = self.codec.encode(content, self.db_connector)
+        seq = self.db_connector.execute("""
+        INSERT INTO topic_log (topic, sender_id, message_type, content, content_format)
+        VALUES (?, ?, ?, ?, ?)
+        """, (topic, sender_id, message_type, payload, content_format))
+        self.logger.info("Published %s to topic %s, seq: %s", message_type, topic, seq)
+        return seq
+
+    def subscribe(self, topic, subscriber, from_start=False):
+        """Create a subscriber's cursor at the end of the topic (or before its oldest entry)"""
+        start = "0" if from_start else "(SELECT COALESCE(MAX(seq), 0) FROM topic_log WHERE topic = ?)"
+        params = (topic, subscriber) if from_start else (topic, subscriber, topic)
+        self.db_connector.execute(f"""
+        INSERT INTO topic_subscriptions (topic, subscriber, last_seq)
+        VALUES (?, ?, {start})
+        ON CONFLICT(topic, subscriber) DO NOTHING
+        """, params)
+
+    def poll(self, topic, subscriber, limit=None):
+        """Entries past the subscriber's cursor, oldest first; nothing is consumed until ack"""
+        self.db_connector.flush()  # Cursor updates may still be queued
+        cursor = self.db_connector.query(
+            "SELECT last_seq FROM topic_subscriptions WHERE topic = ? AND subscriber = ?",
+            (topic, subscriber), row_mode="tuple"
+        )
+        if not cursor:
+            self.subscribe(topic, subscriber)
+            return []
+
+        # Range scan on the (topic, seq) index, starting right after the cursor
+        entries = self.db_connector.query("""
+        SELECT seq, sender_id, message_type, content, content_format, published_at
+        FROM topic_log
+        WHERE topic = ? AND seq > ?
+        ORDER BY seq
+        LIMIT ?
+        """, (topic, cursor[0][0], limit or self.poll_limit))
+
+        for entry in entries:
+            entry["content"] = self.codec.decode(
+                entry["content"], entry.pop("content_format"), self.db_connector
+            )
+        return entries
+
+    def ack(self, topic, subscriber, seq):
+        """Advance a subscriber's cursor to seq; a cursor never moves backwards"""
+        self.db_connector.execute("""
+        UPDATE topic_subscriptions
+        SET last_seq = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE topic = ? AND subscriber = ? AND last_seq < ?
+        """, (seq, topic, subscriber, seq))
+
+    def lag(self):
+        """[(topic, subscriber, entries not yet acknowledged)] for every subscription"""
+        return self.db_connector.query("""
+        SELECT s.topic, s.subscriber,
+               (SELECT COUNT(*) FROM topic_log WHERE topic = s.topic AND seq > s.last_seq)
+        FROM topic_subscriptions s
+        ORDER BY s.topic, s.subscriber
+        """, row_mode="tuple")
+
+    def truncate(self):
+        """Drop whole segments every subscriber has consumed, and entries past max_age_days"""
+        removed = 0
+        conn = self.db_connector._get_connection()
+        topics = self.db_connector.query(
+            "SELECT topic, MIN(last_seq) FROM topic_subscriptions GROUP BY topic", row_mode="tuple"
+        )
+
+        for topic, consumed in topics:
+            # Only segments entirely at or below the slowest cursor go
+            boundary = (consumed + 1) // self.segment_size * self.segment_size
+            if boundary:
+                cursor = conn.execute("DELETE FROM topic_log WHERE topic = ? AND seq < ?", (topic, boundary))
+                conn.commit()
+                removed += cursor.rowcount
+
+        # A subscriber that stopped consuming must not pin the log forever
+        max_age = self.config.get("max_age_days")
+        if max_age:
+            cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - max_age * 86400))
+            cursor = conn.execute("DELETE FROM topic_log WHERE published_at < ?", (cutoff,))
+            conn.commit()
+            removed += cursor.rowcount
+
+        if removed:
+            self.logger.info("Truncated %d consumed topic entries", removed)
+        return removed
@@ -0,0 +1,138 @@
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+# Queue item kinds
+_STATEMENT = "statement"
+_BARRIER = "barrier"
+_STOP = "stop"
+
+class WriteBehindQueue:
+    """One writer thread that group-commits queued statements, each isolated by a SAVEPOINT"""
+
+    def __init__(self, db_connector, batch_size=200, batch_delay=0.005, lock_retries=12):
+        self.db_connector = db_connector
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.lock_retries = lock_retries
+        self.logger = logging.getLogger("agent.write_queue")
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.metrics = {"statements": 0, "batches": 0, "failed": 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, query, params=(), many=False):
+        """Queue a write; the future resolves to lastrowid (rowcount if many) once committed"""
+        future = Future()
+        self.start()
+        self._queue.put((_STATEMENT, query, params, many, future))
+        return future
+
+    def flush(self, timeout=None):
+        """Block until everything queued before this call is committed (or has failed)"""
+        if self._thread is None:
+            return True
+        future = Future()
+        self._queue.put((_BARRIER, None, None, None, future))
+        future.result(timeout)
+        return True
+
+    def stop(self, timeout=None):
+        """Commit what is queued, then stop the writer thread"""
+        if self._thread is None:
+            return
+        self._queue.put((_STOP, None, None, None, None))
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_delay
+
+            # Keep collecting until the batch is full, the delay has passed, or a barrier/stop arrives
+            while len(batch) < self.batch_size and batch[-1][0] == _STATEMENT:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            statements = [item for item in batch if item[0] == _STATEMENT]
+            if statements:
+                self._commit(statements)
+
+            for kind, _, _, _, future in batch:
+                if kind == _BARRIER:
+                    future.set_result(True)
+                elif kind == _STOP:
+                    stopping = True
+
+        self.db_connector.close()
+
+    def _commit(self, statements):
+        """Run a batch in one transaction; a failing statement only rolls back its own savepoint"""
+        conn = self.db_connector._get_connection()
+        results = []
+
+        attempt = 0
+        while True:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as e:
+                # Lock still busy after the connection's own timeout. Retried a bounded number of
+                # times, then the batch fails so its callers see an error instead of waiting forever
+                attempt += 1
+                if attempt > self.lock_retries:
+                    self.logger.error("Write batch of %d statements dropped, database stayed locked: %s",
+                                      len(statements), str(e))
+                    self.metrics["failed"] += len(statements)
+                    for item in statements:
+                        item[4].set_exception(e)
+                    return
+                self.logger.warning("Writer waiting for the database lock: %s", str(e))
+                time.sleep(0.05)
+
+        for _, query, params, many, future in statements:
+            conn.execute("SAVEPOINT write_item")
+            try:
+                cursor = conn.executemany(query, params) if many else conn.execute(query, params)
+                conn.execute("RELEASE write_item")
+                results.append((future, cursor.rowcount if many else cursor.lastrowid, None))
+            except Exception as e:
+                conn.execute("ROLLBACK TO write_item")
+                conn.execute("RELEASE write_item")
+                self.logger.error("Queued write failed: %s", str(e))
+                results.append((future, None, e))
+
+        try:
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self.logger.error("Write batch of %d statements failed to commit: %s", len(statements), str(e))
+            results = [(future, None, e) for future, _, _ in results]
+
+        self.metrics["batches"] += 1
+        self.metrics["statements"] += len(statements)
+
+        # Futures resolve only after the commit, so a result always means the write is durable
+        for future, value, error in results:
+            if error is not None:
+                self.metrics["failed"] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(value)
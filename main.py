@@ -1,11 +1,20 @@
 # main.py
 import os
+import signal
 import logging
 import logging.config
 import time
-from config.settings import LOGGING_CONFIG
-from core.db_connector import DBConnector
-from core.agent_scheduler import AgentScheduler
+from core.timing import StartupTimer
+
+startup_timer = StartupTimer()
+
+with startup_timer.phase("imports"):
+    from config.settings import LOGGING_CONFIG, PROFILING_CONFIG, TELEMETRY_CONFIG
+    from core.db_connector import DBConnector
+    from core.agent_scheduler import AgentScheduler
+    from core.coordination import DuplicateAgentError
+    from core.telemetry import Telemetry, TelemetryServer
+    from core.series_cache import series_cache
 
 def main():
     # Ensure logs directory exists
@@ -13,25 +22,53 @@ def main():
     os.makedirs("reports", exist_ok=True)
     
     # Configure logging
-    logging.config.dictConfig(LOGGING_CONFIG)
+    with startup_timer.phase("logging"):
+        logging.config.dictConfig(LOGGING_CONFIG)
     logger = logging.getLogger("agent.main")
     
     # Initialize database connector
-    db_connector = DBConnector()
-    if not db_connector.connect():
+    with startup_timer.phase("database"):
+        db_connector = DBConnector()
+        connected = db_connector.connect()
+    if not connected:
         logger.error("Failed to connect to database. Exiting.")
         return
     
     logger.info("MCP Agent System starting...")
     
+    # One bulk read of recent metrics, shared by every agent from here on
+    with startup_timer.phase("series_cache"):
+        series_cache(db_connector).warm(db_connector)
+    
     # Initialize and start agent scheduler
-    scheduler = AgentScheduler(db_connector)
-    agent_ids = scheduler.initialize_default_agents()
+    with startup_timer.phase("agents"):
+        scheduler = AgentScheduler(db_connector)
+        try:
+            agent_ids = scheduler.initialize_default_agents()
+        except DuplicateAgentError as e:
+            logger.error("%s. Exiting.", str(e))
+            return
     
     logger.info("Initialized agents: %s", agent_ids)
-    scheduler.start_agents()
+    with startup_timer.phase("start"):
+        scheduler.start_agents()
+    
+    # Backlog, heartbeat and cycle metrics for Prometheus, served from a background thread
+    telemetry_server = None
+    if TELEMETRY_CONFIG.get("enabled"):
+        try:
+            telemetry_server = TelemetryServer(Telemetry(db_connector, scheduler))
+            telemetry_server.start()
+        except OSError as e:
+            logger.error("Could not start telemetry endpoint: %s", str(e))
+            telemetry_server = None
+    
+    # kill -USR1 <pid> profiles the next few cycles of the configured agent(s)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: scheduler.request_profile(PROFILING_CONFIG.get("agent")))
     
     logger.info("All agents started. System running...")
+    startup_timer.log_summary()
     
     try:
         # Keep main thread alive
@@ -41,6 +78,12 @@ def main():
         logger.info("Shutdown requested. Stopping agents...")
         for agent_id in agent_ids.values():
             scheduler.stop_agent(agent_id)
+        scheduler.shutdown()
+        db_connector.stop_writer()
+        # Final snapshot of an in-memory database, after the last queued write is committed
+        db_connector.backup()
+        if telemetry_server is not None:
+            telemetry_server.stop()
     
     logger.info("MCP Agent System shutdown complete.")
 